@@ -0,0 +1,30 @@
+import config
+from cache import LruTtlCache, MISSING
+from business_objects.Models import Classroom
+
+#########################################################################################
+# DESCRIPTION
+# read-through process cache of classroom settings, shared by all routes
+# cached Classroom instances are shared between requests, treat them as read-only and
+# go through save_classroom for writes so this process sees the change immediately
+# (other uWSGI processes pick it up when their entry expires)
+#########################################################################################
+
+classroom_cache = LruTtlCache(config.classroom_cache_size, config.classroom_cache_ttl)
+
+
+def get_classroom(class_code):
+    classroom = classroom_cache.get(class_code)
+    if classroom is MISSING:
+        classroom = Classroom.get(Classroom.class_code == class_code)
+        classroom_cache.put(class_code, classroom)
+    return classroom
+
+
+def load_classroom_for_update(class_code):
+    return Classroom.get(Classroom.class_code == class_code)
+
+
+def save_classroom(classroom):
+    classroom.save()
+    classroom_cache.put(classroom.class_code, classroom)
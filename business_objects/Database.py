@@ -0,0 +1,101 @@
+import time
+import weakref
+
+from peewee import MySQLDatabase, SqliteDatabase
+from playhouse.pool import PooledMySQLDatabase, MaxConnectionsExceeded
+
+from request_metrics import current_request_metrics
+
+
+#########################################################################################
+# DESCRIPTION
+# reports every statement executed during a request (count, rows, time) to the request's
+# metrics (request_metrics.py), outside a request it just executes
+#########################################################################################
+
+
+class InstrumentedDatabase:
+
+    def execute_sql(self, sql, params=None, require_commit=True):
+        metrics = current_request_metrics()
+        if metrics is None:
+            return super(InstrumentedDatabase, self).execute_sql(sql, params, require_commit)
+
+        start = time.perf_counter()
+        cursor = super(InstrumentedDatabase, self).execute_sql(sql, params, require_commit)
+        metrics.record_query(time.perf_counter() - start, cursor.rowcount)
+        return cursor
+
+
+class InstrumentedMySQLDatabase(InstrumentedDatabase, MySQLDatabase):
+    pass
+
+
+class InstrumentedSqliteDatabase(InstrumentedDatabase, SqliteDatabase):
+    pass
+
+
+#########################################################################################
+# DESCRIPTION
+# pooled mysql database that keeps track of how long requests take to check out a
+# connection and how many checkouts actually had to open a new connection
+#
+# with a timeout, connect() waits (polling every 0.1s) for a connection to be handed back
+# when max_connections are in use and raises MaxConnectionsExceeded once the timeout has
+# passed, without one it raises right away, the checkout time is the whole connect() call,
+# waiting for a free connection plus opening a new one when none was idle
+#
+# every uWSGI process builds its own pool after it forks (no connection is opened at
+# import time), connect() checks a connection out and close() hands it back to the pool
+# PooledMySQLDatabase already pings idle connections on checkout and drops dead ones
+#########################################################################################
+
+
+class MeteredPooledMySQLDatabase(InstrumentedDatabase, PooledMySQLDatabase):
+
+    def __init__(self, *args, **kwargs):
+        super(MeteredPooledMySQLDatabase, self).__init__(*args, **kwargs)
+        self.__known_connections = weakref.WeakSet()
+        self.__checkouts = 0
+        self.__new_connections = 0
+        self.__timeouts = 0
+        self.__wait_seconds = 0.0
+        self.__max_wait_seconds = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super(MeteredPooledMySQLDatabase, self).connect()
+        except MaxConnectionsExceeded:
+            self.__timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.__wait_seconds += waited
+            self.__max_wait_seconds = max(self.__max_wait_seconds, waited)
+
+    def _connect(self, *args, **kwargs):
+        # called again for every retry while connect() waits, only successful checkouts count
+        conn = super(MeteredPooledMySQLDatabase, self)._connect(*args, **kwargs)
+
+        self.__checkouts += 1
+        if conn not in self.__known_connections:
+            self.__known_connections.add(conn)
+            self.__new_connections += 1
+
+        return conn
+
+    def get_pool_stats(self):
+        return {
+            'checkouts': self.__checkouts,
+            'new_connections': self.__new_connections,
+            'reused_connections': self.__checkouts - self.__new_connections,
+            'timeouts': self.__timeouts,
+            'idle_connections': len(self._connections),
+            'in_use_connections': len(self._in_use),
+            'max_connections': self.max_connections,
+            'wait_seconds_total': self.__wait_seconds,
+            'wait_seconds_max': self.__max_wait_seconds,
+            'wait_seconds_avg': self.__wait_seconds / (self.__checkouts + self.__timeouts)
+            if self.__checkouts + self.__timeouts else 0.0
+        }
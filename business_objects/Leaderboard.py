@@ -0,0 +1,269 @@
+import threading
+import time
+from random import random
+
+import config
+
+#########################################################################################
+# DESCRIPTION
+# per-classroom leaderboards kept in memory as order statistic trees (treaps keyed by
+# (-total_points, user_id)), so point updates, top-N and "my rank +- k" are O(log n)
+#
+# a board is loaded from the users table on first use and updated in place by record_points
+# once a user's new total is saved, and with the requesting user's own saved total on every
+# read, so users always see their own points
+#
+# every uWSGI process holds its own boards: points other users earned through another
+# process only show up when this process reloads the board from the users table (every
+# leaderboard_refresh_interval seconds), until then ranks can differ between processes by
+# whatever was earned elsewhere in that window
+#
+# entries carry points and ranks only, never who the other users are
+#
+# ranks are competition ranks: users with the same points share a rank
+#########################################################################################
+
+
+class RankNode:
+    __slots__ = ('key', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def node_size(node):
+    return node.size if node is not None else 0
+
+
+def update_size(node):
+    node.size = 1 + node_size(node.left) + node_size(node.right)
+
+
+class RankedSet:
+
+    def __init__(self, sorted_keys=()):
+        self.__root = self.__build(sorted_keys)
+
+    def __len__(self):
+        return node_size(self.__root)
+
+    def add(self, key):
+        self.__root = self.__insert(self.__root, RankNode(key))
+
+    def remove(self, key):
+        self.__root = self.__remove(self.__root, key)
+
+    def count_less(self, key):
+        # number of keys strictly smaller than key
+        count = 0
+        node = self.__root
+        while node is not None:
+            if node.key < key:
+                count += node_size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    def select(self, position):
+        # key at 0-based position
+        node = self.__root
+        while node is not None:
+            left_size = node_size(node.left)
+            if position < left_size:
+                node = node.left
+            elif position == left_size:
+                return node.key
+            else:
+                position -= left_size + 1
+                node = node.right
+        raise IndexError(position)
+
+    def slice(self, start, stop):
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        return [self.select(position) for position in range(start, stop)]
+
+    @staticmethod
+    def __build(sorted_keys):
+        # cartesian tree over the sorted keys, O(n) instead of n inserts
+        stack = []
+        for key in sorted_keys:
+            node = RankNode(key)
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+
+        if not stack:
+            return None
+        root = stack[0]
+        RankedSet.__fix_sizes(root)
+        return root
+
+    @staticmethod
+    def __fix_sizes(node):
+        if node is None:
+            return 0
+        node.size = 1 + RankedSet.__fix_sizes(node.left) + RankedSet.__fix_sizes(node.right)
+        return node.size
+
+    @staticmethod
+    def __split(node, key):
+        # (keys < key, keys >= key)
+        if node is None:
+            return None, None
+        if node.key < key:
+            left, right = RankedSet.__split(node.right, key)
+            node.right = left
+            update_size(node)
+            return node, right
+        left, right = RankedSet.__split(node.left, key)
+        node.left = right
+        update_size(node)
+        return left, node
+
+    @staticmethod
+    def __merge(left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = RankedSet.__merge(left.right, right)
+            update_size(left)
+            return left
+        right.left = RankedSet.__merge(left, right.left)
+        update_size(right)
+        return right
+
+    @staticmethod
+    def __insert(node, new_node):
+        if node is None:
+            return new_node
+        if new_node.priority > node.priority:
+            new_node.left, new_node.right = RankedSet.__split(node, new_node.key)
+            update_size(new_node)
+            return new_node
+        if new_node.key < node.key:
+            node.left = RankedSet.__insert(node.left, new_node)
+        else:
+            node.right = RankedSet.__insert(node.right, new_node)
+        update_size(node)
+        return node
+
+    @staticmethod
+    def __remove(node, key):
+        if node is None:
+            return None
+        if node.key == key:
+            return RankedSet.__merge(node.left, node.right)
+        if key < node.key:
+            node.left = RankedSet.__remove(node.left, key)
+        else:
+            node.right = RankedSet.__remove(node.right, key)
+        update_size(node)
+        return node
+
+
+class Leaderboard:
+
+    def __init__(self, users):
+        # users: iterable of (user_id, total_points)
+        self.__points = {}
+        for user_id, total_points in users:
+            self.__points[user_id] = total_points or 0
+        self.__ranking = RankedSet(sorted((-points, user_id) for user_id, points in self.__points.items()))
+        self.__lock = threading.Lock()
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.__ranking)
+
+    def update(self, user_id, total_points):
+        total_points = total_points or 0
+        with self.__lock:
+            old_points = self.__points.get(user_id)
+            if old_points == total_points:
+                return
+            if old_points is not None:
+                self.__ranking.remove((-old_points, user_id))
+            self.__ranking.add((-total_points, user_id))
+            self.__points[user_id] = total_points
+
+    def get_rank(self, user_id):
+        with self.__lock:
+            points = self.__points.get(user_id)
+            if points is None:
+                return None
+            return self.__rank_of_points(points)
+
+    def get_top(self, number, user_id=None):
+        with self.__lock:
+            return [self.__entry(key, user_id) for key in self.__ranking.slice(0, number)]
+
+    def get_around(self, user_id, distance):
+        with self.__lock:
+            points = self.__points.get(user_id)
+            if points is None:
+                return []
+            position = self.__ranking.count_less((-points, user_id))
+            return [
+                self.__entry(key, user_id)
+                for key in self.__ranking.slice(position - distance, position + distance + 1)
+            ]
+
+    def __rank_of_points(self, points):
+        # 1 + number of users with strictly more points
+        return self.__ranking.count_less((-points, '')) + 1
+
+    def __entry(self, key, requesting_user_id):
+        points, user_id = -key[0], key[1]
+        return {
+            'rank': self.__rank_of_points(points),
+            'total_points': points,
+            'is_me': user_id == requesting_user_id
+        }
+
+
+leaderboards = {}
+leaderboards_lock = threading.Lock()
+
+
+def load_leaderboard(class_code):
+    # imported here, the board itself needs no database (testing/test_leaderboard.py)
+    from business_objects.User import User
+
+    users = (User
+             .select(User.user_id, User.total_points)
+             .where(User.class_code == class_code)
+             .tuples()
+             )
+    return Leaderboard(users)
+
+
+def get_leaderboard(class_code):
+    leaderboard = leaderboards.get(class_code)
+    if leaderboard is None or time.monotonic() - leaderboard.loaded_at >= config.leaderboard_refresh_interval:
+        with leaderboards_lock:
+            leaderboard = leaderboards.get(class_code)
+            if leaderboard is None or time.monotonic() - leaderboard.loaded_at >= config.leaderboard_refresh_interval:
+                leaderboard = load_leaderboard(class_code)
+                leaderboards[class_code] = leaderboard
+    return leaderboard
+
+
+def record_points(user):
+    # call once the user's total_points is committed, a rolled back transaction must not show
+    # up on the board, only boards this process already holds are updated, the rest load fresh
+    # when asked for
+    leaderboard = leaderboards.get(user.class_code_id)
+    if leaderboard is not None:
+        leaderboard.update(user.user_id, user.total_points)
@@ -1,6 +1,32 @@
 from peewee import *
 
-database = MySQLDatabase('testdb', **{'password': 'carhorsebatterysuccess', 'user': 'appuser'})
+import config
+from business_objects.Database import MeteredPooledMySQLDatabase, InstrumentedMySQLDatabase, \
+    InstrumentedSqliteDatabase
+
+database_settings = {'password': 'carhorsebatterysuccess', 'user': 'appuser'}
+
+if config.database_engine == 'sqlite':
+    # WAL and a lock timeout so concurrent request threads and the analytics writer can share the file
+    database = InstrumentedSqliteDatabase(config.database_sqlite_path, pragmas=(('journal_mode', 'wal'),),
+                                          timeout=30)
+elif config.database_pooled:
+    database = MeteredPooledMySQLDatabase(
+        'testdb',
+        max_connections=config.database_max_connections,
+        stale_timeout=config.database_stale_timeout,
+        timeout=config.database_pool_timeout,
+        **database_settings
+    )
+else:
+    database = InstrumentedMySQLDatabase('testdb', **database_settings)
+
+
+def random_order():
+    # ORDER BY RAND() on mysql, RANDOM() on the sqlite stand-in
+    if config.database_engine == 'sqlite':
+        return fn.Random()
+    return fn.Rand()
 
 
 class UnknownField(object):
@@ -8,9 +34,20 @@ class UnknownField(object):
 
 
 class BaseModel(Model):
+    # fields left out of get_json_min
+    json_excluded_fields = ()
+
     class Meta:
         database = database
 
+    def get_json_min(self):
+        # pops from a copy, the instance's _data is left alone so it can still be saved
+        # (one C level dict copy beats filtering field by field in python)
+        data = self._data.copy()
+        for name in self.json_excluded_fields:
+            data.pop(name, None)
+        return data
+
 
 class ActivityLogEntry(BaseModel):
     correct = IntegerField()
@@ -35,6 +72,32 @@ class ActivityLogEntry(BaseModel):
         db_table = 'activity_log'
 
 
+class CacheVersion(BaseModel):
+    name = CharField(primary_key=True)
+    version = IntegerField()
+
+    class Meta:
+        db_table = 'cache_versions'
+
+    # version stamps let every process notice that cached data (chapters, rewards, ...) changed
+    @staticmethod
+    def get_version(name):
+        cache_version = CacheVersion.select(CacheVersion.version).where(CacheVersion.name == name).first()
+        if cache_version:
+            return cache_version.version
+        return 0
+
+    @staticmethod
+    def bump(name):
+        updated = (CacheVersion
+                   .update(version=CacheVersion.version + 1)
+                   .where(CacheVersion.name == name)
+                   .execute()
+                   )
+        if not updated:
+            CacheVersion.create(name=name, version=1)
+
+
 class CalcQuestions(BaseModel):
     answer_units = CharField()
     correct_answer = FloatField()
@@ -54,16 +117,6 @@ class Chapter(BaseModel):
     class Meta:
         db_table = 'chapters'
 
-    def get_json_min(self):
-        data = self._data
-
-        key_list = ()
-
-        for key in key_list:
-            data.pop(key, None)
-
-        return data
-
 
 class Classroom(BaseModel):
     class_code = CharField(primary_key=True)
@@ -180,21 +233,13 @@ class QuestLogEntry(BaseModel):
     user_id = CharField(db_column='user_id')
     id = IntegerField(primary_key=True)
 
+    json_excluded_fields = (
+        'class_code',
+    )
+
     class Meta:
         db_table = 'quest_log'
 
-    def get_json_min(self):
-        data = self._data
-
-        key_list = (
-            'class_code'
-        )
-
-        for key in key_list:
-            data.pop(key, None)
-
-        return data
-
 
 class Reward(BaseModel):
     class_code = ForeignKeyField(db_column='class_code', rel_model=Classroom, to_field='class_code')
@@ -203,19 +248,11 @@ class Reward(BaseModel):
     reward_name = CharField()
     id = IntegerField(primary_key=True)
 
+    json_excluded_fields = (
+        "class_code",
+        "id"
+    )
+
     class Meta:
         db_table = 'rewards'
 
-    def get_json_min(self):
-        data = self._data
-
-        key_list = (
-            "class_code",
-            "id"
-        )
-
-        for key in key_list:
-            data.pop(key, None)
-
-        return data
-
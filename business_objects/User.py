@@ -1,8 +1,11 @@
 import datetime
 import math
 
+import config
 from business_objects.Models import *
-from business_objects.questions.MultipleChoiceQuestion import MultipleChoiceQuestion
+from business_objects.ClassroomCache import get_classroom
+from business_objects.questions.MultipleChoiceQuestion import MultipleChoiceQuestion, encode_question_queue, \
+    decode_question_queue
 
 
 class User(BaseModel):
@@ -26,31 +29,35 @@ class User(BaseModel):
     points_earned_current_quest = IntegerField(null=True)
     points_per_question = IntegerField(null=True)
     question_type = IntegerField(null=True)
+    question_queue = TextField(null=True)
     reward_level = IntegerField()
     total_points = IntegerField(null=True)
     user_id = CharField(db_column='user_id', primary_key=True)
     user_role = IntegerField()
-    research_agreement_status = IntegerField()
-
-    def get_json_min(self):
-        data = self._data
-
-        key_list = (
-            'class_code',
-            'current_answer_index',
-            'datetime_quest_started',
-            'datetime_question_started',
-            'e_mail',
-            'user_role'
-        )
+    research_agreement_status = IntegerField(null=True)
+    dailies_complete_count = IntegerField(null=True)
+    dailies_complete_date = DateField(null=True)
 
-        for key in key_list:
-            data.pop(key, None)
+    # classroom memoized for the lifetime of this instance (one request)
+    __classroom = None
 
-        return data
+    json_excluded_fields = (
+        'class_code',
+        'current_answer_index',
+        'datetime_quest_started',
+        'datetime_question_started',
+        'dailies_complete_count',
+        'dailies_complete_date',
+        'e_mail',
+        'question_queue',
+        'user_role'
+    )
 
     class Meta:
         db_table = 'users'
+        # save() is a single UPDATE of the columns assigned since the row was loaded, nothing
+        # at all when none were
+        only_save_dirty = True
 
     #########################################################################################
     # Convenience Methods
@@ -66,9 +73,14 @@ class User(BaseModel):
             self.__start_daily(user_classroom)
         else:
             self.__start_practice(client_choices)
+        self.__fill_question_queue()
 
     def start_new_question(self):
-        new_question = self.__generate_new_question()
+        # the question for the current progress comes from the queue made at quest start,
+        # so resuming serves the same question again
+        new_question = self.__get_queued_question()
+        if new_question is None:
+            new_question = self.__generate_new_question()
         self.current_answer_index = new_question.get_correct_answer_index()
         self.current_question_index = new_question.get_question_index()
         self.datetime_question_started = datetime.datetime.now()
@@ -92,6 +104,7 @@ class User(BaseModel):
         self.points_earned_current_quest = 0
         self.points_per_question = None
         self.question_type = None
+        self.question_queue = None
 
     def update_quest_progress(self):
         self.current_progress += 1
@@ -122,9 +135,47 @@ class User(BaseModel):
         return user_performance
 
     def is_eligible_for_daily(self, user_classroom):
+        dailies_complete = self.get_dailies_complete()
+        dailies_allowed = user_classroom.number_dailies_allowed
+
+        return dailies_allowed >= dailies_complete
+
+    def get_dailies_complete(self):
+        # today's count is kept on the user row, the quest log is only counted for users
+        # that never had the counter set, nothing is written here, record_daily_completion
+        # sets the counter when their next daily completes
+        if self.dailies_complete_date is None:
+            return self.__count_dailies_complete()
+        if self.dailies_complete_date != datetime.date.today():
+            return 0
+
+        return self.dailies_complete_count
+
+    def record_daily_completion(self):
+        # called for a completed daily before its quest log entry is written, saved with the
+        # rest of the user
+        today = datetime.date.today()
+        if self.dailies_complete_date is None:
+            self.dailies_complete_count = self.__count_dailies_complete() + 1
+        elif self.dailies_complete_date == today:
+            self.dailies_complete_count += 1
+        else:
+            self.dailies_complete_count = 1
+        self.dailies_complete_date = today
+
+    def get_classroom(self):
+        if self.__classroom is None or self.__classroom.class_code != self.class_code_id:
+            self.__classroom = get_classroom(self.class_code_id)
+        return self.__classroom
+
+    #########################################################################################
+    # Private Methods
+    #########################################################################################
+
+    def __count_dailies_complete(self):
         day_start = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
         day_end = day_start.replace(hour=23, minute=59, second=59)
-        dailies_complete = (
+        return (
             QuestLogEntry.select()
             .where(
                 QuestLogEntry.user_id == self.user_id,
@@ -133,16 +184,6 @@ class User(BaseModel):
             )
             .count()
         )
-        dailies_allowed = user_classroom.number_dailies_allowed
-
-        return dailies_allowed >= dailies_complete
-
-    def get_classroom(self):
-        return Classroom.get(Classroom.class_code == self.class_code)
-
-    #########################################################################################
-    # Private Methods
-    #########################################################################################
 
     def __increment_multiplier(self, user_classroom):
         if self.multiplier < user_classroom.max_multiplier:
@@ -157,6 +198,27 @@ class User(BaseModel):
 
         return new_question
 
+    def __fill_question_queue(self):
+        question_queue = MultipleChoiceQuestion().make_question_queue(
+            chapter_index=self.chapter_index_id,
+            number_of_questions=self.number_of_questions,
+            cumulative=self.cumulative,
+            question_type=1
+        )
+        self.question_queue = encode_question_queue(question_queue)
+
+    def __get_queued_question(self):
+        # quests started before the queue existed have none, those generate as they go, so do
+        # queued questions whose choices have been removed from the bank since
+        question_queue = decode_question_queue(self.question_queue)
+        if self.current_progress >= len(question_queue):
+            return None
+
+        return MultipleChoiceQuestion().load_queued_question(
+            self.chapter_index_id,
+            question_queue[self.current_progress]
+        )
+
     def __start_daily(self, user_classroom):
 
         self.datetime_quest_started = datetime.datetime.now()
@@ -181,6 +243,10 @@ class User(BaseModel):
         cumulative = client_choices['cumulative']
         question_type = client_choices['question_type']
 
+        # the whole quest is generated and stored at start, only the lengths the client offers
+        if number_of_questions not in config.number_of_question_options:
+            raise ValueError('number_of_questions must be one of {}'.format(config.number_of_question_options))
+
         points_per_question = 10
         if is_timed:
             points_per_question += 3
@@ -1,7 +1,7 @@
-from random import shuffle, randint
-from peewee import fn
+from random import shuffle, randint, choice
 
 from config import *
+from business_objects.Models import random_order
 from business_objects.Models import Definition as Definition
 from business_objects.Models import Word as Word
 
@@ -29,57 +29,68 @@ class DefinitionQuestion:
         if cumulative:
             chapter_index = randint(1, chapter_index)
 
-        query = (Word
-                 .select()
-                 .where(Word.chapter_index == chapter_index)
-                 .order_by(fn.Rand())
-                 .limit(number_of_multiple_choices)
-                 )
-
+        # at most two queries: the random words, then every definition of those words
+        # only words with at least one definition, the answer word always needs one and a
+        # distractor without one would leave a choice out
+        words = list(Word
+                     .select(Word.word_index, Word.word)
+                     .where(
+                         (Word.chapter_index == chapter_index) &
+                         (Word.word_index << Definition.select(Definition.word_index))
+                     )
+                     .order_by(random_order())
+                     .limit(number_of_multiple_choices)
+                     .tuples()
+                     )
+        if not words:
+            raise Word.DoesNotExist('no words for chapter {}'.format(chapter_index))
+
+        word_indexes = [word_index for word_index, _ in words]
+        if self.__question_type == 0:
+            # only the definition of the word being asked about is needed
+            word_indexes = word_indexes[:1]
+
+        definitions = {}
+        for word_index, definition in (Definition
+                                       .select(Definition.word_index, Definition.definition)
+                                       .where(Definition.word_index << word_indexes)
+                                       .tuples()
+                                       ):
+            definitions.setdefault(word_index, []).append(definition)
+
+        answer_word_index, answer_word = words[0]
+
+        # question type 1 is word prompt with definition choices
         if self.__question_type == 1:
 
             definition_list = []
-            for word in query:
-                raw_definition = (Definition
-                                  .select()
-                                  .where(Definition.word_index == word.get_question_index)
-                                  .order_by(fn.Rand())
-                                  .limit(1)
-                                  )[0]
+            for word_index, _ in words:
                 definition = {
-                    "text": raw_definition.definition,
-                    "index": word.get_question_index
+                    "text": choice(definitions[word_index]),
+                    "index": word_index
                 }
                 definition_list.append(definition)
 
             self.__answer_choices = definition_list
-            self.__question_text = query[0].word
+            self.__question_text = answer_word
 
         # question type 0 is definition prompt with word choices
         elif self.__question_type == 0:
 
             word_list = []
-            for element in query:
+            for word_index, word_text in words:
                 word = {
-                    "text": element.word,
-                    "index": element.get_question_index
+                    "text": word_text,
+                    "index": word_index
                 }
                 word_list.append(word)
 
-            raw_definition = (Definition
-                              .select()
-                              .where(Definition.word_index == query[0].get_question_index)
-                              .order_by(fn.Rand())
-                              .limit(1)
-                              )[0]
-
             self.__answer_choices = word_list
-            self.__question_text = raw_definition.definition
+            self.__question_text = choice(definitions[answer_word_index])
 
-        self.__word_index = query[0].get_question_index
+        self.__word_index = answer_word_index
         shuffle(self.__answer_choices)
 
-
         return self
 
     def get_json_min(self):
@@ -104,84 +115,3 @@ class DefinitionQuestion:
 
     def question_type(self):
         return self.__question_type
-
-def unit_test():
-    print("Starting unit test")
-    Test_Result = True
-    definition_question = MultipleChoiceQuestion()
-    test_question_1 = definition_question.make_definition_question(
-        1,
-        question_type=2
-    )
-    jsonified_text = test_question_1.get_json_min()
-    test_result = valid_json_object(jsonified_text)
-    if not test_result:
-        print("Unit test part 1 failed, generic random question failed")
-        Test_Result = False
-
-    test_question_2 = definition_question.make_definition_question(
-        1,
-        question_type=0
-    )
-    jsonified_text = test_question_2.get_json_min()
-    test_result = valid_json_object(jsonified_text)
-    if not test_result:
-        print("Unit test part 2 failed, generic question type 0 failed")
-        Test_Result = False
-
-    test_question_3 = definition_question.make_definition_question(
-        1,
-        question_type=1
-    )
-    jsonified_text = test_question_3.get_json_min()
-    test_result = valid_json_object(jsonified_text)
-    if not test_result:
-        print("Unit test part 2 failed, generic question type 1 failed")
-        Test_Result = False
-
-    test_question_4 = definition_question.make_definition_question(
-        1,
-        question_type=2,
-        cumulative=True
-    )
-    jsonified_text = test_question_4.get_json_min()
-    test_result = valid_json_object(jsonified_text)
-    if not test_result:
-        print("Unit test part 1 failed, generic random question failed")
-        Test_Result = False
-
-    test_question_5 = definition_question.make_definition_question(
-        1,
-        question_type=0,
-        cumulative=True
-    )
-    jsonified_text = test_question_5.get_json_min()
-    test_result = valid_json_object(jsonified_text)
-    if not test_result:
-        print("Unit test part 2 failed, generic question type 0 failed")
-        Test_Result = False
-
-    test_question_6 = definition_question.make_definition_question(
-        1,
-        question_type=1,
-        cumulative=True
-    )
-    jsonified_text = test_question_6.get_json_min()
-    test_result = valid_json_object(jsonified_text)
-    if not test_result:
-        print("Unit test part 2 failed, generic question type 1 failed")
-        Test_Result = False
-
-    if Test_Result:
-        print("SUCCESS: Unit test for Definition Question complete")
-
-
-def valid_json_object(json_object):
-    assert json_object["prompt"]
-    assert json_object["answers"]
-    assert json_object["chapter_index"]
-    assert json_object["question_type"] is not None
-    return True
-
-if __name__ == "__main__":
-    unit_test()
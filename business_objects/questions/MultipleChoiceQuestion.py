@@ -1,9 +1,38 @@
-from random import shuffle, randint
-from peewee import fn
+from random import shuffle, randint, sample
 
 from config import *
 from business_objects.Models import McPrompt as Prompt
 from business_objects.Models import McChoice as Choice
+from business_objects.Models import random_order
+from business_objects.questions.QuestionIndex import question_index
+
+#########################################################################################
+# a quest's questions are generated up front and stored on the user as a compact string:
+# one "prompt_index:correct_choice_index:choice,choice,..." entry per question (choices
+# already in display order), entries separated by "|"
+#########################################################################################
+
+
+def encode_question_queue(entries):
+    return '|'.join(
+        '{}:{}:{}'.format(prompt_index, correct_index, ','.join(str(choice) for choice in choice_ids))
+        for prompt_index, correct_index, choice_ids in entries
+    )
+
+
+def decode_question_queue(encoded_queue):
+    entries = []
+    if not encoded_queue:
+        return entries
+
+    for encoded_entry in encoded_queue.split('|'):
+        prompt_index, correct_index, choice_ids = encoded_entry.split(':')
+        entries.append((
+            int(prompt_index),
+            int(correct_index),
+            [int(choice) for choice in choice_ids.split(',')]
+        ))
+    return entries
 
 
 class MultipleChoiceQuestion:
@@ -17,21 +46,183 @@ class MultipleChoiceQuestion:
             self,
             chapter_index,
             cumulative=False,
-            question_type=0
+            question_type=0,
+            exclude=()
     ):
         self.__chapter_index = chapter_index
         self.__answer_choices = []
+        chapter_index = self.__pick_chapter(chapter_index, cumulative)
+
+        if multiple_choice_source == "index":
+            self.__pick_from_index(chapter_index, question_type, exclude)
+        elif multiple_choice_source == "batched":
+            self.__pick_from_batched_query(chapter_index, question_type, exclude)
+        else:
+            self.__pick_from_query(chapter_index, question_type, exclude)
+
+        shuffle(self.__answer_choices)
+
+        return self
+
+    def make_question_queue(
+            self,
+            chapter_index,
+            number_of_questions,
+            cumulative=False,
+            question_type=0
+    ):
+        # every question of the quest in one go, no prompt is repeated while the bank allows it
+        used_prompts = set()
+        entries = []
+
+        if multiple_choice_source == "index":
+            # entirely in memory, texts are only fetched when a question is served
+            question_index.refresh()
+            for _ in range(number_of_questions):
+                prompt_index, _, correct_index, distractor_ids = question_index.pick(
+                    self.__pick_chapter(chapter_index, cumulative),
+                    question_type,
+                    number_of_multiple_choices-1,
+                    used_prompts
+                )
+                choice_ids = [correct_index] + distractor_ids
+                shuffle(choice_ids)
+                used_prompts.add(prompt_index)
+                entries.append((prompt_index, correct_index, choice_ids))
+        else:
+            for _ in range(number_of_questions):
+                try:
+                    self.make_multiple_choice(chapter_index, cumulative, question_type, used_prompts)
+                except (Prompt.DoesNotExist, Choice.DoesNotExist):
+                    # the bank ran out of unused prompts, allow repeats
+                    self.make_multiple_choice(chapter_index, cumulative, question_type)
+                used_prompts.add(self.__question_index)
+                entries.append(self.get_queue_entry())
+
+        return entries
+
+    def load_queued_question(self, chapter_index, entry):
+        prompt_index, correct_index, choice_ids = entry
+        self.__chapter_index = chapter_index
+        self.__question_index = prompt_index
+        self.__correct_choice_index = correct_index
+
+        # prompt text and every choice text in one round trip
+        rows = (Choice
+                .select(Choice.index, Choice.text, Prompt.text)
+                .join(Prompt, on=(Choice.question_index == Prompt.index))
+                .where(Choice.index << choice_ids)
+                .tuples()
+                )
+
+        choices = {}
+        for choice_index, choice_text, prompt_text in rows:
+            self.__question_text = prompt_text
+            choices[choice_index] = {
+                'text': choice_text,
+                'index': choice_index
+            }
+
+        if any(choice_index not in choices for choice_index in choice_ids):
+            # a choice was removed from the bank since the quest started, the caller generates
+            # a new question instead
+            return None
+
+        self.__answer_choices = [choices[choice_index] for choice_index in choice_ids]
+
+        return self
+
+    def get_queue_entry(self):
+        return (
+            self.__question_index,
+            self.__correct_choice_index,
+            [choice['index'] for choice in self.__answer_choices]
+        )
+
+    def __pick_chapter(self, chapter_index, cumulative):
         if cumulative:
             if randint(0, 1) == 0:
-                chapter_index = randint(1, chapter_index)
+                return randint(1, chapter_index)
+        return chapter_index
+
+    def __pick_from_index(self, chapter_index, question_type, exclude):
+        question_index.refresh()
+        prompt_index, prompt_text, correct_choice_index, distractor_ids = question_index.pick(
+            chapter_index,
+            question_type,
+            number_of_multiple_choices-1,
+            exclude
+        )
+
+        self.__question_index = prompt_index
+        self.__question_text = prompt_text
+        self.__correct_choice_index = correct_choice_index
 
+        # one primary key lookup for the texts of the handful of choices that were picked
+        choices = {
+            choice.get_index(): choice
+            for choice in Choice.select(Choice.index, Choice.text).where(
+                Choice.index << ([correct_choice_index] + distractor_ids))
+        }
+        self.__answer_choices.append(choices[correct_choice_index].get_json_min())
+        for distractor_id in distractor_ids:
+            self.__answer_choices.append(choices[distractor_id].get_json_min())
+
+    def __pick_from_batched_query(self, chapter_index, question_type, exclude):
+        # a single round trip: the random prompt joined with all of its choices,
+        # partitioned and sampled here instead of in two more queries
+        random_prompt = (Prompt
+                         .select(Prompt.index, Prompt.text)
+                         .where(Prompt.chapter_index == chapter_index,
+                                Prompt.type == question_type)
+                         .order_by(random_order())
+                         .limit(1)
+                         )
+        if exclude:
+            random_prompt = random_prompt.where(Prompt.index.not_in(list(exclude)))
+        random_prompt = random_prompt.alias('random_prompt')
+
+        rows = (Choice
+                .select(random_prompt.c.index, random_prompt.c.text, Choice.index, Choice.text, Choice.correct)
+                .join(random_prompt, on=(Choice.question_index == random_prompt.c.index))
+                .order_by(Choice.index)
+                .tuples()
+                )
+
+        correct_choices = []
+        incorrect_choices = []
+        for prompt_index, prompt_text, choice_index, choice_text, correct in rows:
+            self.__question_index = prompt_index
+            self.__question_text = prompt_text
+            choice = {
+                'text': choice_text,
+                'index': choice_index
+            }
+            if correct:
+                correct_choices.append(choice)
+            else:
+                incorrect_choices.append(choice)
+
+        if not correct_choices:
+            raise Choice.DoesNotExist(
+                'no correct choice for chapter {} type {}'.format(chapter_index, question_type))
+
+        # same as Choice.get in the query path: the first correct choice
+        self.__answer_choices.append(correct_choices[0])
+        self.__correct_choice_index = correct_choices[0]['index']
+        self.__answer_choices.extend(
+            sample(incorrect_choices, min(number_of_multiple_choices-1, len(incorrect_choices))))
+
+    def __pick_from_query(self, chapter_index, question_type, exclude):
         question = (Prompt
                     .select()
                     .where(Prompt.chapter_index == chapter_index,
                            Prompt.type == question_type)
-                    .order_by(fn.Rand())
-                    .get()
+                    .order_by(random_order())
                     )
+        if exclude:
+            question = question.where(Prompt.index.not_in(list(exclude)))
+        question = question.get()
 
         self.__question_index = question.get_index()
         self.__question_text = question.get_prompt_text()
@@ -43,17 +234,13 @@ class MultipleChoiceQuestion:
         incorrect_choices = (Choice
                              .select()
                              .where(Choice.question_index == question, Choice.correct == False)
-                             .order_by(fn.Rand())
+                             .order_by(random_order())
                              .limit(number_of_multiple_choices-1)
                              )
 
         for incorrect_choice in incorrect_choices:
             self.__answer_choices.append(incorrect_choice.get_json_min())
 
-        shuffle(self.__answer_choices)
-
-        return self
-
     def get_json_min(self):
         return {
             "prompt": self.__question_text,
@@ -0,0 +1,123 @@
+import threading
+import time
+from random import choice, sample
+
+from peewee import fn
+
+from config import *
+from business_objects.Models import McPrompt as Prompt
+from business_objects.Models import McChoice as Choice
+from business_objects.Models import CacheVersion
+
+
+#########################################################################################
+# DESCRIPTION
+# read-only, in-memory index of the multiple choice bank grouped by (chapter_index, type)
+# picking a prompt and its distractors is random sampling over python lists instead of
+# ORDER BY RAND() over mc_prompts and mc_choices
+#
+# each entry is (prompt_index, prompt_text, correct_choice_ids, incorrect_choice_ids),
+# choice texts stay in the database and are fetched by primary key for the few ids picked
+#
+# call refresh() before pick(): the index is loaded lazily (after uWSGI forks) and reloaded
+# when a cheap signature of the bank (row counts, max ids and the "question_bank" version
+# stamp) changes, checked at most every question_index_refresh_interval seconds
+#########################################################################################
+
+
+class QuestionIndex:
+
+    def __init__(self):
+        self.__groups = None
+        self.__signature = None
+        self.__checked_at = 0
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def build_groups(prompt_rows, choice_rows):
+        correct_ids = {}
+        incorrect_ids = {}
+        for choice_index, prompt_index, correct in choice_rows:
+            if correct:
+                correct_ids.setdefault(prompt_index, []).append(choice_index)
+            else:
+                incorrect_ids.setdefault(prompt_index, []).append(choice_index)
+
+        groups = {}
+        for prompt_index, chapter_index, question_type, text in prompt_rows:
+            if prompt_index not in correct_ids:
+                # a prompt without a correct answer can never be served
+                continue
+            groups.setdefault((chapter_index, question_type), []).append((
+                prompt_index,
+                text,
+                tuple(sorted(correct_ids[prompt_index])),
+                tuple(incorrect_ids.get(prompt_index, ()))
+            ))
+
+        return groups
+
+    @staticmethod
+    def bank_signature():
+        prompts = Prompt.select(fn.COUNT(Prompt.index), fn.MAX(Prompt.index)).scalar(as_tuple=True)
+        choices = Choice.select(fn.COUNT(Choice.index), fn.MAX(Choice.index)).scalar(as_tuple=True)
+        # bumped by the importer when it changes rows in place, which counts and ids don't show
+        return tuple(prompts) + tuple(choices) + (CacheVersion.get_version('question_bank'),)
+
+    def load(self, prompt_rows=None, choice_rows=None):
+        if prompt_rows is None:
+            prompt_rows = (Prompt
+                           .select(Prompt.index, Prompt.chapter_index, Prompt.type, Prompt.text)
+                           .tuples())
+        if choice_rows is None:
+            choice_rows = (Choice
+                           .select(Choice.index, Choice.question_index, Choice.correct)
+                           .tuples())
+
+        self.__groups = self.build_groups(prompt_rows, choice_rows)
+
+    def invalidate(self):
+        # forces a signature check (and reload) on the next refresh
+        with self.__lock:
+            self.__signature = None
+            self.__checked_at = 0
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.__groups is not None and now - self.__checked_at < question_index_refresh_interval:
+            return
+
+        with self.__lock:
+            if self.__groups is not None and now - self.__checked_at < question_index_refresh_interval:
+                return
+            signature = self.bank_signature()
+            if self.__groups is None or signature != self.__signature:
+                self.load()
+                self.__signature = signature
+            self.__checked_at = now
+
+    def pick(self, chapter_index, question_type, number_of_incorrect, exclude=()):
+        prompts = self.__groups.get((chapter_index, question_type))
+        if not prompts:
+            raise Prompt.DoesNotExist(
+                'no prompts for chapter {} type {}'.format(chapter_index, question_type))
+
+        entry = choice(prompts)
+        if exclude and entry[0] in exclude:
+            # only scan the group when the random pick collides, repeats are allowed once it is used up
+            remaining = [prompt for prompt in prompts if prompt[0] not in exclude]
+            if remaining:
+                entry = choice(remaining)
+
+        prompt_index, text, correct_ids, incorrect_ids = entry
+        distractor_ids = sample(incorrect_ids, min(number_of_incorrect, len(incorrect_ids)))
+
+        return prompt_index, text, correct_ids[0], distractor_ids
+
+    def size(self):
+        if self.__groups is None:
+            return 0
+        return sum(len(prompts) for prompts in self.__groups.values())
+
+
+question_index = QuestionIndex()
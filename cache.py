@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+# returned by get() so that a cached None (negative caching) can be told apart from a miss
+MISSING = object()
+
+
+#########################################################################################
+# DESCRIPTION
+# in-process cache bounded by size (least recently used entry is evicted first)
+# where every entry also carries its own expiry time
+#
+# each uWSGI process keeps its own copy, so only cache things that are safe to be
+# slightly stale or that are explicitly invalidated in every process
+#########################################################################################
+
+
+class LruTtlCache:
+
+    def __init__(self, max_size, default_ttl=None):
+        self.__max_size = max_size
+        self.__default_ttl = default_ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__expirations = 0
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__misses += 1
+                return MISSING
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.__entries[key]
+                self.__expirations += 1
+                self.__misses += 1
+                return MISSING
+
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.__default_ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+
+        with self.__lock:
+            self.__entries[key] = (value, expires_at)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def invalidate(self, key=None):
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+
+    def stats(self):
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'size': len(self.__entries),
+                'max_size': self.__max_size,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'expirations': self.__expirations,
+                'hit_ratio': self.__hits / lookups if lookups else 0.0
+            }
+
+
+#########################################################################################
+# DESCRIPTION
+# a single cached value that is reloaded when its version stamp changes
+# the version is looked up at most every check_interval seconds, so writers in other
+# processes (the db_scripts loaders, other uWSGI workers) invalidate it by bumping the stamp
+#########################################################################################
+
+
+class VersionedCache:
+
+    def __init__(self, load, get_version, check_interval):
+        self.__load = load
+        self.__get_version = get_version
+        self.__check_interval = check_interval
+        self.__value = MISSING
+        self.__version = None
+        self.__checked_at = 0
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__reloads = 0
+
+    def get(self):
+        value = self.__value
+        if value is not MISSING and time.monotonic() - self.__checked_at < self.__check_interval:
+            self.__hits += 1
+            return value
+
+        with self.__lock:
+            now = time.monotonic()
+            if self.__value is MISSING or now - self.__checked_at >= self.__check_interval:
+                version = self.__get_version()
+                if self.__value is MISSING or version != self.__version:
+                    self.__value = self.__load()
+                    self.__version = version
+                    self.__reloads += 1
+                else:
+                    self.__hits += 1
+                self.__checked_at = now
+            else:
+                self.__hits += 1
+            return self.__value
+
+    def invalidate(self):
+        with self.__lock:
+            self.__value = MISSING
+
+    def stats(self):
+        return {
+            'hits': self.__hits,
+            'reloads': self.__reloads,
+            'version': self.__version
+        }
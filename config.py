@@ -26,3 +26,92 @@ question_types = [
         "index": 0
     }
 ]
+
+# auth0 tokeninfo endpoint, only hit when the verified jwt is missing identity claims
+auth0_tokeninfo_endpoint = "https://zhl146.auth0.com/tokeninfo"
+
+# tokeninfo responses are cached per bearer token until the jwt expires (capped at the max ttl)
+token_info_cache_size = 2048
+token_info_cache_max_ttl = 3600
+# failed lookups are remembered briefly so a bad token can't hammer auth0
+token_info_negative_ttl = 5
+
+# pooled database connections instead of a new mysql handshake on every request
+# every uWSGI process keeps its own pool, so processes * database_max_connections
+# has to stay below mysql's max_connections, one connection per request thread
+# (threads in exbookapp.ini) plus the analytics writer's
+database_pooled = True
+database_max_connections = 5
+# idle connections older than this (seconds) are closed instead of reused
+database_stale_timeout = 300
+# seconds a request waits for a free pooled connection when all database_max_connections
+# are in use before it fails (MaxConnectionsExceeded), 0 waits forever
+database_pool_timeout = 5
+# "mysql", or "sqlite" for a local stand-in database (the load test in testing/load_test.py)
+database_engine = "mysql"
+database_sqlite_path = "/tmp/exbook-load-test.db"
+
+# where multiple choice questions are picked from
+# "index": in-memory question index
+# "batched": one query joining a random prompt with all of its choices
+# "query": ORDER BY RAND() queries for the prompt, correct choice and incorrect choices
+multiple_choice_source = "index"
+# seconds between checks of whether the question bank changed
+question_index_refresh_interval = 60
+
+# seconds between checks of the cache_versions stamps for cached chapters/rewards
+cache_version_check_interval = 30
+
+# classroom settings are cached per process for a short time
+classroom_cache_size = 256
+classroom_cache_ttl = 30
+
+# analytics rows (locations, activity log) are written by a background thread
+# in batches, set to False to write them inside the request again
+analytics_writer_enabled = True
+analytics_batch_size = 200
+# seconds the writer waits to fill a batch
+analytics_flush_interval = 2.0
+analytics_queue_size = 10000
+# seconds a request waits on a full queue before its row goes to the spill file
+analytics_enqueue_timeout = 0.05
+# rows the database could not take, one "<path>.<pid>" file per process
+analytics_spill_path = '/var/log/exbook/analytics-spill'
+# seconds between attempts to replay spilled rows
+analytics_replay_interval = 60
+
+# coalesce mc_choices.times_chosen increments in memory and write them with the analytics batches
+answer_choice_buffering = True
+
+# parsed device info per distinct user agent string
+user_agent_cache_size = 1024
+
+# json encoder for api responses: "auto" (orjson if installed), "orjson" or "stdlib"
+json_encoder = "auto"
+# "http" writes datetimes like flask's jsonify, "iso" uses iso 8601 (native and faster with orjson)
+json_datetime_format = "http"
+
+# leaderboards are kept per process and reloaded from the users table this often (seconds),
+# the longest points earned through another process take to show up on this process's board
+leaderboard_refresh_interval = 60
+# most entries a leaderboard request can ask for (top and around me each)
+leaderboard_max_entries = 50
+
+# per-request query counts and timings (request_metrics.py)
+# Server-Timing / X-Query-Count / X-Row-Count headers, None adds them only while app.debug is on
+# (start_flask), True or False overrides that
+request_metrics_header = None
+# one json log line per request on the "exbook.request_metrics" logger
+request_metrics_log = True
+# only log requests that took at least this long (ms), 0 logs every request
+request_metrics_log_min_ms = 0
+
+# prometheus /metrics (metrics.py), every uWSGI process writes its counters to its own file
+# in this directory and a scrape of any process sums them (and folds exited processes' files into one)
+metrics_directory = '/var/log/exbook/metrics'
+# seconds between writes of a process's file (it is also written at exit and on every scrape)
+metrics_flush_interval = 5
+# upper bounds (seconds) of the request latency histogram buckets
+metrics_latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# clients allowed to scrape /metrics (REMOTE_ADDR, the client address nginx passes on)
+metrics_allowed_addresses = ('127.0.0.1',)
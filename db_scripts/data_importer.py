@@ -1,54 +1,54 @@
 import json
 from business_objects.User import *
+from question_bank_importer import QuestionBankImporter, insert_batched
+from json_stream import read_book_chapters
 
 
 class_code = 'A1B2C3D4E5'
 
-with open('definitions.json') as definitions_file:
-    definitions_json = json.load(definitions_file)
-
 with open('rewards.json') as rewards:
     rewards_json = json.load(rewards)
 
-question_index = 0
-
-for chapter in definitions_json['book']:
-    chapter_index = chapter['index']
-    chapter_name = chapter['name']
-    Chapter.create(chapter_index=chapter_index, chapter_name=chapter_name)
-    for question in chapter['questions']:
-        question_text = question['question_text']
-        McPrompt.create(index=question_index, text=question_text, chapter_index=chapter_index, type=1)
-        for correct_answer in question['correct_answers']:
-            McChoice.create(
-                question_index=question_index,
-                text=correct_answer,
-                correct=True
-            )
-        for incorrect_answer in question['incorrect_answers']:
-            McChoice.create(
-                question_index=question_index,
-                text=incorrect_answer,
-                correct=False
-            )
-        question_index += 1
-
-Classroom.create(
-    class_code=class_code,
-    current_chapter=4,
-    number_dailies_allowed=3,
-    max_multiplier=5,
-    daily_exp_base=30,
-    daily_point_value=10000,
-    daily_number_of_questions=25,
-    registration_open=1
-)
-
-for reward in rewards_json['rewards']:
-    Reward.create(
-        class_code=class_code,
-        reward_name=reward['reward_name'],
-        reward_description=reward['reward_description'],
-        required_points=reward['required_points']
+# safe to run again, existing chapters, prompts and choices are matched instead of duplicated
+# the definitions file is streamed a chapter and question at a time
+with open('definitions.json') as definitions_file:
+    importer_stats = QuestionBankImporter(batch_size=200, question_type=1).run(read_book_chapters(definitions_file))
+print("imported {chapters} chapters, {prompts} prompts, {choices} choices "
+      "({updated} updated, {unchanged} unchanged) in {seconds:.2f}s, {rows_per_second:.0f} rows/sec"
+      .format(**importer_stats))
+
+with database.atomic():
+    if not Classroom.select().where(Classroom.class_code == class_code).exists():
+        Classroom.create(
+            class_code=class_code,
+            current_chapter=4,
+            number_dailies_allowed=3,
+            max_multiplier=5,
+            daily_exp_base=30,
+            daily_point_value=10000,
+            daily_number_of_questions=25,
+            registration_open=1
+        )
+
+    existing_rewards = set(
+        reward_name for reward_name, in Reward
+        .select(Reward.reward_name)
+        .where(Reward.class_code == class_code)
+        .tuples()
     )
-
+    insert_batched(Reward, [
+        {
+            'class_code': class_code,
+            'reward_name': reward['reward_name'],
+            'reward_description': reward['reward_description'],
+            'required_points': reward['required_points']
+        }
+        for reward in rewards_json['rewards']
+        if reward['reward_name'] not in existing_rewards
+    ], batch_size=200)
+
+# let the running api processes reload their cached chapter list, question index and rewards
+CacheVersion.bump('chapters')
+if importer_stats['updated']:
+    CacheVersion.bump('question_bank')
+CacheVersion.bump('rewards:{}'.format(class_code))
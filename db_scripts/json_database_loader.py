@@ -1,23 +1,44 @@
-import json
 from business_objects.User import *
+from question_bank_importer import insert_batched
+from json_stream import read_book_chapters
 
-with open('definitions.json') as data_file:
-    data = json.load(data_file)
+# safe to run again, words already in the table (unique by text) are skipped along with
+# their definitions (keyed by text)
+existing_chapters = set(chapter_index for chapter_index, in Chapter.select(Chapter.chapter_index).tuples())
+existing_words = set(word for word, in Word.select(Word.word).tuples())
+existing_definitions = set(definition for definition, in Definition.select(Definition.definition).tuples())
+max_word_index = Word.select(fn.MAX(Word.word_index)).scalar()
+word_counter = 0 if max_word_index is None else max_word_index + 1
 
-word_counter = Word.select().count()
+with open('definitions.json') as definitions_file:
+    for chapter in read_book_chapters(definitions_file, items_key='words'):
+        chapter_index = chapter['index']
+        new_words = []
+        new_definitions = []
+        for word in chapter['words']:
+            word_text = word['text']
+            if word_text in existing_words:
+                continue
+            existing_words.add(word_text)
+            new_words.append({'word_index': word_counter, 'word': word_text, 'chapter_index': chapter_index})
+            for definition in word['definitions']:
+                definition_text = definition['text']
+                if definition_text in existing_definitions:
+                    continue
+                existing_definitions.add(definition_text)
+                new_definitions.append({
+                    'word_index': word_counter,
+                    'definition': definition_text,
+                    'chapter_index': chapter_index
+                })
+            word_counter += 1
 
-for chapter in data['book']:
-    chapter_index = chapter['index']
-    chapter_name = chapter['name']
-    Chapter.create(chapter_index=chapter_index, chapter_name=chapter_name)
-    for word in chapter['words']:
-        word_text = word['text']
-        Word.create(word_index=word_counter, word=word_text, chapter_index=chapter_index)
-        for definition in word['definitions']:
-            definition_text = definition['text']
-            Definition.create(
-                word_index=word_counter,
-                definition=definition_text,
-                chapter_index=chapter_index
-            )
-        word_counter += 1
+        # one transaction per chapter, words before the definitions that reference them
+        with database.atomic():
+            if chapter_index not in existing_chapters:
+                Chapter.create(chapter_index=chapter_index, chapter_name=chapter['name'])
+            insert_batched(Word, new_words, batch_size=200)
+            insert_batched(Definition, new_definitions, batch_size=200)
+
+# let the running api processes reload their cached chapter list
+CacheVersion.bump('chapters')
@@ -0,0 +1,131 @@
+import json
+
+#########################################################################################
+# DESCRIPTION
+# incremental reader for definitions.json, so importing a large bank doesn't hold the
+# whole document (and every python object parsed from it) in memory
+#
+# the file is read in chunks and walked one json value at a time with the standard
+# library's raw_decode, only the value being decoded is kept in the buffer
+#
+# read_book_chapters yields the chapters of "book" one at a time, their questions (or words)
+# are a generator decoded as the importer iterates over it, so memory is bounded by the
+# largest single question rather than by the file
+#########################################################################################
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonStream:
+
+    def __init__(self, source, chunk_size=1 << 16):
+        self.__source = source
+        self.__chunk_size = chunk_size
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ''
+        self.__position = 0
+        self.__eof = False
+
+    def peek(self):
+        self.__skip_whitespace()
+        if self.__position >= len(self.__buffer):
+            raise ValueError('unexpected end of json')
+        return self.__buffer[self.__position]
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('expected {!r} at {!r}'.format(
+                character, self.__buffer[self.__position:self.__position + 20]))
+        self.__position += 1
+
+    def decode_value(self):
+        self.__skip_whitespace()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buffer, self.__position)
+            except ValueError:
+                if self.__eof:
+                    raise
+                self.__fill()
+                continue
+            # a number at the end of the buffer might continue in the next chunk
+            if end == len(self.__buffer) and not self.__eof:
+                self.__fill()
+                continue
+            self.__position = end
+            return value
+
+    def iter_array(self):
+        # yields once per item, positioned at the item, which the caller has to consume
+        self.expect('[')
+        if self.peek() == ']':
+            self.__position += 1
+            return
+        while True:
+            yield
+            if self.peek() == ']':
+                self.__position += 1
+                return
+            self.expect(',')
+
+    def iter_object(self):
+        # yields each key, positioned at its value, which the caller has to consume
+        self.expect('{')
+        if self.peek() == '}':
+            self.__position += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self.__position += 1
+                return
+            self.expect(',')
+
+    def __skip_whitespace(self):
+        while True:
+            while self.__position < len(self.__buffer) and self.__buffer[self.__position] in WHITESPACE:
+                self.__position += 1
+            if self.__position < len(self.__buffer) or self.__eof:
+                return
+            self.__fill()
+
+    def __fill(self):
+        # drops what has been consumed, reads at least as much as is still buffered so a
+        # value spanning many chunks is decoded in a linear number of attempts
+        self.__buffer = self.__buffer[self.__position:]
+        self.__position = 0
+        chunk = self.__source.read(max(self.__chunk_size, len(self.__buffer)))
+        if not chunk:
+            self.__eof = True
+        self.__buffer += chunk
+
+
+def read_chapter(stream, items_key):
+    chapter = {}
+    items = None
+    for key in stream.iter_object():
+        if key == items_key and 'index' in chapter and 'name' in chapter:
+            items = (stream.decode_value() for _ in stream.iter_array())
+            chapter[key] = items
+            yield chapter
+            # whatever the importer didn't read
+            for _ in items:
+                pass
+        else:
+            chapter[key] = stream.decode_value()
+
+    if items is None:
+        # the items came before index or name and were decoded whole
+        yield chapter
+
+
+def read_book_chapters(definitions_file, items_key='questions'):
+    stream = JsonStream(definitions_file)
+    for key in stream.iter_object():
+        if key != 'book':
+            stream.decode_value()
+            continue
+        for _ in stream.iter_array():
+            yield from read_chapter(stream, items_key)
@@ -0,0 +1,4 @@
+-- questions of the current quest, generated once at quest start
+-- format: "prompt_index:correct_choice_index:choice,choice,..." entries separated by "|"
+ALTER TABLE `testdb`.`users`
+  ADD COLUMN `question_queue` TEXT NULL DEFAULT NULL AFTER `current_question_index`;
@@ -0,0 +1,9 @@
+-- version stamps for data the api caches in-process, bumped by the db_scripts loaders
+CREATE TABLE IF NOT EXISTS `testdb`.`cache_versions` (
+  `name` VARCHAR(45) NOT NULL,
+  `version` INT(11) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`name`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8;
+
+INSERT IGNORE INTO `testdb`.`cache_versions` (`name`, `version`) VALUES ('chapters', 1);
@@ -0,0 +1,8 @@
+-- today's number of completed dailies, kept on the user row so the api doesn't count the quest log
+ALTER TABLE `testdb`.`users`
+  ADD COLUMN `dailies_complete_count` INT(11) NULL DEFAULT NULL AFTER `question_queue`,
+  ADD COLUMN `dailies_complete_date` DATE NULL DEFAULT NULL AFTER `dailies_complete_count`;
+
+-- fallback count for users whose counter was never set
+CREATE INDEX `idx_quest_log_user_daily_completed`
+  ON `testdb`.`quest_log` (`user_id`, `is_daily`, `datetime_quest_completed`);
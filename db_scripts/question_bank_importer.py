@@ -0,0 +1,157 @@
+import time
+
+from peewee import fn
+
+from business_objects.Models import Chapter, McPrompt, McChoice
+
+
+#########################################################################################
+# DESCRIPTION
+# bulk import of a question bank (the "book" in definitions.json) into chapters,
+# mc_prompts and mc_choices
+#
+# new rows are written with multi-row INSERTs (insert_many) in batches of batch_size,
+# one transaction per chapter, so an interrupted import only leaves whole chapters behind
+# and can simply be run again
+#
+# re-importing is idempotent, rows are matched on stable keys:
+#   chapters    chapter_index                  name updated if it changed
+#   mc_prompts  (chapter_index, text)          new prompts get indexes after the current max
+#   mc_choices  (question_index, text)         correct updated if it changed
+# rows that are no longer in the file are left alone, the activity log and the answer
+# statistics still refer to them
+#
+# chapters are read one at a time from any iterable (json_stream.read_book_chapters streams
+# them from the file), new rows are written every batch_size choices and only the keys of
+# the chapter being imported are held in memory
+#########################################################################################
+
+
+def batches(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def insert_batched(model, rows, batch_size):
+    for batch in batches(rows, batch_size):
+        model.insert_many(batch).execute()
+    return len(rows)
+
+
+class QuestionBankImporter:
+
+    def __init__(self, batch_size=200, question_type=1):
+        self.__batch_size = batch_size
+        self.__question_type = question_type
+        self.__next_prompt_index = None
+        self.__stats = {
+            'chapters': 0,
+            'prompts': 0,
+            'choices': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'seconds': 0.0
+        }
+
+    def run(self, chapters):
+        start = time.perf_counter()
+        max_index = McPrompt.select(fn.MAX(McPrompt.index)).scalar()
+        self.__next_prompt_index = 0 if max_index is None else max_index + 1
+
+        for chapter in chapters:
+            with Chapter._meta.database.atomic():
+                self.__import_chapter(chapter)
+
+        self.__stats['seconds'] += time.perf_counter() - start
+        return self.stats()
+
+    def stats(self):
+        stats = dict(self.__stats)
+        stats['inserted'] = stats['chapters'] + stats['prompts'] + stats['choices']
+        stats['rows_per_second'] = stats['inserted'] / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+
+    def __import_chapter(self, chapter):
+        chapter_index = chapter['index']
+        self.__upsert_chapter(chapter_index, chapter['name'])
+
+        prompt_indexes = self.__get_existing_prompts(chapter_index)
+        existing_choices = self.__get_existing_choices(chapter_index)
+        new_prompts = []
+        new_choices = []
+
+        for question in chapter['questions']:
+            question_text = question['question_text']
+            question_index = prompt_indexes.get(question_text)
+            if question_index is None:
+                question_index = self.__next_prompt_index
+                self.__next_prompt_index += 1
+                prompt_indexes[question_text] = question_index
+                new_prompts.append({
+                    'index': question_index,
+                    'text': question_text,
+                    'chapter_index': chapter_index,
+                    'type': self.__question_type
+                })
+            else:
+                self.__stats['unchanged'] += 1
+
+            for answers, correct in ((question['correct_answers'], True), (question['incorrect_answers'], False)):
+                for answer_text in answers:
+                    key = (question_index, answer_text)
+                    existing = existing_choices.get(key)
+                    if existing is None:
+                        existing_choices[key] = (None, correct)
+                        new_choices.append({
+                            'question_index': question_index,
+                            'text': answer_text,
+                            'correct': correct
+                        })
+                    elif existing[0] is not None and bool(existing[1]) != correct:
+                        McChoice.update(correct=correct).where(McChoice.index == existing[0]).execute()
+                        existing_choices[key] = (existing[0], correct)
+                        self.__stats['updated'] += 1
+                    else:
+                        self.__stats['unchanged'] += 1
+
+            if len(new_choices) >= self.__batch_size:
+                self.__flush(new_prompts, new_choices)
+
+        self.__flush(new_prompts, new_choices)
+
+    def __flush(self, new_prompts, new_choices):
+        # prompts first, the choices reference them
+        self.__stats['prompts'] += insert_batched(McPrompt, new_prompts, self.__batch_size)
+        self.__stats['choices'] += insert_batched(McChoice, new_choices, self.__batch_size)
+        del new_prompts[:]
+        del new_choices[:]
+
+    def __upsert_chapter(self, chapter_index, chapter_name):
+        existing = Chapter.select(Chapter.chapter_name).where(Chapter.chapter_index == chapter_index).first()
+        if existing is None:
+            Chapter.insert(chapter_index=chapter_index, chapter_name=chapter_name).execute()
+            self.__stats['chapters'] += 1
+        elif existing.chapter_name != chapter_name:
+            Chapter.update(chapter_name=chapter_name).where(Chapter.chapter_index == chapter_index).execute()
+            self.__stats['updated'] += 1
+        else:
+            self.__stats['unchanged'] += 1
+
+    @staticmethod
+    def __get_existing_prompts(chapter_index):
+        prompts = (McPrompt
+                   .select(McPrompt.text, McPrompt.index)
+                   .where(McPrompt.chapter_index == chapter_index)
+                   .tuples()
+                   )
+        return dict(prompts)
+
+    @staticmethod
+    def __get_existing_choices(chapter_index):
+        choices = (McChoice
+                   .select(McChoice.question_index, McChoice.text, McChoice.index, McChoice.correct)
+                   .join(McPrompt)
+                   .where(McPrompt.chapter_index == chapter_index)
+                   .tuples()
+                   )
+        return {(question_index, text): (index, correct) for question_index, text, index, correct in choices}
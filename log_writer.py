@@ -0,0 +1,317 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from processes import process_alive
+
+#########################################################################################
+# DESCRIPTION
+# background writer for analytics rows (locations, activity log) so requests don't wait
+# on those inserts
+#
+# rows go into a bounded queue, a worker thread takes up to batch_size rows (or whatever
+# arrived within flush_interval seconds) and writes them as one multi-row INSERT per table
+# inside a transaction
+#
+# when the queue stays full for enqueue_timeout seconds (backpressure) or the database
+# can't take a batch, rows are appended to a per-process spill file as json lines and
+# replayed once the database is reachable again, nothing is dropped
+#
+# counters (e.g. mc_choices.times_chosen) are coalesced in memory per key and written on
+# the same thread every flush_interval, a failed write keeps the counts for the next try
+#
+# every uWSGI process starts its own worker on first use (after the fork), remaining rows
+# and counts are flushed when the process exits
+#########################################################################################
+
+INSERT = 'insert'
+CALL = 'call'
+
+
+def spill_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(' ')
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+class CounterBuffer:
+
+    def __init__(self, write):
+        # write({key: amount, ...}) has to apply every increment atomically in the database
+        self.__write = write
+        self.__counts = {}
+        self.__lock = threading.Lock()
+
+    def add(self, key, amount=1):
+        with self.__lock:
+            self.__counts[key] = self.__counts.get(key, 0) + amount
+
+    def pending(self):
+        with self.__lock:
+            return sum(self.__counts.values())
+
+    def flush(self):
+        with self.__lock:
+            counts, self.__counts = self.__counts, {}
+        if not counts:
+            return True
+
+        try:
+            self.__write(counts)
+            return True
+        except Exception as ex:
+            print(ex)
+            print("failed to write counters, keeping them for the next flush.")
+            self.__restore(counts)
+            return False
+
+    def __restore(self, counts):
+        with self.__lock:
+            for key, amount in counts.items():
+                self.__counts[key] = self.__counts.get(key, 0) + amount
+
+
+class AnalyticsWriter:
+
+    def __init__(
+            self,
+            database,
+            models,
+            batch_size,
+            flush_interval,
+            max_queue_size,
+            enqueue_timeout,
+            spill_path,
+            replay_interval
+    ):
+        self.__database = database
+        self.__models = {model._meta.db_table: model for model in models}
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__enqueue_timeout = enqueue_timeout
+        self.__spill_path = spill_path
+        self.__replay_interval = replay_interval
+        self.__queue = queue.Queue(max_queue_size)
+        self.__spill_lock = threading.Lock()
+        self.__start_lock = threading.Lock()
+        self.__stopping = threading.Event()
+        self.__thread = None
+        self.__pid = None
+        self.__replayed_at = 0
+        self.__claimed_files = 0
+        self.__counters = {}
+        self.__stats = {
+            'queued': 0,
+            'written': 0,
+            'batches': 0,
+            'spilled': 0,
+            'replayed': 0,
+            'failed_calls': 0
+        }
+
+    #########################################################################################
+    # producer side, called from request handlers
+    #########################################################################################
+
+    def insert(self, model, row):
+        self.__enqueue((INSERT, model._meta.db_table, row))
+
+    def register_counter(self, name, write):
+        self.__counters[name] = CounterBuffer(write)
+
+    def increment(self, name, key, amount=1):
+        self.__ensure_started()
+        self.__counters[name].add(key, amount)
+
+    def defer(self, function, *args):
+        # deferred calls are not spilled, if the queue is full they run right away
+        self.__enqueue((CALL, function, args))
+
+    def stop(self, timeout=10):
+        self.__stopping.set()
+        if self.__thread is not None and self.__pid == os.getpid():
+            self.__thread.join(timeout)
+        # whatever the worker could not get to before the timeout
+        self.__write(self.__drain())
+        for name, counter in self.__counters.items():
+            if not counter.flush():
+                print("lost {} pending '{}' increments at shutdown.".format(counter.pending(), name))
+        self.__close_connection()
+
+    def stats(self):
+        stats = dict(self.__stats)
+        stats['queue_size'] = self.__queue.qsize()
+        stats['pending_increments'] = {name: counter.pending() for name, counter in self.__counters.items()}
+        return stats
+
+    def __enqueue(self, item):
+        self.__ensure_started()
+        try:
+            self.__queue.put(item, timeout=self.__enqueue_timeout)
+            self.__stats['queued'] += 1
+        except queue.Full:
+            if item[0] == INSERT:
+                self.__spill([(item[1], item[2])])
+            else:
+                self.__run_call(item[1], item[2])
+
+    def __ensure_started(self):
+        if self.__thread is not None and self.__pid == os.getpid():
+            return
+
+        with self.__start_lock:
+            if self.__thread is not None and self.__pid == os.getpid():
+                return
+            self.__pid = os.getpid()
+            self.__stopping.clear()
+            self.__thread = threading.Thread(target=self.__run, name='analytics-writer', daemon=True)
+            self.__thread.start()
+            atexit.register(self.stop)
+
+    #########################################################################################
+    # worker side
+    #########################################################################################
+
+    def __run(self):
+        while not self.__stopping.is_set():
+            self.__write(self.__take_batch())
+            for counter in self.__counters.values():
+                counter.flush()
+            if time.monotonic() - self.__replayed_at >= self.__replay_interval:
+                self.__replayed_at = time.monotonic()
+                self.__replay_spill()
+            self.__close_connection()
+
+    def __take_batch(self):
+        items = []
+        deadline = time.monotonic() + self.__flush_interval
+        while len(items) < self.__batch_size and not self.__stopping.is_set():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self.__queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def __drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self.__queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def __write(self, items):
+        if not items:
+            return
+
+        rows = [(item[1], item[2]) for item in items if item[0] == INSERT]
+        if rows and self.__insert_rows(rows):
+            self.__stats['written'] += len(rows)
+            self.__stats['batches'] += 1
+        elif rows:
+            self.__spill(rows)
+
+        for item in items:
+            if item[0] == CALL:
+                self.__run_call(item[1], item[2])
+
+    def __close_connection(self):
+        # hands this thread's connection back to the pool between batches
+        if not self.__database.is_closed():
+            self.__database.close()
+
+    def __insert_rows(self, rows):
+        rows_by_table = {}
+        for table, row in rows:
+            rows_by_table.setdefault(table, []).append(row)
+
+        try:
+            with self.__database.atomic():
+                for table, table_rows in rows_by_table.items():
+                    self.__models[table].insert_many(table_rows).execute()
+            return True
+        except Exception as ex:
+            print(ex)
+            print("failed to write analytics batch, spilling to disk.")
+            return False
+
+    def __run_call(self, function, args):
+        try:
+            function(*args)
+        except Exception as ex:
+            self.__stats['failed_calls'] += 1
+            print(ex)
+
+    #########################################################################################
+    # spill files, "<spill_path>.<pid>" is only appended to by that process
+    #
+    # a process replays its own file and those of processes that are gone (uWSGI respawns),
+    # never the file of a live process, which may still be appending to it, a file is claimed
+    # by renaming it to "<spill_path>.<pid>.replaying.<n>" and removed only once its rows are
+    # in the database or spilled again, a crash mid-replay can write a batch twice (the
+    # claimed file is replayed again), it never drops one
+    #########################################################################################
+
+    def __spill(self, rows, replayed=False):
+        with self.__spill_lock:
+            with open('{}.{}'.format(self.__spill_path, os.getpid()), 'a') as spill_file:
+                for table, row in rows:
+                    spill_file.write(json.dumps({'table': table, 'row': row}, default=spill_default) + '\n')
+            if not replayed:
+                self.__stats['spilled'] += len(rows)
+
+    def __replay_spill(self):
+        for spill_file_path in self.__claim_spill_files():
+            rows = []
+            with open(spill_file_path) as claimed_file:
+                for line in claimed_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short when its process was killed mid-write
+                        print("skipping unreadable spilled row in {}.".format(spill_file_path))
+                        continue
+                    rows.append((entry['table'], entry['row']))
+
+            for start in range(0, len(rows), self.__batch_size):
+                batch = rows[start:start + self.__batch_size]
+                if self.__insert_rows(batch):
+                    self.__stats['replayed'] += len(batch)
+                else:
+                    self.__spill(rows[start:], replayed=True)
+                    os.remove(spill_file_path)
+                    return
+            os.remove(spill_file_path)
+
+    def __claim_spill_files(self):
+        claimed = []
+        for spill_file_path in glob.glob('{}.[0-9]*'.format(self.__spill_path)):
+            owner = spill_file_path[len(self.__spill_path) + 1:].split('.')[0]
+            if not owner.isdigit():
+                continue
+            owner = int(owner)
+            if owner == os.getpid() and '.replaying.' in spill_file_path:
+                # left by an earlier replay in this process that didn't finish
+                claimed.append(spill_file_path)
+                continue
+            if owner != os.getpid() and process_alive(owner):
+                continue
+
+            self.__claimed_files += 1
+            claimed_path = '{}.{}.replaying.{}'.format(self.__spill_path, os.getpid(), self.__claimed_files)
+            try:
+                # new rows of this process go to a new file from here on
+                with self.__spill_lock:
+                    os.rename(spill_file_path, claimed_path)
+            except OSError:
+                # another process claimed it first
+                continue
+            claimed.append(claimed_path)
+        return claimed
@@ -0,0 +1,303 @@
+import atexit
+import fcntl
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+from processes import process_alive
+
+#########################################################################################
+# DESCRIPTION
+# prometheus metrics (text exposition format) aggregated over every uWSGI process
+#
+# each process keeps its counters and histograms in memory and writes a snapshot of them
+# to its own file in directory (at most every flush_interval seconds, from the request path,
+# and when it exits), /metrics sums the snapshots of all processes, so any worker can
+# answer a scrape for the whole deployment
+#
+# counters only ever grow in a snapshot, and a scrape folds the snapshots of exited processes
+# into one retired snapshot before removing their files, so the sums stay monotonic when uWSGI
+# respawns a worker and the directory doesn't grow with every respawn, gauges (pool sizes,
+# queue lengths) are only reported for processes that are still running, labelled with their pid
+#
+# collectors registered with register_collector are sampled when a snapshot is written,
+# for values other modules already keep (cache hits, pool checkouts, ...), ratios
+# (describe_ratio) are worked out from the summed counters, not averaged over processes
+#########################################################################################
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+# exited processes' counters and histograms, summed into one file
+RETIRED_SNAPSHOT_NAME = 'metrics.retired.json'
+
+
+def label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def merge_snapshot(snapshot, buckets, counters, histograms):
+    # adds a snapshot's counters and histograms to the sums, histograms written with other
+    # bucket bounds (before a config change) can't be merged and are left out
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+
+    if tuple(snapshot['buckets']) != buckets:
+        return
+    for name, labels, snapshot_buckets, total, count in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        histogram = histograms.setdefault(key, {'buckets': [0] * len(snapshot_buckets), 'sum': 0.0, 'count': 0})
+        histogram['buckets'] = [merged + added for merged, added in zip(histogram['buckets'], snapshot_buckets)]
+        histogram['sum'] += total
+        histogram['count'] += count
+
+
+def remove_snapshot(path):
+    try:
+        os.remove(path)
+    except OSError as ex:
+        print(ex)
+
+
+class MetricsRegistry:
+
+    def __init__(self, directory, flush_interval, buckets):
+        self.__directory = directory
+        self.__flush_interval = flush_interval
+        self.__buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__help = {}
+        self.__counters = {}
+        self.__histograms = {}
+        self.__collectors = []
+        self.__ratios = {}
+        self.__pid = None
+        self.__snapshot_path = None
+        self.__flushed_at = 0
+
+    def describe(self, name, kind, help_text):
+        self.__help[name] = (kind, help_text)
+
+    def describe_ratio(self, name, hits_name, misses_name, help_text):
+        # gauge name{labels} = hits / (hits + misses), for every label set of hits_name
+        self.describe(name, GAUGE, help_text)
+        self.__ratios[name] = (hits_name, misses_name)
+
+    def register_collector(self, collector):
+        # collector() returns [(COUNTER or GAUGE, name, labels dict, value), ...]
+        self.__collectors.append(collector)
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, label_key(labels))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = (name, label_key(labels))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = {'buckets': [0] * len(self.__buckets), 'sum': 0.0, 'count': 0}
+            for position, upper_bound in enumerate(self.__buckets):
+                if value <= upper_bound:
+                    histogram['buckets'][position] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    #########################################################################################
+    # per-process snapshot files
+    #########################################################################################
+
+    def maybe_flush(self):
+        if time.monotonic() - self.__flushed_at >= self.__flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.__flushed_at = time.monotonic()
+        counters = []
+        gauges = []
+        for collector in self.__collectors:
+            try:
+                samples = collector()
+            except Exception as ex:
+                print(ex)
+                continue
+            for kind, name, labels, value in samples:
+                (counters if kind == COUNTER else gauges).append([name, label_key(labels), value])
+
+        with self.__lock:
+            counters.extend([name, labels, value] for (name, labels), value in self.__counters.items())
+            histograms = [
+                [name, labels, histogram['buckets'], histogram['sum'], histogram['count']]
+                for (name, labels), histogram in self.__histograms.items()
+            ]
+
+        snapshot = {
+            'pid': os.getpid(),
+            'buckets': self.__buckets,
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms
+        }
+        path = self.__get_snapshot_path()
+        temporary_path = path + '.tmp'
+        try:
+            with open(temporary_path, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file, separators=(',', ':'))
+            # readers only ever see a complete snapshot
+            os.replace(temporary_path, path)
+        except OSError as ex:
+            print(ex)
+            print("failed to write metrics snapshot.")
+
+    def __get_snapshot_path(self):
+        if self.__pid != os.getpid():
+            # first flush in this process (after the fork), pid plus start time so a reused pid
+            # never overwrites an exited process's counters
+            self.__pid = os.getpid()
+            os.makedirs(self.__directory, exist_ok=True)
+            self.__snapshot_path = os.path.join(
+                self.__directory, 'metrics.{}.{}.json'.format(self.__pid, int(time.time() * 1000)))
+            atexit.register(self.flush)
+        return self.__snapshot_path
+
+    #########################################################################################
+    # aggregation and exposition
+    #########################################################################################
+
+    def collect(self):
+        self.flush()
+        counters = {}
+        gauges = {}
+        histograms = {}
+        for snapshot in self.__read_snapshots():
+            merge_snapshot(snapshot, self.__buckets, counters, histograms)
+
+            if snapshot['pid'] is not None and (snapshot['pid'] == os.getpid() or process_alive(snapshot['pid'])):
+                for name, labels, value in snapshot['gauges']:
+                    key = (name, tuple(map(tuple, labels)) + (('pid', snapshot['pid']),))
+                    gauges[key] = value
+
+        for name, (hits_name, misses_name) in self.__ratios.items():
+            for (sample_name, labels), hits in counters.items():
+                if sample_name != hits_name:
+                    continue
+                lookups = hits + counters.get((misses_name, labels), 0)
+                gauges[(name, labels)] = hits / lookups if lookups else 0.0
+
+        return counters, gauges, histograms
+
+    def __read_snapshots(self):
+        os.makedirs(self.__directory, exist_ok=True)
+        with open(os.path.join(self.__directory, 'metrics.lock'), 'a') as lock_file:
+            # scrapes of different processes take turns, so an exited process's snapshot is
+            # folded into the retired one exactly once and never read next to it
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            snapshots = {}
+            for path in glob.glob(os.path.join(self.__directory, 'metrics.*.json')):
+                try:
+                    with open(path) as snapshot_file:
+                        snapshots[path] = json.load(snapshot_file)
+                except (OSError, ValueError):
+                    continue
+            return self.__retire_exited(snapshots)
+
+    def __retire_exited(self, snapshots):
+        retired_path = os.path.join(self.__directory, RETIRED_SNAPSHOT_NAME)
+        retired = snapshots.pop(retired_path, None)
+        if retired is None:
+            retired = {'pid': None, 'buckets': self.__buckets, 'counters': [], 'gauges': [], 'histograms': [],
+                       'folded': []}
+        for name in retired['folded']:
+            # folded before the last scrape stopped short of removing it
+            path = os.path.join(self.__directory, name)
+            if snapshots.pop(path, None) is not None:
+                remove_snapshot(path)
+
+        exited = [
+            path for path, snapshot in snapshots.items()
+            if snapshot['pid'] != os.getpid() and not process_alive(snapshot['pid'])
+        ]
+        if not exited:
+            return list(snapshots.values()) + [retired]
+
+        counters = {}
+        histograms = {}
+        for snapshot in [retired] + [snapshots[path] for path in exited]:
+            merge_snapshot(snapshot, self.__buckets, counters, histograms)
+        folded = {
+            'pid': None,
+            'buckets': self.__buckets,
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'gauges': [],
+            'histograms': [
+                [name, labels, histogram['buckets'], histogram['sum'], histogram['count']]
+                for (name, labels), histogram in histograms.items()
+            ],
+            'folded': [os.path.basename(path) for path in exited]
+        }
+        temporary_path = retired_path + '.tmp'
+        try:
+            with open(temporary_path, 'w') as snapshot_file:
+                json.dump(folded, snapshot_file, separators=(',', ':'))
+            os.replace(temporary_path, retired_path)
+        except OSError as ex:
+            print(ex)
+            print("failed to write retired metrics snapshot.")
+            return list(snapshots.values()) + [retired]
+
+        for path in exited:
+            remove_snapshot(path)
+            del snapshots[path]
+        return list(snapshots.values()) + [folded]
+
+    def render(self):
+        counters, gauges, histograms = self.collect()
+        lines = []
+
+        def header(name, default_kind):
+            kind, help_text = self.__help.get(name, (default_kind, name))
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        for samples, kind in ((counters, COUNTER), (gauges, GAUGE)):
+            for name in sorted(set(name for name, _ in samples)):
+                header(name, kind)
+                for (sample_name, labels), value in sorted(samples.items()):
+                    if sample_name == name:
+                        lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+
+        for name in sorted(set(name for name, _ in histograms)):
+            header(name, 'histogram')
+            for (sample_name, labels), histogram in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                cumulative = 0
+                for upper_bound, bucket_count in zip(self.__buckets + (math.inf,),
+                                                     histogram['buckets'] + [histogram['count'] - sum(histogram['buckets'])]):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, format_labels(labels + (('le', format_value(upper_bound)),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), format_value(histogram['sum'])))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
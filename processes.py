@@ -0,0 +1,29 @@
+import os
+
+#########################################################################################
+# DESCRIPTION
+# whether the process with this pid is still running, for the files every uWSGI process
+# writes on its own (metrics snapshots, analytics spill files) that are taken over once
+# their process has exited
+#
+# RETURN CASES
+# True if the process exists, also when it belongs to another user
+# False if there is no such process
+#
+# TAKES
+# pid
+#
+# RETURNS
+# bool
+#########################################################################################
+
+
+def process_alive(pid):
+    try:
+        # signal 0 is only checked, never sent
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
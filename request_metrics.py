@@ -0,0 +1,130 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+#########################################################################################
+# DESCRIPTION
+# per-request counters for the hot path: sql statements, rows, database time, external
+# http time (auth0 tokeninfo) and response serialization time
+#
+# rest_core starts the counters in before_request and finishes them in after_request, the
+# database classes in business_objects/Database.py report every statement they execute,
+# other code wraps its slow parts in timed('http') / timed('serialization')
+#
+# counters live in a thread local, work done outside a request (the analytics writer
+# thread, the db_scripts) isn't counted and costs nothing extra
+#########################################################################################
+
+TIMED_KINDS = ('http', 'serialization')
+
+
+class RequestMetrics:
+
+    def __init__(self, route):
+        self.route = route
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.http_calls = 0
+        self.http_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.total_seconds = None
+
+    def record_query(self, seconds, rows):
+        self.queries += 1
+        # rowcount is -1 when the driver doesn't know (e.g. sqlite selects)
+        self.rows += max(rows, 0)
+        self.db_seconds += seconds
+
+    def record_time(self, kind, seconds):
+        if kind == 'http':
+            self.http_calls += 1
+            self.http_seconds += seconds
+        elif kind == 'serialization':
+            self.serialization_seconds += seconds
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self.started_at
+        return self
+
+    def to_json(self):
+        return {
+            'route': self.route,
+            'queries': self.queries,
+            'rows': self.rows,
+            'db_ms': round(self.db_seconds * 1000, 3),
+            'http_calls': self.http_calls,
+            'http_ms': round(self.http_seconds * 1000, 3),
+            'serialization_ms': round(self.serialization_seconds * 1000, 3),
+            'total_ms': round(self.total_seconds * 1000, 3) if self.total_seconds is not None else None
+        }
+
+    def get_headers(self):
+        # Server-Timing shows up in the browser's network panel
+        return {
+            'Server-Timing': 'db;dur={:.3f};desc="{} queries", http;dur={:.3f}, serialization;dur={:.3f}, '
+                             'total;dur={:.3f}'.format(self.db_seconds * 1000, self.queries, self.http_seconds * 1000,
+                                                       self.serialization_seconds * 1000, self.total_seconds * 1000),
+            'X-Query-Count': str(self.queries),
+            'X-Row-Count': str(self.rows)
+        }
+
+
+local_metrics = threading.local()
+
+
+def start_request(route):
+    local_metrics.current = RequestMetrics(route)
+    return local_metrics.current
+
+
+def current_request_metrics():
+    return getattr(local_metrics, 'current', None)
+
+
+def finish_request():
+    metrics = current_request_metrics()
+    local_metrics.current = None
+    if metrics is None:
+        return None
+    return metrics.finish()
+
+
+@contextmanager
+def timed(kind):
+    metrics = current_request_metrics()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_time(kind, time.perf_counter() - start)
+
+
+#########################################################################################
+# structured log lines, one json object per request on its own logger so they can be
+# shipped or grepped apart from the application log
+#########################################################################################
+
+metrics_logger = logging.getLogger('exbook.request_metrics')
+if not metrics_logger.handlers:
+    metrics_handler = logging.StreamHandler(sys.stderr)
+    metrics_handler.setFormatter(logging.Formatter('%(asctime)s request_metrics %(message)s'))
+    metrics_logger.addHandler(metrics_handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+
+
+def log_request_metrics(metrics, status_code, min_ms=0):
+    if metrics.total_seconds * 1000 < min_ms:
+        return
+    line = metrics.to_json()
+    line['status'] = status_code
+    metrics_logger.info(json.dumps(line, separators=(',', ':')))
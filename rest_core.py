@@ -1,8 +1,15 @@
+import datetime
 import logging
 from logging.handlers import RotatingFileHandler
 from rest_functions import *
+from rest_json import encode_json_response
+from request_metrics import start_request, finish_request, timed, log_request_metrics
+from metrics import MetricsRegistry, COUNTER, GAUGE
+from business_objects.ClassroomCache import classroom_cache, load_classroom_for_update, save_classroom
+from business_objects.Leaderboard import record_points
+from business_objects.questions.QuestionIndex import question_index
 from config import *
-from flask import Flask, jsonify, request, abort, _request_ctx_stack
+from flask import Flask, request, abort, _request_ctx_stack
 
 import jwt
 import base64
@@ -12,13 +19,106 @@ from werkzeug.local import LocalProxy
 app = Flask(__name__, static_url_path='/')
 
 
+# id tokens are signed by auth0 with the client secret and issued for this client id
+jwt_secret = base64.b64decode('Ruhcmld2nOTwFL4u_NZgUd8Dzj-LhZVEw5o4deIqcy7O_A6LQ4jJhtvKgy6jauN4'.replace("_","/").replace("-","+"))
+jwt_audience = 'p0YHk3HYjJP7HjleA1zwvNS9xCb5WfIw'
+
 # Authentication annotation
 current_user = LocalProxy(lambda: _request_ctx_stack.top.current_user)
+# the users row for current_user, loaded at most once per request (see RequestUserLoader)
+request_user = LocalProxy(lambda: _request_ctx_stack.top.request_user)
+
+
+# -------------------------------------------------------------
+# Prometheus metrics, served on /metrics for every uWSGI process (see metrics.py)
+# -------------------------------------------------------------
+
+app_metrics = MetricsRegistry(metrics_directory, metrics_flush_interval, metrics_latency_buckets)
+app_metrics.describe('exbook_http_requests_total', COUNTER, 'Requests by route, method and status code.')
+app_metrics.describe('exbook_http_request_duration_seconds', 'histogram', 'Request latency by route.')
+app_metrics.describe('exbook_http_errors_total', COUNTER, 'Responses with a 4xx/5xx status by route and status code.')
+app_metrics.describe('exbook_auth_errors_total', COUNTER, 'Failed authentications by error code.')
+app_metrics.describe('exbook_db_queries_total', COUNTER, 'SQL statements executed by route.')
+app_metrics.describe('exbook_db_seconds_total', COUNTER, 'Seconds spent in SQL statements by route.')
+app_metrics.describe('exbook_db_pool_checkouts_total', COUNTER, 'Connections taken from the pool.')
+app_metrics.describe('exbook_db_pool_new_connections_total', COUNTER, 'Connections the pool had to open.')
+app_metrics.describe('exbook_db_pool_wait_seconds_total', COUNTER,
+                     'Seconds spent checking out pooled connections (waiting for a free one or opening one).')
+app_metrics.describe('exbook_db_pool_timeouts_total', COUNTER, 'Checkouts that gave up waiting for a free connection.')
+app_metrics.describe('exbook_db_pool_connections', GAUGE, 'Pooled connections by state (idle, in_use, max).')
+app_metrics.describe('exbook_cache_hits_total', COUNTER, 'Process cache hits by cache.')
+app_metrics.describe('exbook_cache_misses_total', COUNTER, 'Process cache misses (reloads for versioned caches) by cache.')
+app_metrics.describe('exbook_cache_entries', GAUGE, 'Entries in a process cache.')
+app_metrics.describe_ratio('exbook_cache_hit_ratio', 'exbook_cache_hits_total', 'exbook_cache_misses_total',
+                           'Hits over lookups by cache, summed over all processes.')
+app_metrics.describe('exbook_analytics_rows_total', COUNTER, 'Analytics writer rows by outcome.')
+app_metrics.describe('exbook_analytics_queue_size', GAUGE, 'Analytics rows waiting to be written.')
+app_metrics.describe('exbook_question_index_prompts', GAUGE, 'Prompts loaded in the question index.')
+
+
+def collect_service_metrics():
+    samples = []
+    for cache_name, cache in (('token_info', token_info_cache), ('user_agent', user_agent_cache),
+                              ('classroom', classroom_cache)):
+        stats = cache.stats()
+        samples.append((COUNTER, 'exbook_cache_hits_total', {'cache': cache_name}, stats['hits']))
+        samples.append((COUNTER, 'exbook_cache_misses_total', {'cache': cache_name}, stats['misses']))
+        samples.append((GAUGE, 'exbook_cache_entries', {'cache': cache_name}, stats['size']))
+
+    # one series for all the per-class rewards caches, not one per class
+    quest_options_stats = quest_options_cache.stats()
+    rewards_stats = list(get_rewards_cache_stats().values())
+    for cache_name, hits, reloads in (
+            ('quest_options', quest_options_stats['hits'], quest_options_stats['reloads']),
+            ('rewards', sum(stats['hits'] for stats in rewards_stats), sum(stats['reloads'] for stats in rewards_stats))):
+        samples.append((COUNTER, 'exbook_cache_hits_total', {'cache': cache_name}, hits))
+        samples.append((COUNTER, 'exbook_cache_misses_total', {'cache': cache_name}, reloads))
+
+    if hasattr(database, 'get_pool_stats'):
+        pool_stats = database.get_pool_stats()
+        samples.append((COUNTER, 'exbook_db_pool_checkouts_total', {}, pool_stats['checkouts']))
+        samples.append((COUNTER, 'exbook_db_pool_new_connections_total', {}, pool_stats['new_connections']))
+        samples.append((COUNTER, 'exbook_db_pool_wait_seconds_total', {}, pool_stats['wait_seconds_total']))
+        samples.append((COUNTER, 'exbook_db_pool_timeouts_total', {}, pool_stats['timeouts']))
+        for state in ('idle', 'in_use', 'max'):
+            samples.append((GAUGE, 'exbook_db_pool_connections', {'state': state},
+                            pool_stats[state + '_connections']))
+
+    analytics_stats = analytics_writer.stats()
+    for outcome in ('queued', 'written', 'spilled', 'replayed'):
+        samples.append((COUNTER, 'exbook_analytics_rows_total', {'outcome': outcome}, analytics_stats[outcome]))
+    samples.append((GAUGE, 'exbook_analytics_queue_size', {}, analytics_stats['queue_size']))
+    samples.append((GAUGE, 'exbook_question_index_prompts', {}, question_index.size()))
+    return samples
+
+
+app_metrics.register_collector(collect_service_metrics)
+
+
+def record_request_metrics(metrics, status_code):
+    route_labels = {'route': metrics.route}
+    app_metrics.inc('exbook_http_requests_total',
+                    {'route': metrics.route, 'method': request.method, 'status': str(status_code)})
+    app_metrics.observe('exbook_http_request_duration_seconds', metrics.total_seconds, route_labels)
+    if status_code >= 400:
+        app_metrics.inc('exbook_http_errors_total', {'route': metrics.route, 'status': str(status_code)})
+    app_metrics.inc('exbook_db_queries_total', route_labels, metrics.queries)
+    app_metrics.inc('exbook_db_seconds_total', route_labels, metrics.db_seconds)
+    app_metrics.maybe_flush()
+
+
+def json_response(data):
+    # compact json through the configured encoder (see rest_json.py), pre-encoded values
+    # (cached quest options, ...) are not serialized again
+    with timed('serialization'):
+        encoded = encode_json_response(data)
+    return app.response_class(encoded, mimetype='application/json')
 
 
 # Authentication attribute/annotation
 def authenticate(error):
-    resp = jsonify(error)
+    app_metrics.inc('exbook_auth_errors_total', {'code': error['code']})
+    resp = json_response(error)
 
     resp.status_code = 500
 
@@ -45,8 +145,8 @@ def requires_auth(f):
         try:
             payload = jwt.decode(
                 token,
-                base64.b64decode('Ruhcmld2nOTwFL4u_NZgUd8Dzj-LhZVEw5o4deIqcy7O_A6LQ4jJhtvKgy6jauN4'.replace("_","/").replace("-","+")),
-                audience='p0YHk3HYjJP7HjleA1zwvNS9xCb5WfIw',
+                jwt_secret,
+                audience=jwt_audience,
                 options={'verify_iat': False}
             )
         except jwt.ExpiredSignature:
@@ -57,7 +157,7 @@ def requires_auth(f):
         except jwt.InvalidAudienceError:
             return authenticate({
                 'code': 'invalid_audience',
-                'description': 'incorrect audience, expected: p0YHk3HYjJP7HjleA1zwvNS9xCb5WfIw'
+                'description': 'incorrect audience, expected: ' + jwt_audience
             })
         except jwt.DecodeError:
             return authenticate({
@@ -68,6 +168,7 @@ def requires_auth(f):
             app.logger.error(" Unhandled Exception in authentication method: {}").format(str(ex))
             return authenticate({'code': 'unhandled exception', 'description': 'See logs for details, unhandled exception'})
         _request_ctx_stack.top.current_user = payload
+        _request_ctx_stack.top.request_user = RequestUserLoader(request, payload)
         return f(*args, **kwargs)
 
     return decorated
@@ -76,6 +177,9 @@ def requires_auth(f):
 @app.before_request
 def before_request():
     print('Request Incoming')
+    # unmatched urls share one name, so they don't make a new series per path in the metrics
+    start_request(request.url_rule.rule if request.url_rule is not None else 'unmatched')
+    # with config.database_pooled this checks a connection out of the process pool
     database.connect()
 
 
@@ -86,11 +190,24 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE')
+
+    metrics = finish_request()
+    if metrics is not None:
+        record_request_metrics(metrics, response.status_code)
+        if request_metrics_header or (request_metrics_header is None and app.debug):
+            response.headers.extend(metrics.get_headers())
+        if request_metrics_log:
+            log_request_metrics(metrics, response.status_code, request_metrics_log_min_ms)
     return response
 
 
 @app.teardown_request
 def _db_close(exc):
+    # after_request doesn't run when a route raised, that request is counted as a 500 here
+    metrics = finish_request()
+    if metrics is not None and exc is not None:
+        record_request_metrics(metrics, 500)
+    # returns the connection to the pool when pooling is enabled
     if not database.is_closed():
         database.close()
 
@@ -123,13 +240,13 @@ def _db_close(exc):
 def route_get_status():
     try:
         app.logger.info(request.json)
-        user = authenticate_user(request)
+        user = request_user.get_user()
         try:
             daily_info = get_daily_info(user)
-            rewards = get_rewards(user)
-            quest_options = get_quest_options()
+            rewards = get_rewards_json(user)
+            quest_options = get_quest_options_json()
 
-            return jsonify({
+            return json_response({
                 "user": user.get_json_min(),
                 "daily_status": daily_info,
                 'rewards': rewards,
@@ -171,14 +288,14 @@ def route_start_quest():
         incoming_request = request
         app.logger.info(incoming_request)
         # check authentication
-        user = authenticate_user(request)
+        user = request_user.get_user()
         if user:
-            user_classroom = Classroom.get(Classroom.class_code == user.class_code)
+            user_classroom = user.get_classroom()
             user.start_new_quest(request, user_classroom)
             new_question = user.start_new_question()
             user.save()
 
-            return jsonify({
+            return json_response({
                 "question": new_question.get_json_min(),
                 "user": user.get_json_min()
             })
@@ -216,10 +333,10 @@ def route_get_quests():
         incoming_request = request
         app.logger.info(incoming_request)
         # check authentication
-        user = authenticate_user(request)
+        user = request_user.get_user()
         if user:
-            quest_options = get_quest_options()
-            return jsonify({
+            quest_options = get_quest_options_json()
+            return json_response({
                 "user": user.get_json_min(),
                 "quest_options": quest_options
             })
@@ -256,12 +373,12 @@ def route_drop_quest():
         incoming_request = request
         app.logger.info(incoming_request)
         # check authentication
-        user = authenticate_user(request)
+        user = request_user.get_user()
         if user:
             user.drop_user_quest()
             user.save()
 
-            return jsonify({
+            return json_response({
                 "user": user.get_json_min()
             })
 
@@ -276,8 +393,9 @@ def route_drop_quest():
 
 #########################################################################################
 # DESCRIPTION
-# Assumed use: on user phone reboot or other session clear, the user will request a new
-# question.  This could be used to avoid particularly hard questions, watch logs for abuse
+# Assumed use: on user phone reboot or other session clear, the user will request the
+# current question again.  Questions are queued at quest start, so this serves the same
+# question (same answer order) rather than re-rolling it
 #
 # RETURN CASES
 # Error: if the user does not authenticate
@@ -301,12 +419,12 @@ def route_resume_quest():
         app.logger.info(incoming_request)
 
         # check authentication
-        user = authenticate_user(request)
+        user = request_user.get_user()
         if user:
             new_question = user.start_new_question()
             user.save()
 
-            return jsonify({
+            return json_response({
                 'user': user.get_json_min(),
                 'question': new_question.get_json_min()
             })
@@ -342,17 +460,17 @@ def route_submit_question():
     try:
         app.logger.info(request.json)
 
-        user = authenticate_user(request)
+        user = request_user.get_user()
         if user:
             quest_complete = (user.current_progress >= user.number_of_questions)
 
             if quest_complete:
-                return jsonify({
+                return json_response({
                     "user": user.get_json_min(),
                     "quest_complete": True
                 })
 
-            user_classroom = Classroom.get(Classroom.class_code == user.class_code)
+            user_classroom = user.get_classroom()
 
             correct_answer = user.current_answer_index
 
@@ -376,15 +494,19 @@ def route_submit_question():
 
             if quest_complete:
                 record_location(request, 0)
-                make_quest_log_entry(user, request)
-                if user.is_on_daily and user.is_eligible_for_daily(user_classroom):
-                    user.award_daily_rewards(user_classroom)
-                user_performance = user.calculate_user_performance()
-                user.drop_user_quest()
-                user.save()
+                # the quest log entry and the user's rewards/reset are committed together
+                with database.atomic():
+                    make_quest_log_entry(user, request)
+                    if user.is_on_daily and user.is_eligible_for_daily(user_classroom):
+                        user.award_daily_rewards(user_classroom)
+                    user_performance = user.calculate_user_performance()
+                    user.drop_user_quest()
+                    user.save()
+                # committed, the leaderboard can show the new total
+                record_points(user)
                 daily_info = get_daily_info(user)
 
-                return jsonify({
+                return json_response({
                     "user": user.get_json_min(),
                     "feedback": {
                         "is_correct": correct,
@@ -399,8 +521,9 @@ def route_submit_question():
             else:
                 new_question = user.start_new_question()
                 user.save()
+                record_points(user)
 
-                return jsonify({
+                return json_response({
                     "user": user.get_json_min(),
                     "feedback": {
                         "is_correct": correct,
@@ -442,12 +565,14 @@ def route_create_account():
         incoming_request = request
         app.logger.info(incoming_request)
 
-        user_information = get_token_info(request)
+        user_information = request_user.get_identity(
+            required_fields=('user_id', 'given_name', 'family_name', 'email')
+        )
         if user_information:
             app.logger.info(user_information)
-            user_id = str(user_information['identities'][0]['user_id'])
+            user_id = user_information['user_id']
 
-            if User.select().where(User.user_id == user_id).count():
+            if request_user.exists():
                 print('aborting')
                 return abort(500, "Error: user already exists.")
             class_code = request.json['class_code']
@@ -465,15 +590,18 @@ def route_create_account():
                 total_points=0,
                 reward_level=0,
                 multiplier=1,
-                user_role=0
+                user_role=0,
+                dailies_complete_count=0,
+                dailies_complete_date=datetime.date.today()
             )
+            request_user.set_user(new_user)
 
             if new_user:
                 daily_info = get_daily_info(new_user)
-                rewards = get_rewards(new_user)
-                quest_options = get_quest_options()
+                rewards = get_rewards_json(new_user)
+                quest_options = get_quest_options_json()
 
-                return jsonify({
+                return json_response({
                     "user": new_user.get_json_min(),
                     "daily_status": daily_info,
                     'rewards': rewards,
@@ -508,11 +636,11 @@ def route_get_daily():
     try:
         app.logger.info(request.json)
 
-        user = authenticate_user(request)
+        user = request_user.get_user(daily_info_fields)
         if user:
             daily_info = get_daily_info(user)
 
-            return jsonify({
+            return json_response({
                 'daily_status': daily_info
             })
         else:
@@ -546,12 +674,12 @@ def route_sign_agreement():
     try:
         app.logger.info(request.json)
         choice = request.json['agreement_choice']
-        user = authenticate_user(request)
+        user = request_user.get_user()
         if user:
             user.sign_agreement(choice)
             user.save()
 
-            return jsonify({
+            return json_response({
                 'user': user.get_json_min()
             })
         else:
@@ -563,6 +691,49 @@ def route_sign_agreement():
         return abort(500, "Error. If this error persists, please contact an admin")
 
 
+#########################################################################################
+# DESCRIPTION
+# leaderboard for the user's classroom
+#
+# RETURN CASES
+# top entries, entries around the user and the user's rank
+# 403 if the user can't be authenticated
+#
+# TAKES
+# optional "top" and "around" counts in the request json
+#
+# RETURNS
+# {"leaderboard": {"top", "around_me", "my_rank", "class_size"}}
+#########################################################################################
+
+
+@app.route('/api/v1/leaderboard/get', methods=['POST'])
+@requires_auth
+def route_get_leaderboard():
+    try:
+        app.logger.info(request.json)
+        options = request.json or {}
+
+        user = request_user.get_user(leader_board_fields)
+        if user:
+            leader_board = get_leader_board(
+                user,
+                top=options.get('top', 10),
+                around=options.get('around', 5)
+            )
+
+            return json_response({
+                'leaderboard': leader_board
+            })
+        else:
+            return abort(403, "Unable to authenticate user")
+
+    except Exception as ex:
+        app.logger.error("Something went wrong, error: ")
+        app.logger.error(ex)
+        return abort(500, "Error. If this error persists, please contact an admin")
+
+
 # -------------------------------------------------------------
 # Professor client routes
 # -------------------------------------------------------------
@@ -587,16 +758,20 @@ def route_sign_agreement():
 @app.route('/api/v1/current_chapter/set', methods=['POST'])
 @requires_auth
 def route_set_chapter():
+    app.logger.info(request.json)
+    # checked outside the try, the except below would turn the 403 into a 500
+    user = request_user.get_user(('user_id', 'class_code'))
+    if not user:
+        return abort(403, "Unable to authenticate user")
+
     try:
-        app.logger.info(request.json)
         client_request = request.json
 
-        user = authenticate_user(request)
-        user_classroom = Classroom.get(Classroom.class_code == user.class_code)
+        user_classroom = load_classroom_for_update(user.class_code_id)
 
         user_classroom.current_chapter = client_request['chapter_index']
 
-        user_classroom.save()
+        save_classroom(user_classroom)
 
     except Exception as ex:
         app.logger.error("Something went wrong, error: ")
@@ -683,6 +858,35 @@ def route_set_chapter():
 #
 #########################################################################################
 
+# -------------------------------------------------------------
+# Operations routes
+# -------------------------------------------------------------
+
+#########################################################################################
+# DESCRIPTION
+# prometheus scrape target, request counts, latency histograms and error counts by route,
+# auth error codes, database pool and cache statistics, summed over every uWSGI process
+#
+# RETURN CASES
+# 403 when the client address is not in metrics_allowed_addresses
+# otherwise the metrics in the prometheus text format
+#
+# TAKES
+# nothing
+#
+# RETURNS
+# text/plain; version=0.0.4
+#
+#########################################################################################
+
+
+@app.route('/metrics', methods=['GET'])
+def route_metrics():
+    if request.remote_addr not in metrics_allowed_addresses:
+        return abort(403, "Forbidden")
+
+    return app.response_class(app_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # -------------------------------------------------------------
 # Runs the actual server
 # -------------------------------------------------------------
@@ -1,11 +1,20 @@
+import base64
 import datetime
+import hashlib
+import json
+import time
 import requests
 from user_agents import parse
 
 from business_objects.Models import *
 from business_objects.User import User
+from business_objects.Leaderboard import get_leaderboard
 
 import config as config
+from cache import LruTtlCache, VersionedCache, MISSING
+from rest_json import pre_encode_json
+from log_writer import AnalyticsWriter
+from request_metrics import timed
 
 #########################################################################################
 # DESCRIPTION
@@ -26,14 +35,17 @@ import config as config
 #########################################################################################
 
 
+def get_bearer_token(client_request):
+    return client_request.headers.get('authorization').replace("Bearer ", "", 1)
+
+
 def get_token_info(client_request):
     try:
-        token = client_request.headers.get('authorization').replace("Bearer ", "", 1)
+        token = get_bearer_token(client_request)
         # print(token)
 
-        auth0_endpoint = "https://zhl146.auth0.com/tokeninfo"
-
-        response = (requests.post(auth0_endpoint, data={'id_token': token})).json()
+        with timed('http'):
+            response = (requests.post(config.auth0_tokeninfo_endpoint, data={'id_token': token})).json()
 
         # print(response)
         return response
@@ -42,40 +54,334 @@ def get_token_info(client_request):
         print(ex)
 
 
-def authenticate_user(client_request):
-    user_information = get_token_info(client_request)
-    if user_information:
-        # print(user_information)
-        user_id = str(user_information['identities'][0]['user_id'])
-        user = User.get(User.user_id == user_id)
-        if user:
-            return user
-        else:
-            return False
-
 #########################################################################################
 # DESCRIPTION
-#
+# get_token_info behind a per-process cache keyed by a hash of the bearer token
+# successful lookups live until the jwt "exp" claim (capped by config), failures are
+# negatively cached for a few seconds
 #
 # RETURN CASES
+# cached or fresh tokeninfo json
+# None if auth0 could not resolve the token (possibly cached)
+#
+# TAKES
+# client request with a bearer token
+#
+# RETURNS
+# user information json
+# None
+#########################################################################################
+
+token_info_cache = LruTtlCache(config.token_info_cache_size)
+
+token_info_remote_stats = {
+    'calls': 0,
+    'seconds': 0.0
+}
+
+
+def get_token_expiry(token):
+    # the signature was already checked in requires_auth, only the exp claim is needed here
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload).decode('utf-8')).get('exp')
+    except Exception:
+        return None
+
+
+def get_cached_token_info(client_request):
+    token = get_bearer_token(client_request)
+    cache_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    token_info = token_info_cache.get(cache_key)
+    if token_info is not MISSING:
+        return token_info
+
+    start = time.perf_counter()
+    token_info = get_token_info(client_request)
+    token_info_remote_stats['calls'] += 1
+    token_info_remote_stats['seconds'] += time.perf_counter() - start
+
+    if isinstance(token_info, dict) and token_info.get('identities'):
+        ttl = config.token_info_cache_max_ttl
+        expiry = get_token_expiry(token)
+        if expiry is not None:
+            ttl = min(ttl, expiry - time.time())
+        if ttl > 0:
+            token_info_cache.put(cache_key, token_info, ttl)
+    else:
+        token_info = None
+        token_info_cache.put(cache_key, None, config.token_info_negative_ttl)
+
+    return token_info
+
+
+def get_token_info_cache_stats():
+    stats = token_info_cache.stats()
+    remote_calls = token_info_remote_stats['calls']
+    remote_seconds = token_info_remote_stats['seconds']
+    stats['remote_calls'] = remote_calls
+    stats['remote_seconds'] = remote_seconds
+    stats['estimated_seconds_saved'] = stats['hits'] * remote_seconds / remote_calls if remote_calls else 0.0
+    return stats
+
+
+# only used when the verified jwt does not carry the claims we need
+# swap it out with set_token_info_resolver to run without auth0 (local runs, benchmarks)
+token_info_resolver = get_cached_token_info
+
+
+def set_token_info_resolver(resolver):
+    global token_info_resolver
+    token_info_resolver = resolver
+
+#########################################################################################
+# DESCRIPTION
+# resolves who the user is, preferring the jwt payload that requires_auth already verified
+# and only falling back to the token info resolver (auth0 /tokeninfo) when claims are missing
 #
+# RETURN CASES
+# identity dict built from the claims if every required field is present
+# identity dict built from the token info resolver otherwise
+# None if neither source can identify the user
 #
 # TAKES
+# client request, verified jwt payload (current_user), fields the caller needs
+#
+# RETURNS
+# {"user_id", "given_name", "family_name", "email"} dict
+# None
+#########################################################################################
+
+
+def identity_from_claims(claims):
+    if not claims or not claims.get('sub'):
+        return None
+
+    # auth0 subjects look like "google-oauth2|1234", tokeninfo identities only hold the "1234" part
+    return {
+        'user_id': str(claims['sub'].split('|', 1)[-1]),
+        'given_name': claims.get('given_name'),
+        'family_name': claims.get('family_name'),
+        'email': claims.get('email')
+    }
+
+
+def identity_from_token_info(token_info):
+    if not token_info or not token_info.get('identities'):
+        return None
+
+    return {
+        'user_id': str(token_info['identities'][0]['user_id']),
+        'given_name': token_info.get('given_name'),
+        'family_name': token_info.get('family_name'),
+        'email': token_info.get('email')
+    }
+
+
+def get_user_identity(client_request, claims=None, required_fields=('user_id',)):
+    identity = identity_from_claims(claims)
+    if identity and all(identity[field] is not None for field in required_fields):
+        return identity
+
+    return identity_from_token_info(token_info_resolver(client_request))
+
+#########################################################################################
+# DESCRIPTION
+# the authenticated user of one request, attached next to current_user by requires_auth
+# identity is resolved once and the users row is read at most once per projection,
+# lazily, the first time a route asks for it, an identity resolved for some fields serves
+# every later call that needs no more than those (create-account asks for the most first)
 #
+# read-only routes can ask for a few columns (e.g. daily_info_fields) instead of all of
+# them, a projected user is only handed out for the same projection, asking for the full
+# row loads it (and from then on it serves every projection)
+#
+# RETURN CASES
+# User (full or projected) if the identity resolves and the row exists
+# None otherwise
+#
+# TAKES
+# client request, verified jwt payload (current_user)
 #
 # RETURNS
+# User
+# None
+#########################################################################################
+
+
+class RequestUserLoader:
+
+    def __init__(self, client_request, claims=None):
+        self.__request = client_request
+        self.__claims = claims
+        self.__identity = MISSING
+        self.__identity_fields = frozenset()
+        self.__user = MISSING
+        self.__projected_users = {}
+
+    def get_identity(self, required_fields=('user_id',)):
+        if self.__identity is MISSING or not self.__identity_fields.issuperset(required_fields):
+            self.__identity = get_user_identity(self.__request, self.__claims, required_fields)
+            self.__identity_fields = self.__identity_fields.union(required_fields)
+        return self.__identity
+
+    def get_user(self, fields=None):
+        if self.__user is not MISSING:
+            return self.__user
+
+        identity = self.get_identity()
+        if not identity:
+            return None
+
+        if fields is None:
+            self.__user = User.select().where(User.user_id == identity['user_id']).first()
+            return self.__user
+
+        fields = tuple(fields)
+        if fields not in self.__projected_users:
+            self.__projected_users[fields] = (User
+                                              .select(*[getattr(User, name) for name in fields])
+                                              .where(User.user_id == identity['user_id'])
+                                              .first()
+                                              )
+        return self.__projected_users[fields]
+
+    def exists(self):
+        if self.__user is not MISSING:
+            return self.__user is not None
+        if self.__projected_users:
+            return next(iter(self.__projected_users.values())) is not None
+        return self.get_user(('user_id',)) is not None
+
+    def set_user(self, user):
+        # e.g. right after the account was created
+        self.__user = user
+        self.__projected_users = {}
+
+#########################################################################################
+# DESCRIPTION
+# chapter and question count options for the quest selection screen, cached per process
+# together with their serialized json (rest_json.pre_encode_json, the plain dict with orjson)
+#
+# RETURN CASES
+# cached options, reloaded when the "chapters" version stamp changes
+#
+# TAKES
+# nothing
 #
+# RETURNS
+# quest options dict (get_quest_options)
+# PreEncodedJson of the same options, or the same dict with orjson (get_quest_options_json)
 #########################################################################################
 
 
-def get_quest_options():
+def load_quest_options():
     chapter_list = []
     for chapter in Chapter.select():
         chapter_list.append(chapter.get_json_min())
-    return {
+    quest_options = {
         'chapter_options': chapter_list,
         'number_of_questions_options': config.number_of_question_options
     }
+    return quest_options, pre_encode_json(quest_options)
+
+
+# chapters only change when an importer runs, which bumps the "chapters" version stamp
+quest_options_cache = VersionedCache(
+    load_quest_options,
+    lambda: CacheVersion.get_version('chapters'),
+    config.cache_version_check_interval
+)
+
+
+def get_quest_options():
+    return quest_options_cache.get()[0]
+
+
+def get_quest_options_json():
+    return quest_options_cache.get()[1]
+
+#########################################################################################
+# DESCRIPTION
+# analytics rows are handed to the background writer (see log_writer.py) unless it is
+# disabled in config, then they are inserted right away like before
+#
+# RETURN CASES
+# nothing
+#
+# TAKES
+# model class, dict of column values
+#
+# RETURNS
+# nothing
+#########################################################################################
+
+analytics_writer = AnalyticsWriter(
+    database,
+    [Location, ActivityLogEntry],
+    batch_size=config.analytics_batch_size,
+    flush_interval=config.analytics_flush_interval,
+    max_queue_size=config.analytics_queue_size,
+    enqueue_timeout=config.analytics_enqueue_timeout,
+    spill_path=config.analytics_spill_path,
+    replay_interval=config.analytics_replay_interval
+)
+
+
+def write_analytics_row(model, row):
+    if config.analytics_writer_enabled:
+        analytics_writer.insert(model, row)
+    else:
+        model.insert(**row).execute()
+
+
+def defer_analytics_call(function, *args):
+    if config.analytics_writer_enabled:
+        analytics_writer.defer(function, *args)
+    else:
+        function(*args)
+
+#########################################################################################
+# DESCRIPTION
+# user agent parsing is regex heavy and the same few device strings come in over and over,
+# so the parsed device info is cached per raw user agent string
+#
+# RETURN CASES
+# cached or freshly parsed device info
+#
+# TAKES
+# raw user agent string
+#
+# RETURNS
+# (device_type, device_family, device_model) tuple
+# device_type is 0 mobile, 1 tablet, 2 pc, -1 anything else
+#########################################################################################
+
+user_agent_cache = LruTtlCache(config.user_agent_cache_size)
+
+
+def parse_device_info(user_agent_string):
+    user_agent = parse(user_agent_string)
+    if user_agent.is_mobile:
+        device_type = 0
+    elif user_agent.is_tablet:
+        device_type = 1
+    elif user_agent.is_pc:
+        device_type = 2
+    else:
+        device_type = -1
+
+    return device_type, user_agent.device.family, user_agent.device.model
+
+
+def get_device_info(user_agent_string):
+    device_info = user_agent_cache.get(user_agent_string)
+    if device_info is MISSING:
+        device_info = parse_device_info(user_agent_string)
+        user_agent_cache.put(user_agent_string, device_info)
+    return device_info
 
 #########################################################################################
 # DESCRIPTION
@@ -96,25 +402,17 @@ def make_activity_log_entry(user, correct, request):
     try:
         # ip_address = request.remote_addr
         # request_json = request.json
-        user_agent = parse(request.user_agent.string)
-        if user_agent.is_mobile:
-            device_type = 0
-        elif user_agent.is_tablet:
-            device_type = 1
-        elif user_agent.is_pc:
-            device_type = 2
-        else:
-            device_type = -1
-
-        new_activity_log_entry = ActivityLogEntry(
+        device_type, device_family, device_model = get_device_info(request.user_agent.string)
+
+        write_analytics_row(ActivityLogEntry, dict(
             correct=correct,
             question_index=user.current_question_index,
             answer_index=user.current_answer_index,
             datetime=datetime.datetime.now(),
             datetime_quest_started=user.datetime_quest_started,
             datetime_question_started=user.datetime_question_started,
-            device_family=user_agent.device.family,
-            device_model=user_agent.device.model,
+            device_family=device_family,
+            device_model=device_model,
             device_type=device_type,
             # ip_address=ip_address,
             is_daily=user.is_on_daily,
@@ -123,8 +421,7 @@ def make_activity_log_entry(user, correct, request):
             # longitude=request_json['longitude'],
             number_of_questions=user.number_of_questions,
             user_id=user.user_id
-        )
-        new_activity_log_entry.save()
+        ))
     except Exception as ex:
         print(ex)
         print("failed too make activity log entry.")
@@ -145,63 +442,87 @@ def make_activity_log_entry(user, correct, request):
 
 
 def make_quest_log_entry(user, request):
-    try:
-        # ip_address = request.remote_addr
-        # request_json = request.json
-        user_agent = parse(request.user_agent.string)
-        if user_agent.is_mobile:
-            device_type = 0
-        elif user_agent.is_tablet:
-            device_type = 1
-        elif user_agent.is_pc:
-            device_type = 2
-        else:
-            device_type = -1
-
-        new_quest_log_entry = QuestLogEntry(
-            chapter_index=user.chapter_index_id,
-            cumulative=user.cumulative,
-            datetime_quest_completed=datetime.datetime.now(),
-            datetime_quest_started=user.datetime_quest_started,
-            device_family=user_agent.device.family,
-            device_model=user_agent.device.model,
-            device_type=device_type,
-            # ip_address=ip_address,
-            is_daily=user.is_on_daily,
-            is_timed=user.is_timed,
-            # latitude=request_json['latitude'],
-            # longitude=request_json['longitude'],
-            number_of_questions=user.number_of_questions,
-            user_id=user.user_id,
-            number_correct=user.number_correct
-        )
-        new_quest_log_entry.save()
-    except Exception as ex:
-        print(ex)
-        print("Failed to make quest log entry.")
+    # written right away (not through the analytics writer) so it can share the
+    # transaction of the quest completion, errors propagate and roll that back
+    # ip_address = request.remote_addr
+    # request_json = request.json
+    device_type, device_family, device_model = get_device_info(request.user_agent.string)
+
+    if user.is_on_daily:
+        user.record_daily_completion()
+
+    QuestLogEntry.insert(
+        chapter_index=user.chapter_index_id,
+        cumulative=user.cumulative,
+        datetime_quest_completed=datetime.datetime.now(),
+        datetime_quest_started=user.datetime_quest_started,
+        device_family=device_family,
+        device_model=device_model,
+        device_type=device_type,
+        # ip_address=ip_address,
+        is_daily=user.is_on_daily,
+        is_timed=user.is_timed,
+        # latitude=request_json['latitude'],
+        # longitude=request_json['longitude'],
+        number_of_questions=user.number_of_questions,
+        user_id=user.user_id,
+        number_correct=user.number_correct
+    ).execute()
 
 #########################################################################################
 # DESCRIPTION
-#
+# rewards of the user's classroom, cached per class code together with their serialized json
+# (rest_json.pre_encode_json, with orjson the plain list, encoded once per response)
+# rewards are only written by db_scripts/data_importer.py, which bumps the classroom's
+# "rewards:<class_code>" version stamp so every process reloads
 #
 # RETURN CASES
-#
+# cached rewards, reloaded when the classroom's version stamp changes
 #
 # TAKES
-#
+# user
 #
 # RETURNS
-#
+# list of reward json (get_rewards)
+# PreEncodedJson of the same list, or the same list with orjson (get_rewards_json)
 #########################################################################################
 
+rewards_caches = {}
 
-def get_rewards(user):
-    class_code = user.class_code_id
+
+def load_rewards(class_code):
     reward_list = []
     for reward in Reward.select().where(Reward.class_code == class_code):
         reward_list.append(reward.get_json_min())
 
-    return reward_list
+    return reward_list, pre_encode_json(reward_list)
+
+
+def rewards_version_name(class_code):
+    return 'rewards:{}'.format(class_code)
+
+
+def get_rewards_cache(class_code):
+    rewards_cache = rewards_caches.get(class_code)
+    if rewards_cache is None:
+        rewards_cache = rewards_caches.setdefault(class_code, VersionedCache(
+            lambda: load_rewards(class_code),
+            lambda: CacheVersion.get_version(rewards_version_name(class_code)),
+            config.cache_version_check_interval
+        ))
+    return rewards_cache
+
+
+def get_rewards(user):
+    return get_rewards_cache(user.class_code_id).get()[0]
+
+
+def get_rewards_json(user):
+    return get_rewards_cache(user.class_code_id).get()[1]
+
+
+def get_rewards_cache_stats():
+    return {class_code: rewards_cache.stats() for class_code, rewards_cache in rewards_caches.items()}
 
 #########################################################################################
 # DESCRIPTION
@@ -218,21 +539,13 @@ def get_rewards(user):
 #########################################################################################
 
 
+# columns get_daily_info (and the daily counter fallback) reads from the user
+daily_info_fields = ('user_id', 'class_code', 'dailies_complete_count', 'dailies_complete_date')
+
+
 def get_daily_info(user):
-    day_start = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
-    day_end = day_start.replace(hour=23, minute=59, second=59)
-
-    class_code = user.class_code_id
-    classroom = Classroom.get(Classroom.class_code == class_code)
-    dailies_complete = (
-        QuestLogEntry.select()
-        .where(
-            QuestLogEntry.user_id == user.user_id,
-            QuestLogEntry.is_daily == True,
-            QuestLogEntry.datetime_quest_completed.between(day_start, day_end)
-        )
-        .count()
-    )
+    classroom = user.get_classroom()
+    dailies_complete = user.get_dailies_complete()
     dailies_allowed = classroom.number_dailies_allowed
     current_chapter = classroom.current_chapter_id
     return {
@@ -244,27 +557,38 @@ def get_daily_info(user):
 
 #########################################################################################
 # DESCRIPTION
-#
+# leaderboard of the user's classroom, served from the in-memory board in
+# business_objects/Leaderboard.py instead of reading every user in the class
 #
 # RETURN CASES
-#
+# top entries and the entries around the user (both capped at leaderboard_max_entries)
+# the user's own saved points are always current, other users' can be up to
+# leaderboard_refresh_interval seconds old (see business_objects/Leaderboard.py)
 #
 # TAKES
-#
+# user object, number of top entries, number of entries above and below the user
 #
 # RETURNS
-#
+# {"top", "around_me", "my_rank", "class_size"} dict, entries are {rank, total_points, is_me}
 #########################################################################################
 
-def get_leader_board(user):
-    leader_board = []
-    class_code = user.class_code_id
+# columns get_leader_board reads from the user
+leader_board_fields = ('user_id', 'class_code', 'total_points')
 
-    all_users = User.select(User.class_code == class_code).order_by(-User.total_points)
-    for single_user in all_users:
-        leader_board.append(single_user.total_points)
 
-    return leader_board
+def get_leader_board(user, top=10, around=5):
+    top = max(0, min(int(top), config.leaderboard_max_entries))
+    around = max(0, min(int(around), config.leaderboard_max_entries // 2))
+    leaderboard = get_leaderboard(user.class_code_id)
+    # points this user earned through another process since the board was loaded
+    leaderboard.update(user.user_id, user.total_points)
+
+    return {
+        'top': leaderboard.get_top(top, user.user_id),
+        'around_me': leaderboard.get_around(user.user_id, around),
+        'my_rank': leaderboard.get_rank(user.user_id),
+        'class_size': len(leaderboard)
+    }
 
 #########################################################################################
 # DESCRIPTION
@@ -283,11 +607,11 @@ def get_leader_board(user):
 
 def record_location(request, action):
     request_json = request.json
-    Location.create(
+    write_analytics_row(Location, dict(
         latitude=request_json['latitude'],
         longitude=request_json['longitude'],
         action=action
-    )
+    ))
 
 #########################################################################################
 # DESCRIPTION
@@ -304,7 +628,25 @@ def record_location(request, action):
 #########################################################################################
 
 
+def increment_times_chosen(answer_counts):
+    # one atomic UPDATE per distinct amount, concurrent workers can't lose increments
+    indexes_by_amount = {}
+    for answer_index, amount in answer_counts.items():
+        indexes_by_amount.setdefault(amount, []).append(answer_index)
+
+    for amount, answer_indexes in indexes_by_amount.items():
+        (McChoice
+         .update(times_chosen=fn.COALESCE(McChoice.times_chosen, 0) + amount)
+         .where(McChoice.index << answer_indexes)
+         .execute()
+         )
+
+
+analytics_writer.register_counter('times_chosen', increment_times_chosen)
+
+
 def record_answer_choice(answer_index):
-    chosen_answer = McChoice.get(McChoice.index == answer_index)
-    chosen_answer.times_chosen += 1
-    chosen_answer.save()
+    if config.answer_choice_buffering and config.analytics_writer_enabled:
+        analytics_writer.increment('times_chosen', answer_index)
+    else:
+        defer_analytics_call(increment_times_chosen, {answer_index: 1})
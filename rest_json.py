@@ -0,0 +1,96 @@
+import json
+
+from werkzeug.http import http_date
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+#########################################################################################
+# DESCRIPTION
+# compact json encoding for api responses
+# the encoder is pluggable: orjson when it is installed, the standard library otherwise
+# (config.json_encoder picks one explicitly)
+#
+# parts of a payload that rarely change (quest options, rewards) can be serialized once
+# with pre_encode_json and are spliced into responses without being encoded again, only
+# with the standard library encoder: orjson encodes the whole response faster than the
+# splice costs, so with it pre_encode_json hands the value back as it is
+#
+# datetimes are written like flask's jsonify (http dates) unless config.json_datetime_format
+# is "iso", which lets orjson handle them natively
+#########################################################################################
+
+
+class PreEncodedJson:
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+
+def json_default(value):
+    if isinstance(value, PreEncodedJson):
+        # only reachable when a pre-encoded value is nested below the top level
+        return json.loads(value.encoded)
+    if hasattr(value, 'isoformat'):
+        if config.json_datetime_format == 'iso':
+            return value.isoformat()
+        if hasattr(value, 'timetuple'):
+            return http_date(value.timetuple())
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def encode_stdlib(value):
+    return json.dumps(value, separators=(',', ':'), default=json_default).encode('utf-8')
+
+
+def encode_orjson(value):
+    if config.json_datetime_format == 'iso':
+        return orjson.dumps(value, default=json_default)
+    return orjson.dumps(value, default=json_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+json_encoders = {
+    'stdlib': encode_stdlib
+}
+if orjson is not None:
+    json_encoders['orjson'] = encode_orjson
+
+encode_value = encode_stdlib
+
+
+def use_json_encoder(name):
+    global encode_value
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in json_encoders else 'stdlib'
+    encode_value = json_encoders[name]
+
+
+use_json_encoder(config.json_encoder)
+
+
+def encode_json(value):
+    if isinstance(value, PreEncodedJson):
+        return value.encoded
+    return encode_value(value)
+
+
+def pre_encode_json(value):
+    if encode_value is not encode_stdlib:
+        return value
+    return PreEncodedJson(encode_json(value))
+
+
+def encode_json_response(data):
+    # top level dict whose values may be pre-encoded
+    if not any(isinstance(value, PreEncodedJson) for value in data.values()):
+        return encode_value(data)
+
+    return b'{' + b','.join(
+        encode_value(key) + b':' + encode_json(value)
+        for key, value in data.items()
+    ) + b'}'
@@ -0,0 +1,680 @@
+# micro benchmarks for the hot paths of the rest api
+# run from the repository root: python testing/benchmarks.py <benchmark> [options]
+# correctness is covered by the tests next to this file (python -m pytest), these only time things
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubRequest:
+    def __init__(self, token):
+        self.headers = {'authorization': 'Bearer ' + token}
+
+
+def report(name, iterations, elapsed):
+    print("{:<40} {:>10} calls {:>10.1f} us/call {:>12.0f} calls/sec".format(
+        name,
+        iterations,
+        elapsed / iterations * 1000000,
+        iterations / elapsed
+    ))
+
+
+def time_calls(name, iterations, function):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    report(name, iterations, time.perf_counter() - start)
+
+#########################################################################################
+# identity resolution: verified jwt claims vs auth0 /tokeninfo
+# the remote path is stubbed with a fixed latency unless --remote is passed
+#########################################################################################
+
+
+def benchmark_identity(args):
+    import rest_functions
+
+    claims = {
+        'sub': 'google-oauth2|110169484474386276334',
+        'given_name': 'Ada',
+        'family_name': 'Lovelace',
+        'email': 'ada@example.com'
+    }
+    token_info = {
+        'identities': [{'user_id': '110169484474386276334'}],
+        'given_name': 'Ada',
+        'family_name': 'Lovelace',
+        'email': 'ada@example.com'
+    }
+
+    def stub_token_info(client_request):
+        time.sleep(args.latency / 1000)
+        return token_info
+
+    if not args.remote:
+        rest_functions.get_token_info = stub_token_info
+
+    client_request = StubRequest(args.token)
+
+    time_calls('identity from jwt claims', args.iterations, lambda: rest_functions.get_user_identity(
+        client_request, claims))
+
+    rest_functions.set_token_info_resolver(rest_functions.get_token_info)
+    time_calls('identity from tokeninfo', args.iterations, lambda: rest_functions.get_user_identity(
+        client_request, None))
+
+    rest_functions.set_token_info_resolver(rest_functions.get_cached_token_info)
+    time_calls('identity from cached tokeninfo', args.iterations, lambda: rest_functions.get_user_identity(
+        client_request, None))
+    print(rest_functions.get_token_info_cache_stats())
+
+#########################################################################################
+# per-request connection cost: connect/close on a plain MySQLDatabase (full handshake)
+# vs checkout/return on the pooled database, each cycle runs one trivial query
+# needs the mysql server from business_objects/Models.py
+#########################################################################################
+
+
+def benchmark_pool(args):
+    from peewee import MySQLDatabase
+    from business_objects.Database import MeteredPooledMySQLDatabase
+    from business_objects.Models import database_settings
+
+    def request_cycle(database):
+        database.connect()
+        database.execute_sql('SELECT 1')
+        database.close()
+
+    plain_database = MySQLDatabase('testdb', **database_settings)
+    time_calls('connect per request', args.iterations, lambda: request_cycle(plain_database))
+
+    pooled_database = MeteredPooledMySQLDatabase('testdb', max_connections=1, **database_settings)
+    time_calls('pooled connection per request', args.iterations, lambda: request_cycle(pooled_database))
+    print(pooled_database.get_pool_stats())
+    pooled_database.close_all()
+
+#########################################################################################
+# question selection over a synthetic bank, no database needed
+# in-memory question index vs the ORDER BY RAND() equivalent (shuffle the whole chapter)
+#########################################################################################
+
+
+def synthetic_question_bank(number_of_prompts, number_of_chapters, choices_per_prompt):
+    prompt_rows = []
+    choice_rows = []
+    choice_index = 0
+    for prompt_index in range(number_of_prompts):
+        chapter_index = prompt_index % number_of_chapters + 1
+        prompt_rows.append((prompt_index, chapter_index, 1, 'prompt {}'.format(prompt_index)))
+        for choice_number in range(choices_per_prompt):
+            choice_rows.append((choice_index, prompt_index, choice_number < 2))
+            choice_index += 1
+    return prompt_rows, choice_rows
+
+
+def benchmark_question_index(args):
+    import random
+    import tracemalloc
+    from business_objects.questions.QuestionIndex import QuestionIndex
+
+    prompt_rows, choice_rows = synthetic_question_bank(args.prompts, args.chapters, args.choices)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = QuestionIndex()
+    index.load(prompt_rows, choice_rows)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('built index of {} prompts in {:.2f}s using {:.1f} MB'.format(index.size(), elapsed, memory / 1e6))
+
+    time_calls('pick from question index', args.iterations, lambda: index.pick(
+        random.randint(1, args.chapters), 1, 3))
+
+    chapter_rows = [row for row in prompt_rows if row[1] == 1]
+
+    def order_by_rand():
+        return sorted(chapter_rows, key=lambda row: random.random())[0]
+
+    time_calls('ORDER BY RAND() equivalent', max(1, args.iterations // 100), order_by_rand)
+
+#########################################################################################
+# definition questions per second against the configured database
+#########################################################################################
+
+
+def benchmark_definitions(args):
+    from business_objects.Models import database
+    from business_objects.questions.DefinitionQuestion import DefinitionQuestion
+
+    database.connect()
+    for question_type in (0, 1):
+        time_calls('definition question type {}'.format(question_type), args.iterations,
+                   lambda: DefinitionQuestion().make_definition_question(args.chapter, question_type=question_type))
+    database.close()
+
+#########################################################################################
+# concurrent times_chosen increments against the configured database
+# several processes (like uWSGI workers) increment the same choice, half through the
+# direct atomic UPDATE and half through the buffered counter, then the total is checked
+#########################################################################################
+
+
+def increment_answer_choice(answer_index, increments, buffered):
+    import rest_functions
+    from business_objects.Models import database
+
+    config = rest_functions.config
+    config.answer_choice_buffering = buffered
+    for _ in range(increments):
+        if buffered:
+            rest_functions.record_answer_choice(answer_index)
+        else:
+            rest_functions.increment_times_chosen({answer_index: 1})
+    rest_functions.analytics_writer.stop()
+    database.close()
+
+
+def benchmark_answer_counter(args):
+    import multiprocessing
+    from business_objects.Models import database, McChoice
+
+    def times_chosen():
+        database.connect()
+        value = McChoice.get(McChoice.index == args.choice).times_chosen or 0
+        database.close()
+        return value
+
+    before = times_chosen()
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=increment_answer_choice, args=(args.choice, args.increments, number % 2 == 1))
+        for number in range(args.processes)
+    ]
+
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    report('times_chosen increments', args.processes * args.increments, time.perf_counter() - start)
+
+    after = times_chosen()
+    expected = before + args.processes * args.increments
+    print('times_chosen {} -> {}, expected {}: {}'.format(
+        before, after, expected, 'OK' if after == expected else 'LOST UPDATES'))
+    if after != expected:
+        sys.exit(1)
+
+#########################################################################################
+# device info per submit: parsing the user agent every time vs the user agent cache
+#########################################################################################
+
+USER_AGENTS = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 10_3_1 like Mac OS X) AppleWebKit/603.1.30 '
+    '(KHTML, like Gecko) Mobile/14E304',
+    'Mozilla/5.0 (Linux; Android 7.0; SM-G930V Build/NRD90M) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/59.0.3071.125 Mobile Safari/537.36',
+    'Mozilla/5.0 (iPad; CPU OS 10_3_2 like Mac OS X) AppleWebKit/603.2.4 (KHTML, like Gecko) Mobile/14F89',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/60.0.3112.90 Safari/537.36'
+]
+
+
+def benchmark_user_agent(args):
+    import rest_functions
+
+    user_agents = [USER_AGENTS[number % len(USER_AGENTS)] for number in range(args.iterations)]
+
+    start = time.perf_counter()
+    for user_agent in user_agents:
+        rest_functions.parse_device_info(user_agent)
+    report('parse user agent', args.iterations, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for user_agent in user_agents:
+        rest_functions.get_device_info(user_agent)
+    report('cached user agent', args.iterations, time.perf_counter() - start)
+    print(rest_functions.user_agent_cache.stats())
+
+#########################################################################################
+# what a mid-quest submit writes to the users row: every column (plain save) vs only the
+# changed columns, measured on the generated UPDATE statement, no database needed
+#########################################################################################
+
+
+def update_size(query):
+    sql, params = query.sql()
+    return len(sql.encode('utf-8')) + sum(len(str(param).encode('utf-8')) for param in params)
+
+
+def benchmark_user_writes(args):
+    import datetime
+    from business_objects.User import User
+
+    class StubClassroom:
+        max_multiplier = 5
+
+    now = datetime.datetime.now()
+    user = User(
+        user_id='110169484474386276334', first_name='Ada', last_name='Lovelace', e_mail='ada@example.com',
+        class_code='A1B2C3D4E5', chapter_index=3, completion_points=0, cumulative=1, current_progress=4,
+        current_answer_index=5120, current_question_index=1033, datetime_quest_started=now,
+        datetime_question_started=now, is_on_daily=0, is_timed=1, multiplier=2, number_correct=3,
+        number_of_questions=25, points_earned_current_quest=80, points_per_question=16, question_type=1,
+        reward_level=1, total_points=15230, user_role=0, research_agreement_status=1,
+        dailies_complete_count=1, dailies_complete_date=now.date()
+    )
+    # as if loaded from the database, nothing dirty yet
+    user._dirty.clear()
+
+    # what route_submit_question changes for a correct answer mid-quest
+    user.award_question_points(StubClassroom())
+    user.update_quest_progress()
+    user.current_answer_index = 5131
+    user.current_question_index = 1041
+    user.datetime_question_started = datetime.datetime.now()
+
+    all_fields = {name: value for name, value in user._data.items() if name != 'user_id'}
+    full_update = User.update(**all_fields).where(User.user_id == user.user_id)
+
+    changed_fields = {field.name: user._data[field.name] for field in user.dirty_fields}
+    changed_update = User.update(**changed_fields).where(User.user_id == user.user_id)
+
+    print('full save:     {} columns, {} bytes per submit'.format(len(all_fields), update_size(full_update)))
+    print('changed only:  {} columns, {} bytes per submit'.format(len(changed_fields), update_size(changed_update)))
+    print('rows written per submit: 1 users row in both cases')
+
+#########################################################################################
+# response serialization for representative /status/get and /question/submit payloads:
+# jsonify in debug (indented stdlib), each registered encoder, and pre-encoded quest options and rewards
+#########################################################################################
+
+
+def representative_payloads():
+    user = {
+        'user_id': '110169484474386276334', 'first_name': 'Ada', 'last_name': 'Lovelace', 'chapter_index': 3,
+        'completion_points': 0, 'cumulative': 1, 'current_progress': 4, 'current_question_index': 1033,
+        'is_on_daily': 0, 'is_timed': 1, 'multiplier': 2, 'number_correct': 3, 'number_of_questions': 25,
+        'points_earned_current_quest': 80, 'points_per_question': 16, 'question_type': 1, 'reward_level': 1,
+        'total_points': 15230, 'research_agreement_status': 1
+    }
+    rewards = [
+        {'required_points': 20000 * number, 'reward_name': 'Milestone {}'.format(number),
+         'reward_description': 'If you reach this milestone you will receive a bonus for this module.'}
+        for number in range(1, 11)
+    ]
+    quest_options = {
+        'chapter_options': [
+            {'chapter_index': number, 'chapter_name': 'Chapter {} of the textbook'.format(number)}
+            for number in range(1, 21)
+        ],
+        'number_of_questions_options': [10, 25, 50]
+    }
+    status = {
+        'user': user,
+        'daily_status': {'dailies_complete': 1, 'dailies_allowed': 3, 'daily_chapter': 4},
+        'rewards': rewards,
+        'quest_options': quest_options
+    }
+    submit = {
+        'user': user,
+        'feedback': {'is_correct': True, 'correct_answer': 5120, 'user_answer': 5120},
+        'question': {
+            'prompt': 'Substance composed of atoms with identical atomic number',
+            'answers': [{'text': 'answer text number {}'.format(number), 'index': 5120 + number}
+                        for number in range(4)],
+            'chapter_index': 3
+        },
+        'quest_complete': False
+    }
+    return status, submit
+
+
+def benchmark_serialization(args):
+    import json
+    import rest_json
+
+    status, submit = representative_payloads()
+
+    for name, payload in (('/status/get', status), ('/question/submit', submit)):
+        time_calls('{} jsonify debug'.format(name), args.iterations,
+                   lambda: json.dumps(payload, indent=2, separators=(', ', ': ')))
+        for encoder in sorted(rest_json.json_encoders):
+            rest_json.use_json_encoder(encoder)
+            time_calls('{} {}'.format(name, encoder), args.iterations,
+                       lambda: rest_json.encode_json_response(payload))
+            if payload is status:
+                # as the caches hold them, pre_encode_json leaves them alone with orjson
+                pre_encoded_status = dict(status, quest_options=rest_json.pre_encode_json(status['quest_options']),
+                                          rewards=rest_json.pre_encode_json(status['rewards']))
+                time_calls('{} {} pre-encoded'.format(name, encoder), args.iterations,
+                           lambda: rest_json.encode_json_response(pre_encoded_status))
+
+#########################################################################################
+# get_json_min vs the old pop-from-_data serializer (timed on a copy, so the instance stays
+# intact between calls), get_json_min must not be slower, no database needed
+#########################################################################################
+
+
+def legacy_json_min(instance, key_list):
+    # what get_json_min used to do, on a copy so it can run repeatedly
+    data = dict(instance._data)
+    for key in key_list:
+        data.pop(key, None)
+    return data
+
+
+def benchmark_json_min(args):
+    from business_objects.Models import Reward
+    from business_objects.User import User
+
+    status, _ = representative_payloads()
+    user = User(class_code='A1B2C3D4E5', e_mail='ada@example.com', user_role=0, current_answer_index=5120,
+                **status['user'])
+    # as if loaded from the database, nothing dirty yet
+    user._dirty.clear()
+    reward = Reward(class_code='A1B2C3D4E5', id=7, **status['rewards'][0])
+
+    time_calls('User legacy get_json_min', args.iterations, lambda: legacy_json_min(user, User.json_excluded_fields))
+    time_calls('User get_json_min', args.iterations, user.get_json_min)
+    time_calls('Reward legacy get_json_min', args.iterations, lambda: legacy_json_min(
+        reward, Reward.json_excluded_fields))
+    time_calls('Reward get_json_min', args.iterations, reward.get_json_min)
+
+
+#########################################################################################
+# per-classroom leaderboard: building a board, point updates, top-N, around-me and rank
+# lookups against a synthetic class
+#########################################################################################
+
+
+def benchmark_leaderboard(args):
+    import random
+    from business_objects.Leaderboard import Leaderboard
+
+    users = [('user-{}'.format(number), random.randint(0, 10000)) for number in range(args.users)]
+    points = dict(users)
+
+    start = time.perf_counter()
+    leaderboard = Leaderboard(users)
+    print("built board of {} users in {:.1f} ms".format(len(leaderboard), (time.perf_counter() - start) * 1000))
+
+    updates = []
+    for _ in range(args.iterations):
+        user_id = 'user-{}'.format(random.randrange(args.users))
+        points[user_id] += random.randint(1, 50)
+        updates.append((user_id, points[user_id]))
+
+    start = time.perf_counter()
+    for user_id, total_points in updates:
+        leaderboard.update(user_id, total_points)
+    report('update points', args.iterations, time.perf_counter() - start)
+
+    user_ids = [user_id for user_id, _ in updates]
+    time_calls('top 10', args.iterations, lambda: leaderboard.get_top(10))
+    time_calls('around me +-5', args.iterations, lambda: leaderboard.get_around(random.choice(user_ids), 5))
+    time_calls('rank lookup', args.iterations, lambda: leaderboard.get_rank(random.choice(user_ids)))
+
+
+#########################################################################################
+# question bank import: row by row create() (the old data_importer) vs the bulk importer,
+# on a synthetic book written to a temporary definitions file and imported into sqlite
+# files, then the same book re-imported (nothing to insert, every row compared)
+#########################################################################################
+
+
+def synthetic_book(number_of_chapters, prompts_per_chapter, correct, incorrect):
+    return {'book': [
+        {
+            'index': chapter_index,
+            'name': 'Chapter {}'.format(chapter_index),
+            'questions': [
+                {
+                    'question_text': 'prompt {}-{}'.format(chapter_index, prompt_number),
+                    'correct_answers': ['correct {}'.format(number) for number in range(correct)],
+                    'incorrect_answers': ['incorrect {}'.format(number) for number in range(incorrect)]
+                }
+                for prompt_number in range(prompts_per_chapter)
+            ]
+        }
+        for chapter_index in range(1, number_of_chapters + 1)
+    ]}
+
+
+def legacy_import(chapters):
+    from business_objects.Models import Chapter, McPrompt, McChoice
+
+    rows = 0
+    question_index = 0
+    for chapter in chapters:
+        Chapter.create(chapter_index=chapter['index'], chapter_name=chapter['name'])
+        rows += 1
+        for question in chapter['questions']:
+            McPrompt.create(index=question_index, text=question['question_text'],
+                            chapter_index=chapter['index'], type=1)
+            rows += 1
+            for answer_text in question['correct_answers']:
+                McChoice.create(question_index=question_index, text=answer_text, correct=True)
+                rows += 1
+            for answer_text in question['incorrect_answers']:
+                McChoice.create(question_index=question_index, text=answer_text, correct=False)
+                rows += 1
+            question_index += 1
+    return rows
+
+
+def benchmark_import(args):
+    import json
+    import tempfile
+    from peewee import SqliteDatabase, Using
+    from business_objects.Models import Chapter, McPrompt, McChoice
+    from db_scripts.question_bank_importer import QuestionBankImporter
+
+    models = [Chapter, McPrompt, McChoice]
+    directory = tempfile.mkdtemp()
+    definitions_path = os.path.join(directory, 'definitions.json')
+    with open(definitions_path, 'w') as definitions_file:
+        json.dump(synthetic_book(args.chapters, args.prompts, args.correct, args.incorrect), definitions_file)
+    print("synthetic definitions file: {:.1f} MB".format(os.path.getsize(definitions_path) / 1e6))
+
+    with open(definitions_path) as definitions_file:
+        chapters = json.load(definitions_file)['book']
+
+    legacy_database = SqliteDatabase(os.path.join(directory, 'legacy.db'))
+    with Using(legacy_database, models, with_transaction=False):
+        legacy_database.create_tables(models)
+        start = time.perf_counter()
+        rows = legacy_import(chapters[:args.legacy_chapters])
+        elapsed = time.perf_counter() - start
+    print("{:<40} {:>10} rows {:>10.2f} s {:>12.0f} rows/sec".format('row by row create()', rows, elapsed,
+                                                                     rows / elapsed))
+
+    bulk_database = SqliteDatabase(os.path.join(directory, 'bulk.db'))
+    with Using(bulk_database, models, with_transaction=False):
+        bulk_database.create_tables(models)
+        stats = QuestionBankImporter(batch_size=args.batch_size).run(chapters)
+        print("{:<40} {:>10} rows {:>10.2f} s {:>12.0f} rows/sec".format('bulk import', stats['inserted'],
+                                                                         stats['seconds'],
+                                                                         stats['rows_per_second']))
+
+        stats = QuestionBankImporter(batch_size=args.batch_size).run(chapters)
+        print("re-import: {inserted} inserted, {updated} updated, {unchanged} unchanged in {seconds:.2f}s"
+              .format(**stats))
+
+
+#########################################################################################
+# peak memory of reading a large definitions file: json.load vs the streaming reader in
+# db_scripts/json_stream.py, each in a fresh process so their peaks don't mix
+# the synthetic file is written a question at a time, so generating it is cheap on memory too
+#########################################################################################
+
+
+def write_synthetic_definitions(path, megabytes, prompts_per_chapter, correct, incorrect):
+    import json
+
+    target_size = megabytes * 1000000
+    written = 0
+    chapter_index = 0
+    with open(path, 'w') as definitions_file:
+        definitions_file.write('{"book": [')
+        while written < target_size:
+            chapter_index += 1
+            chapter_start = '{}{{"index": {}, "name": "Chapter {}", "questions": ['.format(
+                ', ' if chapter_index > 1 else '', chapter_index, chapter_index)
+            definitions_file.write(chapter_start)
+            written += len(chapter_start)
+            for prompt_number in range(prompts_per_chapter):
+                question = json.dumps({
+                    'question_text': 'prompt {}-{}'.format(chapter_index, prompt_number),
+                    'correct_answers': ['correct answer {} of {}'.format(number, prompt_number)
+                                        for number in range(correct)],
+                    'incorrect_answers': ['incorrect answer {} of {}'.format(number, prompt_number)
+                                          for number in range(incorrect)]
+                })
+                definitions_file.write((', ' if prompt_number else '') + question)
+                written += len(question) + 2
+                if written >= target_size:
+                    break
+            definitions_file.write(']}')
+        definitions_file.write(']}')
+
+
+def read_definitions(reader, path, results):
+    import json
+    import resource
+    from db_scripts.json_stream import read_book_chapters
+
+    start = time.perf_counter()
+    chapters = 0
+    questions = 0
+    with open(path) as definitions_file:
+        if reader == 'json.load':
+            book = json.load(definitions_file)['book']
+        elif reader == 'stream':
+            book = read_book_chapters(definitions_file)
+        else:
+            book = []
+        for chapter in book:
+            chapters += 1
+            for _ in chapter['questions']:
+                questions += 1
+
+    results.put({
+        'reader': reader,
+        'chapters': chapters,
+        'questions': questions,
+        'seconds': time.perf_counter() - start,
+        # kilobytes on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+
+def benchmark_definitions_memory(args):
+    import multiprocessing
+    import tempfile
+
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'definitions.json')
+    if not os.path.exists(path):
+        write_synthetic_definitions(path, args.megabytes, args.prompts, args.correct, args.incorrect)
+    print("definitions file: {} ({:.0f} MB)".format(path, os.path.getsize(path) / 1e6))
+
+    # spawn, not fork, so every reader starts from the same fresh interpreter
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    for reader in ['none'] + args.readers.split(','):
+        process = context.Process(target=read_definitions, args=(reader, path, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print("{:<12} failed with exit code {} (out of memory?)".format(reader, process.exitcode))
+            continue
+        result = results.get()
+        print("{reader:<12} {chapters:>8} chapters {questions:>10} questions {seconds:>8.1f} s "
+              "{peak_rss_mb:>10.0f} MB peak rss".format(**result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    identity_parser = subparsers.add_parser('identity')
+    identity_parser.add_argument('--iterations', type=int, default=200)
+    identity_parser.add_argument('--latency', type=float, default=80, help='simulated tokeninfo latency in ms')
+    identity_parser.add_argument('--remote', action='store_true', help='call the real auth0 endpoint')
+    identity_parser.add_argument('--token', default='', help='id token to send with --remote')
+    identity_parser.set_defaults(run=benchmark_identity)
+
+    pool_parser = subparsers.add_parser('pool')
+    pool_parser.add_argument('--iterations', type=int, default=500)
+    pool_parser.set_defaults(run=benchmark_pool)
+
+    question_index_parser = subparsers.add_parser('question-index')
+    question_index_parser.add_argument('--iterations', type=int, default=100000)
+    question_index_parser.add_argument('--prompts', type=int, default=100000)
+    question_index_parser.add_argument('--chapters', type=int, default=20)
+    question_index_parser.add_argument('--choices', type=int, default=10, help='choices per prompt, 2 correct')
+    question_index_parser.set_defaults(run=benchmark_question_index)
+
+    definitions_parser = subparsers.add_parser('definitions')
+    definitions_parser.add_argument('--iterations', type=int, default=1000)
+    definitions_parser.add_argument('--chapter', type=int, default=1)
+    definitions_parser.set_defaults(run=benchmark_definitions)
+
+    answer_counter_parser = subparsers.add_parser('answer-counter')
+    answer_counter_parser.add_argument('--choice', type=int, required=True, help='mc_choices index to increment')
+    answer_counter_parser.add_argument('--processes', type=int, default=8)
+    answer_counter_parser.add_argument('--increments', type=int, default=500)
+    answer_counter_parser.set_defaults(run=benchmark_answer_counter)
+
+    user_agent_parser = subparsers.add_parser('user-agent')
+    user_agent_parser.add_argument('--iterations', type=int, default=20000)
+    user_agent_parser.set_defaults(run=benchmark_user_agent)
+
+    user_writes_parser = subparsers.add_parser('user-writes')
+    user_writes_parser.set_defaults(run=benchmark_user_writes)
+
+    serialization_parser = subparsers.add_parser('serialization')
+    serialization_parser.add_argument('--iterations', type=int, default=20000)
+    serialization_parser.set_defaults(run=benchmark_serialization)
+
+    json_min_parser = subparsers.add_parser('json-min')
+    json_min_parser.add_argument('--iterations', type=int, default=100000)
+    json_min_parser.set_defaults(run=benchmark_json_min)
+
+    leaderboard_parser = subparsers.add_parser('leaderboard')
+    leaderboard_parser.add_argument('--iterations', type=int, default=20000)
+    leaderboard_parser.add_argument('--users', type=int, default=50000)
+    leaderboard_parser.set_defaults(run=benchmark_leaderboard)
+
+    import_parser = subparsers.add_parser('import')
+    import_parser.add_argument('--chapters', type=int, default=20)
+    import_parser.add_argument('--prompts', type=int, default=1000, help='prompts per chapter')
+    import_parser.add_argument('--correct', type=int, default=2)
+    import_parser.add_argument('--incorrect', type=int, default=6)
+    import_parser.add_argument('--legacy-chapters', type=int, default=1, help='chapters imported row by row')
+    import_parser.add_argument('--batch-size', type=int, default=200)
+    import_parser.set_defaults(run=benchmark_import)
+
+    definitions_memory_parser = subparsers.add_parser('definitions-memory')
+    definitions_memory_parser.add_argument('--megabytes', type=int, default=1024, help='size of the synthetic file')
+    definitions_memory_parser.add_argument('--path', help='existing (or where to write the) definitions file')
+    definitions_memory_parser.add_argument('--prompts', type=int, default=20000, help='prompts per chapter')
+    definitions_memory_parser.add_argument('--correct', type=int, default=2)
+    definitions_memory_parser.add_argument('--incorrect', type=int, default=6)
+    definitions_memory_parser.add_argument('--readers', default='stream,json.load')
+    definitions_memory_parser.set_defaults(run=benchmark_definitions_memory)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# shared setup for the tests in testing/, run from the repository root: python -m pytest
+#
+# the models bind to the database configured when business_objects.Models is first imported,
+# so the sqlite stand-in (as in load_test.py) is configured here, before any test imports them
+# tests that use the database need peewee 2.x and are skipped where it isn't installed
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+test_directory = tempfile.mkdtemp(prefix='exbook-tests-')
+config.database_engine = 'sqlite'
+config.database_sqlite_path = os.path.join(test_directory, 'exbook.db')
+config.database_pooled = False
+config.analytics_spill_path = os.path.join(test_directory, 'analytics-spill')
+config.metrics_directory = os.path.join(test_directory, 'metrics')
+
+
+@pytest.fixture
+def database():
+    # every model's table, created empty for each test and dropped afterwards
+    pytest.importorskip('peewee')
+    from business_objects import Models
+    from business_objects.User import User
+
+    models = [
+        Models.Chapter, Models.Classroom, Models.McPrompt, Models.McChoice, Models.Word, Models.Definition,
+        Models.CalcQuestions, Models.Location, Models.ActivityLogEntry, Models.QuestLogEntry, Models.Reward,
+        Models.CacheVersion, User
+    ]
+    Models.database.create_tables(models, safe=True)
+    yield Models.database
+    Models.database.drop_tables(models, safe=True)
+    Models.database.close()
+
+
+def synthetic_book(number_of_chapters, prompts_per_chapter, correct=1, incorrect=5):
+    return [
+        {
+            'index': chapter_index,
+            'name': 'Chapter {}'.format(chapter_index),
+            'questions': [
+                {
+                    'question_text': 'prompt {}-{}'.format(chapter_index, prompt_number),
+                    'correct_answers': ['correct {}-{}-{}'.format(chapter_index, prompt_number, number)
+                                        for number in range(correct)],
+                    'incorrect_answers': ['incorrect {}-{}-{}'.format(chapter_index, prompt_number, number)
+                                          for number in range(incorrect)]
+                }
+                for prompt_number in range(prompts_per_chapter)
+            ]
+        }
+        for chapter_index in range(1, number_of_chapters + 1)
+    ]
+
+
+@pytest.fixture
+def question_bank(database):
+    # three chapters of 20 type 1 prompts, as db_scripts/data_importer.py loads them
+    from db_scripts.question_bank_importer import QuestionBankImporter
+    from business_objects.questions.QuestionIndex import question_index
+
+    chapters = synthetic_book(3, 20)
+    QuestionBankImporter().run(chapters)
+    # the process-wide index may still hold an earlier test's bank
+    question_index.invalidate()
+    return chapters
@@ -0,0 +1,422 @@
+# load test for the /api/v1 routes: boots the flask app against a local sqlite stand-in
+# database and a stubbed auth0 tokeninfo service, replays quest sessions (status, start,
+# submits until the quest completes, daily and leaderboard) from concurrent clients and
+# reports throughput, latency percentiles and database queries per request for every route
+#
+# --engine mysql runs against the testdb schema from business_objects/Models.py instead
+# (tables are created if missing, the load test classroom and its users are reset), with the
+# connection pool or, with --no-pool, a new connection per request, connects and the time
+# spent connecting are reported per request either way
+#
+# run from the repository root: python testing/load_test.py [options]
+# --save writes the results as json, --compare fails (exit code 1) when a later run regresses
+# against such a baseline
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+CLASS_CODE = 'LOADTEST01'
+
+
+#########################################################################################
+# measurements
+#########################################################################################
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__latencies = {}
+        self.__queries = {}
+        self.__db_seconds = {}
+        self.__errors = {}
+
+    def record(self, route, latency, queries, db_seconds, ok):
+        with self.__lock:
+            self.__latencies.setdefault(route, []).append(latency)
+            self.__queries[route] = self.__queries.get(route, 0) + queries
+            self.__db_seconds[route] = self.__db_seconds.get(route, 0.0) + db_seconds
+            if not ok:
+                self.__errors[route] = self.__errors.get(route, 0) + 1
+
+    def summary(self, elapsed):
+        summary = {}
+        with self.__lock:
+            for route, latencies in sorted(self.__latencies.items()):
+                latencies = sorted(latencies)
+                summary[route] = {
+                    'requests': len(latencies),
+                    'errors': self.__errors.get(route, 0),
+                    'requests_per_second': len(latencies) / elapsed,
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p90_ms': percentile(latencies, 90) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'max_ms': latencies[-1] * 1000,
+                    'queries_per_request': self.__queries[route] / len(latencies),
+                    'db_ms_per_request': self.__db_seconds[route] / len(latencies) * 1000
+                }
+        return summary
+
+
+def percentile(sorted_values, percent):
+    # nearest rank
+    rank = max(1, int(round(percent / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class ConnectStats:
+
+    # counts database.connect() calls (a checkout with the pool, a handshake without it)
+    def __init__(self, database):
+        self.__lock = threading.Lock()
+        self.__connect = database.connect
+        self.connects = 0
+        self.seconds = 0.0
+        database.connect = self.connect
+
+    def connect(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.__connect(*args, **kwargs)
+        finally:
+            with self.__lock:
+                self.connects += 1
+                self.seconds += time.perf_counter() - start
+
+    def reset(self):
+        with self.__lock:
+            self.connects = 0
+            self.seconds = 0.0
+
+
+def server_timing_duration(header, name):
+    # 'db;dur=1.234;desc="5 queries", http;dur=0.000, ...' -> seconds for name
+    for metric in header.split(','):
+        parts = metric.strip().split(';')
+        if parts[0] == name:
+            for part in parts[1:]:
+                if part.startswith('dur='):
+                    return float(part[4:]) / 1000
+    return 0.0
+
+
+#########################################################################################
+# stand-in services
+#########################################################################################
+
+
+def make_token(user_number, with_claims):
+    import jwt
+    from rest_core import jwt_secret, jwt_audience
+
+    claims = {'aud': jwt_audience, 'iat': int(time.time())}
+    if with_claims:
+        claims.update({
+            'sub': 'google-oauth2|load-test-{}'.format(user_number),
+            'given_name': 'Load',
+            'family_name': 'Tester {}'.format(user_number),
+            'email': 'load-test-{}@example.com'.format(user_number)
+        })
+    else:
+        # only the token, identity has to come from the (stubbed) tokeninfo service
+        claims['nonce'] = str(user_number)
+    token = jwt.encode(claims, jwt_secret, algorithm='HS256')
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+def stub_token_service(latency):
+    # replaces the auth0 /tokeninfo call, the per-process token info cache in front of it stays
+    import rest_functions
+
+    def fetch_token_info(client_request):
+        token = rest_functions.get_bearer_token(client_request)
+        user_number = token_users.get(token)
+        time.sleep(latency)
+        if user_number is None:
+            return None
+        return {
+            'identities': [{'user_id': 'load-test-{}'.format(user_number)}],
+            'given_name': 'Load',
+            'family_name': 'Tester {}'.format(user_number),
+            'email': 'load-test-{}@example.com'.format(user_number)
+        }
+
+    token_users = {}
+    rest_functions.get_token_info = fetch_token_info
+    return token_users
+
+
+def seed_database(args):
+    from benchmarks import synthetic_book
+    from business_objects.Models import database, Chapter, Classroom, McPrompt, McChoice, Reward, QuestLogEntry, \
+        ActivityLogEntry, Location, CacheVersion
+    from business_objects.User import User
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db_scripts'))
+    from question_bank_importer import QuestionBankImporter
+
+    database.create_tables([
+        Chapter, Classroom, McPrompt, McChoice, User, Reward, QuestLogEntry, ActivityLogEntry, Location, CacheVersion
+    ], safe=True)
+    book = synthetic_book(args.chapters, args.prompts, correct=2, incorrect=6)
+    QuestionBankImporter().run(book['book'])
+
+    if Classroom.select().where(Classroom.class_code == CLASS_CODE).exists():
+        # an earlier run against the same (mysql) database, its users are created again
+        User.delete().where(User.class_code == CLASS_CODE).execute()
+        database.close()
+        return
+
+    Classroom.create(
+        class_code=CLASS_CODE,
+        current_chapter=1,
+        number_dailies_allowed=3,
+        max_multiplier=5,
+        daily_exp_base=30,
+        daily_point_value=10000,
+        daily_number_of_questions=args.questions,
+        registration_open=1
+    )
+    rewards_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db_scripts',
+                                'rewards.json')
+    with open(rewards_path) as rewards_file:
+        for reward in json.load(rewards_file)['rewards']:
+            Reward.create(class_code=CLASS_CODE, **reward)
+    database.close()
+
+
+#########################################################################################
+# sessions
+#########################################################################################
+
+
+class Client:
+
+    def __init__(self, app, token, stats):
+        self.__client = app.test_client()
+        self.__headers = {'Authorization': 'Bearer ' + token}
+        self.__stats = stats
+
+    def post(self, route, payload=None):
+        start = time.perf_counter()
+        response = self.__client.post(
+            route,
+            data=json.dumps(payload or {}),
+            content_type='application/json',
+            headers=self.__headers
+        )
+        latency = time.perf_counter() - start
+        ok = response.status_code == 200
+        # counted by the app itself (request_metrics.py), see config.request_metrics_header
+        queries = int(response.headers.get('X-Query-Count', 0))
+        db_seconds = server_timing_duration(response.headers.get('Server-Timing', ''), 'db')
+        self.__stats.record(route, latency, queries, db_seconds, ok)
+        if not ok:
+            return None
+        return json.loads(response.get_data())
+
+
+def run_session(client, args, session_random):
+    client.post('/api/v1/status/get')
+
+    is_daily = session_random.random() < args.daily_ratio
+    started = client.post('/api/v1/quest/start', {
+        'is_daily': is_daily,
+        'chapter_index': session_random.randint(1, args.chapters),
+        'number_of_questions': args.questions,
+        'is_timed': session_random.random() < 0.5,
+        'cumulative': False,
+        'question_type': 1
+    })
+    if started is None:
+        return False
+
+    question = started['question']
+    for _ in range(args.questions):
+        answer = session_random.choice(question['answers'])
+        submitted = client.post('/api/v1/question/submit', {
+            'user_answer': answer['index'],
+            'latitude': 44.56 + session_random.random() / 100,
+            'longitude': -123.28 + session_random.random() / 100
+        })
+        if submitted is None:
+            return False
+        if submitted['quest_complete']:
+            break
+        question = submitted['question']
+
+    client.post('/api/v1/daily/get')
+    client.post('/api/v1/leaderboard/get', {'top': 10, 'around': 5})
+    return True
+
+
+def run_user(app, token, stats, args, sessions, seed):
+    client = Client(app, token, stats)
+    session_random = random.Random(seed)
+    completed = 0
+    for _ in range(sessions):
+        if run_session(client, args, session_random):
+            completed += 1
+    return completed
+
+
+#########################################################################################
+# reporting
+#########################################################################################
+
+
+def print_summary(results):
+    print("{:<32} {:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'queries', 'db ms'))
+    for route, route_summary in results['routes'].items():
+        print("{:<32} {requests:>8} {errors:>6} {requests_per_second:>9.1f} {p50_ms:>9.1f} {p90_ms:>9.1f} "
+              "{p99_ms:>9.1f} {max_ms:>9.1f} {queries_per_request:>9.2f} {db_ms_per_request:>9.2f}".format(
+                  route, **route_summary))
+    print("{requests} requests in {seconds:.1f}s, {requests_per_second:.1f} req/s, {sessions_completed} quest "
+          "sessions".format(**results['total']))
+    print("{engine}{pool}: {connects_per_request:.2f} connects per request, {connect_ms_per_request:.2f} ms "
+          "connecting per request".format(
+              engine=results['arguments']['engine'],
+              pool=' pooled' if 'pool' in results else '',
+              **results['total']))
+    if 'pool' in results:
+        print("pool: {checkouts} checkouts, {new_connections} new connections, {timeouts} timeouts".format(
+            **results['pool']))
+
+
+def compare_results(results, baseline, tolerance):
+    regressions = []
+    for route, route_summary in results['routes'].items():
+        baseline_route = baseline['routes'].get(route)
+        if baseline_route is None:
+            continue
+        if route_summary['queries_per_request'] > baseline_route['queries_per_request'] + 0.01:
+            regressions.append('{}: {:.2f} queries per request (baseline {:.2f})'.format(
+                route, route_summary['queries_per_request'], baseline_route['queries_per_request']))
+        if route_summary['p90_ms'] > baseline_route['p90_ms'] * (1 + tolerance):
+            regressions.append('{}: p90 {:.1f} ms (baseline {:.1f} ms)'.format(
+                route, route_summary['p90_ms'], baseline_route['p90_ms']))
+        if route_summary['errors'] > baseline_route['errors']:
+            regressions.append('{}: {} errors (baseline {})'.format(
+                route, route_summary['errors'], baseline_route['errors']))
+
+    total = results['total']['requests_per_second']
+    baseline_total = baseline['total']['requests_per_second']
+    if total < baseline_total * (1 - tolerance):
+        regressions.append('throughput {:.1f} req/s (baseline {:.1f} req/s)'.format(total, baseline_total))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20, help='concurrent clients, one user each')
+    parser.add_argument('--sessions', type=int, default=5, help='quest sessions per user')
+    parser.add_argument('--questions', type=int, default=10, choices=config.number_of_question_options,
+                        help='questions per quest')
+    parser.add_argument('--daily-ratio', type=float, default=0.2, help='share of sessions that are dailies')
+    parser.add_argument('--chapters', type=int, default=5)
+    parser.add_argument('--prompts', type=int, default=200, help='prompts per chapter')
+    parser.add_argument('--identity', choices=['claims', 'tokeninfo'], default='claims',
+                        help='identify users from the jwt claims or from the stubbed tokeninfo service')
+    parser.add_argument('--tokeninfo-latency', type=float, default=50, help='stubbed tokeninfo latency in ms')
+    parser.add_argument('--engine', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--no-pool', action='store_true', help='with --engine mysql, connect on every request')
+    parser.add_argument('--database', help='sqlite file to use (default: a new temporary file)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results as json to this file')
+    parser.add_argument('--compare', help='baseline json from an earlier --save')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed latency/throughput regression')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='exbook-load-test-')
+    config.database_engine = args.engine
+    config.database_sqlite_path = args.database or os.path.join(directory, 'exbook.db')
+    config.database_pooled = not args.no_pool
+    config.multiple_choice_source = 'index'
+    config.analytics_spill_path = os.path.join(directory, 'analytics-spill')
+    config.metrics_directory = os.path.join(directory, 'metrics')
+    config.question_index_refresh_interval = 3600
+    config.request_metrics_header = True
+    config.request_metrics_log = False
+
+    # imported only now, the models bind to the database configured above
+    import logging
+    import rest_functions
+    from business_objects.Models import database
+    from rest_core import app
+
+    app.logger.setLevel(logging.WARNING)
+    seed_database(args)
+    stats = RouteStats()
+    connect_stats = ConnectStats(database)
+    token_users = stub_token_service(args.tokeninfo_latency / 1000)
+
+    # accounts are created before the clock starts and are not part of the report
+    tokens = []
+    for user_number in range(args.users):
+        token = make_token(user_number, with_claims=args.identity == 'claims')
+        token_users[token] = user_number
+        tokens.append(token)
+        created = Client(app, token, RouteStats()).post('/api/v1/account/create', {'class_code': CLASS_CODE})
+        if created is None:
+            sys.exit('could not create load test user {}'.format(user_number))
+
+    # the routes print and log every request, kept out of the report
+    connect_stats.reset()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.users) as clients:
+            completed = sum(clients.map(
+                lambda user_number: run_user(app, tokens[user_number], stats, args, args.sessions,
+                                             args.seed * 1000003 + user_number),
+                range(args.users)
+            ))
+        elapsed = time.perf_counter() - start
+        rest_functions.analytics_writer.stop()
+
+    routes = stats.summary(elapsed)
+    requests = sum(route_summary['requests'] for route_summary in routes.values())
+    results = {
+        'arguments': vars(args),
+        'routes': routes,
+        'total': {
+            'requests': requests,
+            'seconds': elapsed,
+            'requests_per_second': requests / elapsed,
+            'sessions_completed': completed,
+            'connects_per_request': connect_stats.connects / requests if requests else 0.0,
+            'connect_ms_per_request': connect_stats.seconds / requests * 1000 if requests else 0.0
+        }
+    }
+    if hasattr(database, 'get_pool_stats'):
+        results['pool'] = database.get_pool_stats()
+    print_summary(results)
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('no regressions against {}'.format(args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from cache import LruTtlCache, VersionedCache, MISSING
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LruTtlCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_expired_entries_are_misses():
+    cache = LruTtlCache(10, default_ttl=60)
+    cache.put('expired', 1, ttl=0)
+    cache.put('fresh', 2)
+
+    assert cache.get('expired') is MISSING
+    assert cache.get('fresh') == 2
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['size'] == 1
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_cached_none_is_a_hit():
+    cache = LruTtlCache(10)
+    cache.put('negative', None)
+
+    assert cache.get('negative') is None
+    assert cache.get('unknown') is MISSING
+
+
+def test_invalidate():
+    cache = LruTtlCache(10)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key)
+
+    cache.invalidate('a')
+    assert cache.get('a') is MISSING
+    assert cache.get('b') == 'b'
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
+
+
+def test_versioned_cache_reloads_when_the_version_changes():
+    version = [1]
+    loads = []
+
+    def load():
+        loads.append(version[0])
+        return 'value {}'.format(version[0])
+
+    cache = VersionedCache(load, lambda: version[0], check_interval=0)
+    assert cache.get() == 'value 1'
+    assert cache.get() == 'value 1'
+    assert loads == [1]
+
+    version[0] = 2
+    assert cache.get() == 'value 2'
+    assert loads == [1, 2]
+
+    cache.invalidate()
+    assert cache.get() == 'value 2'
+    assert loads == [1, 2, 2]
+    assert cache.stats()['reloads'] == 3
+
+
+def test_versioned_cache_checks_the_version_at_most_every_interval():
+    checks = []
+
+    def get_version():
+        checks.append(1)
+        return len(checks)
+
+    cache = VersionedCache(lambda: 'value', get_version, check_interval=3600)
+    for _ in range(5):
+        assert cache.get() == 'value'
+    assert len(checks) == 1
@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip('peewee')
+
+from config import number_of_multiple_choices
+from business_objects.Models import Chapter, Word, Definition
+from business_objects.questions.DefinitionQuestion import DefinitionQuestion
+
+
+@pytest.fixture
+def vocabulary(database):
+    # chapter 1: six words with definitions and two without (e.g. their definitions were
+    # skipped as duplicates by the loader), chapter 2: words with definitions only
+    for chapter_index in (1, 2):
+        Chapter.create(chapter_index=chapter_index, chapter_name='Chapter {}'.format(chapter_index))
+
+    defined = {}
+    for chapter_index, number_of_words in ((1, 6), (2, 5)):
+        for number in range(number_of_words):
+            word = Word.create(chapter_index=chapter_index, word='word {}.{}'.format(chapter_index, number))
+            defined[word.word_index] = ['definition {}.{}.{}'.format(chapter_index, number, definition)
+                                        for definition in range(2)]
+            for text in defined[word.word_index]:
+                Definition.create(chapter_index=chapter_index, word_index=word.word_index, definition=text)
+    for number in range(2):
+        Word.create(chapter_index=1, word='undefined {}'.format(number))
+
+    database.close()
+    return defined
+
+
+def check_question(question, defined):
+    question_json = question.get_json_min()
+    answer_indexes = [answer['index'] for answer in question.answer_choices()]
+
+    assert question_json['prompt']
+    assert question_json['chapter_index'] == question.chapter_index()
+    assert question_json['question_type'] in (0, 1)
+    # the correct answer is always among the choices, no choice repeats and every choice
+    # is a word with definitions
+    assert question.word_index() in answer_indexes
+    assert len(answer_indexes) == len(set(answer_indexes))
+    assert len(answer_indexes) == number_of_multiple_choices
+    assert set(answer_indexes) <= set(defined)
+
+    if question.question_type() == 1:
+        assert question.question_text() == Word.get(Word.word_index == question.word_index()).word
+        for answer in question.answer_choices():
+            assert answer['text'] in defined[answer['index']]
+    else:
+        assert question.question_text() in defined[question.word_index()]
+
+
+@pytest.mark.parametrize('question_type', [0, 1, 2])
+@pytest.mark.parametrize('cumulative', [False, True])
+def test_definition_questions(vocabulary, question_type, cumulative):
+    for _ in range(20):
+        question = DefinitionQuestion().make_definition_question(2, question_type=question_type,
+                                                                 cumulative=cumulative)
+        check_question(question, vocabulary)
+        if question_type in (0, 1):
+            assert question.question_type() == question_type
+
+
+def test_no_words_with_definitions(database):
+    Chapter.create(chapter_index=1, chapter_name='Chapter 1')
+    Word.create(chapter_index=1, word='undefined')
+
+    with pytest.raises(Word.DoesNotExist):
+        DefinitionQuestion().make_definition_question(1, question_type=1)
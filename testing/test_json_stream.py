@@ -0,0 +1,76 @@
+import io
+import json
+
+import pytest
+
+from db_scripts.json_stream import JsonStream, read_book_chapters
+
+
+def book_file(chapters, **extra):
+    return io.StringIO(json.dumps(dict(extra, book=chapters), indent=1))
+
+
+def read_all(source, items_key='questions'):
+    return [
+        dict(chapter, **{items_key: list(chapter[items_key])})
+        for chapter in read_book_chapters(source, items_key)
+    ]
+
+
+def test_decodes_values_spanning_chunks():
+    document = {'numbers': list(range(1000)), 'text': 'x' * 5000, 'nested': {'a': [1.5, None, True]}}
+    stream = JsonStream(io.StringIO(json.dumps(document)), chunk_size=7)
+
+    decoded = {}
+    for key in stream.iter_object():
+        decoded[key] = stream.decode_value()
+    assert decoded == document
+
+
+def test_number_at_a_chunk_boundary_is_not_cut():
+    stream = JsonStream(io.StringIO('[1234567, 89]'), chunk_size=4)
+    assert [stream.decode_value() for _ in stream.iter_array()] == [1234567, 89]
+
+
+def test_empty_containers():
+    stream = JsonStream(io.StringIO('{"a": [], "b": {}}'))
+    for key in stream.iter_object():
+        assert list(stream.iter_array() if key == 'a' else stream.iter_object()) == []
+
+
+def test_malformed_json_raises():
+    stream = JsonStream(io.StringIO('{"book": [1, 2'))
+    with pytest.raises(ValueError):
+        for key in stream.iter_object():
+            for _ in stream.iter_array():
+                stream.decode_value()
+
+
+def test_reads_chapters_like_json_load():
+    chapters = [
+        {
+            'index': chapter_index,
+            'name': 'Chapter {}'.format(chapter_index),
+            'questions': [
+                {'question_text': 'prompt {}'.format(number), 'correct_answers': ['yes'],
+                 'incorrect_answers': ['no', 'maybe']}
+                for number in range(50)
+            ]
+        }
+        for chapter_index in range(1, 4)
+    ]
+    assert read_all(book_file(chapters, version=2)) == chapters
+
+
+def test_questions_before_index_and_name_are_decoded_whole():
+    chapters = [{'questions': [{'question_text': 'first'}], 'index': 1, 'name': 'Chapter 1'}]
+    assert read_all(book_file(chapters)) == chapters
+
+
+def test_unread_questions_are_skipped():
+    chapters = [
+        {'index': number, 'name': 'Chapter {}'.format(number), 'words': ['a', 'b', 'c']}
+        for number in range(1, 4)
+    ]
+    names = [chapter['name'] for chapter in read_book_chapters(book_file(chapters), items_key='words')]
+    assert names == ['Chapter 1', 'Chapter 2', 'Chapter 3']
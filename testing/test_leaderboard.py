@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from business_objects.Leaderboard import Leaderboard, RankedSet
+
+
+def expected_rank(points, user_id):
+    return sum(1 for total_points in points.values() if total_points > points[user_id]) + 1
+
+
+def test_ranked_set_matches_a_sorted_list():
+    keys = random.sample(range(10000), 500)
+    ranked_set = RankedSet(sorted(keys[:250]))
+    for key in keys[250:]:
+        ranked_set.add(key)
+    for key in keys[:100]:
+        ranked_set.remove(key)
+
+    remaining = sorted(keys[100:])
+    assert len(ranked_set) == len(remaining)
+    assert ranked_set.slice(0, len(remaining)) == remaining
+    assert ranked_set.slice(-5, 3) == remaining[:3]
+    for position in (0, 17, len(remaining) - 1):
+        assert ranked_set.select(position) == remaining[position]
+        assert ranked_set.count_less(remaining[position]) == position
+    with pytest.raises(IndexError):
+        ranked_set.select(len(remaining))
+
+
+def test_leaderboard_matches_a_full_sort():
+    points = {'user-{}'.format(number): random.randint(0, 500) for number in range(300)}
+    leaderboard = Leaderboard(points.items())
+
+    for _ in range(1000):
+        user_id = random.choice(list(points))
+        points[user_id] += random.randint(1, 50)
+        leaderboard.update(user_id, points[user_id])
+
+    assert len(leaderboard) == len(points)
+    ranked_points = sorted(points.values(), reverse=True)
+    assert [entry['total_points'] for entry in leaderboard.get_top(10)] == ranked_points[:10]
+    for user_id in points:
+        assert leaderboard.get_rank(user_id) == expected_rank(points, user_id)
+
+
+def test_ties_share_a_rank():
+    leaderboard = Leaderboard([('a', 50), ('b', 30), ('c', 50), ('d', None)])
+
+    assert [entry['rank'] for entry in leaderboard.get_top(4)] == [1, 1, 3, 4]
+    assert leaderboard.get_rank('c') == 1
+    assert leaderboard.get_rank('b') == 3
+    assert leaderboard.get_rank('d') == 4
+    assert leaderboard.get_rank('unknown') is None
+
+
+def test_entries_mark_the_requesting_user_only():
+    leaderboard = Leaderboard([('user-{}'.format(number), number * 10) for number in range(20)])
+
+    around = leaderboard.get_around('user-10', 2)
+    assert [entry['total_points'] for entry in around] == [120, 110, 100, 90, 80]
+    assert [entry['is_me'] for entry in around] == [False, False, True, False, False]
+    assert all(set(entry) == {'rank', 'total_points', 'is_me'} for entry in around)
+
+    top = leaderboard.get_around('user-19', 2)
+    assert [entry['total_points'] for entry in top] == [190, 180, 170]
+    assert leaderboard.get_around('unknown', 2) == []
+
+
+def test_new_users_join_the_board():
+    leaderboard = Leaderboard([('a', 10)])
+    leaderboard.update('b', 20)
+
+    assert len(leaderboard) == 2
+    assert leaderboard.get_rank('b') == 1
+    assert leaderboard.get_rank('a') == 2
+
+
+def test_boards_show_the_requesting_users_saved_points(database):
+    import rest_functions
+    from business_objects import Leaderboard as leaderboard_module
+    from business_objects.User import User
+
+    for number, total_points in enumerate((100, 200, 300)):
+        User.create(user_id='user-{}'.format(number), class_code='A1B2C3D4E5', e_mail='user@example.com',
+                    reward_level=0, user_role=0, total_points=total_points)
+    leaderboard_module.leaderboards.clear()
+    rest_functions.get_leader_board(User.get(User.user_id == 'user-0'))
+
+    # points saved by other processes, this process's board was loaded before
+    User.update(total_points=400).where(User.user_id << ['user-0', 'user-1']).execute()
+    leader_board = rest_functions.get_leader_board(User.get(User.user_id == 'user-0'))
+    leaderboard_module.leaderboards.clear()
+
+    assert leader_board['my_rank'] == 1
+    # user-1's points only show up once the board is reloaded
+    assert [entry['total_points'] for entry in leader_board['top']] == [400, 300, 200]
+    assert [entry['is_me'] for entry in leader_board['top']] == [True, False, False]
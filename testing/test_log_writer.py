@@ -0,0 +1,147 @@
+import glob
+import threading
+import time
+
+from log_writer import AnalyticsWriter, CounterBuffer
+
+
+def test_counter_buffer_coalesces_increments():
+    writes = []
+    counter = CounterBuffer(writes.append)
+    for key in (5, 5, 7, 5):
+        counter.add(key)
+    counter.add(7, 3)
+
+    assert counter.pending() == 7
+    assert counter.flush()
+    assert writes == [{5: 3, 7: 4}]
+    assert counter.pending() == 0
+    # nothing pending, nothing written
+    assert counter.flush()
+    assert len(writes) == 1
+
+
+def test_counter_buffer_keeps_counts_when_the_write_fails():
+    writes = []
+    database_down = [True]
+
+    def write(counts):
+        if database_down[0]:
+            raise RuntimeError('database is down')
+        writes.append(counts)
+
+    counter = CounterBuffer(write)
+    counter.add(5, 2)
+    assert not counter.flush()
+    counter.add(5)
+    assert counter.pending() == 3
+
+    database_down[0] = False
+    assert counter.flush()
+    assert writes == [{5: 3}]
+
+
+def test_counter_buffer_loses_no_concurrent_increments():
+    totals = {}
+
+    def write(counts):
+        for key, amount in counts.items():
+            totals[key] = totals.get(key, 0) + amount
+
+    counter = CounterBuffer(write)
+
+    def add_many():
+        for number in range(2000):
+            counter.add(number % 3)
+
+    threads = [threading.Thread(target=add_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        counter.flush()
+    counter.flush()
+
+    assert sum(totals.values()) == 8000
+
+
+#########################################################################################
+# the writer against the sqlite stand-in
+#########################################################################################
+
+
+def make_writer(database, spill_path, replay_interval=3600):
+    from business_objects.Models import Location
+
+    return AnalyticsWriter(
+        database,
+        [Location],
+        batch_size=50,
+        flush_interval=0.01,
+        max_queue_size=1000,
+        enqueue_timeout=0.01,
+        spill_path=spill_path,
+        replay_interval=replay_interval
+    )
+
+
+def location_rows(number):
+    return [{'latitude': 40.0 + row, 'longitude': -105.0, 'action': 1} for row in range(number)]
+
+
+def test_rows_are_written_in_batches(database, tmp_path):
+    from business_objects.Models import Location
+
+    writer = make_writer(database, str(tmp_path / 'spill'))
+    for row in location_rows(120):
+        writer.insert(Location, row)
+    writer.stop()
+
+    assert Location.select().count() == 120
+    stats = writer.stats()
+    assert stats['written'] == 120
+    assert stats['spilled'] == 0
+    assert glob.glob(str(tmp_path / 'spill*')) == []
+
+
+def test_failed_batches_are_spilled_and_replayed(database, tmp_path):
+    from business_objects.Models import Location
+
+    spill_path = str(tmp_path / 'spill')
+    database.drop_tables([Location])
+    writer = make_writer(database, spill_path)
+    for row in location_rows(10):
+        writer.insert(Location, row)
+    writer.stop()
+    assert writer.stats()['spilled'] == 10
+    assert len(glob.glob(spill_path + '.*')) == 1
+
+    database.create_tables([Location])
+    writer = make_writer(database, spill_path, replay_interval=0)
+    writer.insert(Location, location_rows(1)[0])
+    deadline = time.monotonic() + 10
+    while writer.stats()['replayed'] < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.stop()
+
+    assert writer.stats()['replayed'] == 10
+    assert Location.select().count() == 11
+    # the claimed file is removed once its rows are in
+    assert glob.glob(spill_path + '.*') == []
+
+
+def test_spill_files_of_live_processes_are_left_alone(database, tmp_path):
+    from business_objects.Models import Location
+
+    spill_path = str(tmp_path / 'spill')
+    # pid 1 is always running
+    with open(spill_path + '.1', 'w') as spill_file:
+        spill_file.write('{"table": "locations", "row": {"latitude": 1, "longitude": 2, "action": 1}}\n')
+
+    writer = make_writer(database, spill_path, replay_interval=0)
+    writer.insert(Location, location_rows(1)[0])
+    time.sleep(0.2)
+    writer.stop()
+
+    assert writer.stats()['replayed'] == 0
+    assert Location.select().count() == 1
+    assert glob.glob(spill_path + '.*') == [spill_path + '.1']
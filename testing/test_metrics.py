@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+from metrics import MetricsRegistry, COUNTER, GAUGE, RETIRED_SNAPSHOT_NAME
+
+BUCKETS = (0.1, 1.0)
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(directory, pid, requests, latency):
+    snapshot = {
+        'pid': pid,
+        'buckets': BUCKETS,
+        'counters': [['requests_total', [['route', '/a']], requests]],
+        'gauges': [['pool_size', [], 3]],
+        'histograms': [['latency_seconds', [['route', '/a']], [1, 0], latency, 1]]
+    }
+    path = os.path.join(str(directory), 'metrics.{}.1.json'.format(pid))
+    with open(path, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    return path
+
+
+def make_registry(directory):
+    registry = MetricsRegistry(str(directory), 0, BUCKETS)
+    registry.describe('requests_total', COUNTER, 'requests')
+    registry.describe('pool_size', GAUGE, 'pool size')
+    registry.inc('requests_total', {'route': '/a'})
+    return registry
+
+
+def test_exited_processes_are_folded_into_the_retired_snapshot(tmp_path):
+    registry = make_registry(tmp_path)
+    live_path = write_snapshot(tmp_path, 1, 10, 0.05)
+    exited_path = write_snapshot(tmp_path, exited_pid(), 5, 0.02)
+
+    for _ in range(2):
+        counters, gauges, histograms = registry.collect()
+        assert counters[('requests_total', (('route', '/a'),))] == 16
+        assert histograms[('latency_seconds', (('route', '/a'),))]['count'] == 2
+        # gauges only of running processes
+        assert [key for key in gauges if key[0] == 'pool_size'] == [('pool_size', (('pid', 1),))]
+
+    assert os.path.exists(live_path)
+    assert not os.path.exists(exited_path)
+    with open(str(tmp_path / RETIRED_SNAPSHOT_NAME)) as retired_file:
+        assert json.load(retired_file)['counters'] == [['requests_total', [['route', '/a']], 5]]
+
+    # later exits add to the retired counts
+    write_snapshot(tmp_path, exited_pid(), 7, 0.02)
+    counters, _, _ = registry.collect()
+    assert counters[('requests_total', (('route', '/a'),))] == 23
+
+
+def test_folded_snapshots_left_behind_are_not_counted_twice(tmp_path):
+    registry = make_registry(tmp_path)
+    exited_path = write_snapshot(tmp_path, exited_pid(), 5, 0.02)
+    registry.collect()
+
+    # as if the last scrape stopped after writing the retired snapshot
+    write_snapshot(tmp_path, int(os.path.basename(exited_path).split('.')[1]), 5, 0.02)
+    counters, _, _ = registry.collect()
+    assert counters[('requests_total', (('route', '/a'),))] == 6
+    assert not os.path.exists(exited_path)
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip('peewee')
+
+from config import number_of_multiple_choices
+from business_objects.Models import McPrompt, McChoice
+from business_objects.questions import MultipleChoiceQuestion as multiple_choice_module
+from business_objects.questions.MultipleChoiceQuestion import MultipleChoiceQuestion, encode_question_queue, \
+    decode_question_queue
+
+
+@pytest.fixture(params=['index', 'batched', 'query'])
+def source(request, monkeypatch, question_bank):
+    monkeypatch.setattr(multiple_choice_module, 'multiple_choice_source', request.param)
+    return request.param
+
+
+def check_question(question, chapter_index):
+    prompt = McPrompt.get(McPrompt.index == question.get_question_index())
+    answer_indexes = [answer['index'] for answer in question.answer_choices()]
+    choices = {choice.index: choice for choice in McChoice.select().where(McChoice.index << answer_indexes)}
+
+    assert prompt.chapter_index_id == chapter_index
+    assert question.question_text() == prompt.text
+    assert len(answer_indexes) == len(set(answer_indexes)) == number_of_multiple_choices
+    assert all(choices[index].question_index_id == prompt.index for index in answer_indexes)
+    assert [index for index in answer_indexes if choices[index].correct] == [question.get_correct_answer_index()]
+    assert [answer['text'] for answer in question.answer_choices()] == [choices[index].text for index in answer_indexes]
+
+
+def test_make_multiple_choice(source):
+    for _ in range(10):
+        question = MultipleChoiceQuestion().make_multiple_choice(3, question_type=1)
+        check_question(question, 3)
+        assert question.get_json_min()['chapter_index'] == 3
+
+
+def test_excluded_prompts_are_not_picked(source):
+    chapter_prompts = [prompt.index for prompt in McPrompt.select().where(McPrompt.chapter_index == 1)]
+    exclude = set(chapter_prompts[1:])
+    for _ in range(5):
+        question = MultipleChoiceQuestion().make_multiple_choice(1, question_type=1, exclude=exclude)
+        assert question.get_question_index() == chapter_prompts[0]
+
+
+def test_question_queue_round_trip(source):
+    entries = MultipleChoiceQuestion().make_question_queue(2, 25, question_type=1)
+    assert decode_question_queue(encode_question_queue(entries)) == entries
+
+    # more questions than the chapter's 20 prompts: every prompt is used before one repeats
+    assert len(entries) == 25
+    assert len(set(entry[0] for entry in entries)) == 20
+
+    for entry in entries:
+        question = MultipleChoiceQuestion().load_queued_question(2, entry)
+        check_question(question, 2)
+        assert question.get_queue_entry() == entry
+
+
+def test_unknown_chapter(source):
+    with pytest.raises((McPrompt.DoesNotExist, McChoice.DoesNotExist)):
+        MultipleChoiceQuestion().make_multiple_choice(9, question_type=1)
@@ -0,0 +1,63 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip('peewee')
+
+from conftest import synthetic_book
+from business_objects.Models import Chapter, McPrompt, McChoice
+from db_scripts.json_stream import read_book_chapters
+from db_scripts.question_bank_importer import QuestionBankImporter
+
+
+def test_imports_every_row_in_batches(database):
+    stats = QuestionBankImporter(batch_size=7).run(synthetic_book(3, 10, correct=2, incorrect=4))
+
+    assert (stats['chapters'], stats['prompts'], stats['choices']) == (3, 30, 180)
+    assert stats['inserted'] == 213
+    assert McPrompt.select().count() == 30
+    assert McChoice.select().where(McChoice.correct == True).count() == 60
+    # prompt indexes are handed out in file order
+    assert [prompt.text for prompt in McPrompt.select().order_by(McPrompt.index).limit(2)] == [
+        'prompt 1-0', 'prompt 1-1']
+
+
+def test_reimport_is_idempotent(database):
+    chapters = synthetic_book(2, 10)
+    QuestionBankImporter().run(chapters)
+
+    stats = QuestionBankImporter().run(chapters)
+    assert stats['inserted'] == 0
+    assert stats['updated'] == 0
+    assert McPrompt.select().count() == 20
+    assert McChoice.select().count() == 120
+
+
+def test_changed_rows_are_updated_in_place(database):
+    chapters = synthetic_book(2, 5)
+    QuestionBankImporter().run(chapters)
+    choice_ids = [choice.index for choice in McChoice.select().order_by(McChoice.index)]
+
+    chapters[0]['name'] = 'Renamed chapter'
+    question = chapters[0]['questions'][0]
+    moved_answer = question['incorrect_answers'].pop()
+    question['correct_answers'].append(moved_answer)
+    chapters[1]['questions'].append({'question_text': 'new prompt', 'correct_answers': ['new'],
+                                     'incorrect_answers': []})
+    stats = QuestionBankImporter().run(chapters)
+
+    assert stats['updated'] == 2
+    assert (stats['prompts'], stats['choices']) == (1, 1)
+    assert Chapter.get(Chapter.chapter_index == 1).chapter_name == 'Renamed chapter'
+    assert McChoice.get(McChoice.text == moved_answer).correct
+    assert [choice.index for choice in McChoice.select().order_by(McChoice.index)][:-1] == choice_ids
+    assert McPrompt.get(McPrompt.text == 'new prompt').chapter_index_id == 2
+
+
+def test_imports_from_the_streaming_reader(database):
+    chapters = synthetic_book(3, 10)
+    definitions_file = io.StringIO(json.dumps({'book': chapters}))
+
+    stats = QuestionBankImporter(batch_size=5).run(read_book_chapters(definitions_file))
+    assert (stats['chapters'], stats['prompts'], stats['choices']) == (3, 30, 180)
@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip('peewee')
+
+from business_objects.Models import McPrompt, McChoice, CacheVersion
+from business_objects.questions.QuestionIndex import QuestionIndex, question_index
+
+PROMPT_ROWS = [
+    # prompt_index, chapter_index, type, text
+    (1, 1, 1, 'one'),
+    (2, 1, 1, 'two'),
+    (3, 1, 0, 'three'),
+    (4, 2, 1, 'four'),
+    (5, 2, 1, 'no correct answer')
+]
+
+CHOICE_ROWS = [
+    # choice_index, prompt_index, correct
+    (10, 1, True), (11, 1, False), (12, 1, False), (13, 1, False),
+    (20, 2, True), (21, 2, True), (22, 2, False),
+    (30, 3, True),
+    (40, 4, True), (41, 4, False),
+    (50, 5, False)
+]
+
+
+def loaded_index():
+    index = QuestionIndex()
+    index.load(PROMPT_ROWS, CHOICE_ROWS)
+    return index
+
+
+def test_groups_by_chapter_and_type():
+    groups = QuestionIndex.build_groups(PROMPT_ROWS, CHOICE_ROWS)
+
+    assert sorted(groups) == [(1, 0), (1, 1), (2, 1)]
+    assert sorted(groups[(1, 1)]) == [(1, 'one', (10,), (11, 12, 13)), (2, 'two', (20, 21), (22,))]
+    # a prompt without a correct answer is left out
+    assert groups[(2, 1)] == [(4, 'four', (40,), (41,))]
+    assert loaded_index().size() == 4
+
+
+def test_pick_returns_the_first_correct_choice_and_distinct_distractors():
+    index = loaded_index()
+    for _ in range(50):
+        prompt_index, text, correct_id, distractor_ids = index.pick(1, 1, 2)
+        assert (prompt_index, text) in ((1, 'one'), (2, 'two'))
+        assert correct_id == {1: 10, 2: 20}[prompt_index]
+        assert len(distractor_ids) == len(set(distractor_ids)) == {1: 2, 2: 1}[prompt_index]
+        assert set(distractor_ids) <= {1: {11, 12, 13}, 2: {22}}[prompt_index]
+
+
+def test_pick_avoids_excluded_prompts_until_the_group_is_used_up():
+    index = loaded_index()
+    for _ in range(50):
+        assert index.pick(1, 1, 3, exclude={1})[0] == 2
+    assert index.pick(1, 1, 3, exclude={1, 2})[0] in (1, 2)
+
+
+def test_pick_from_an_empty_group():
+    with pytest.raises(McPrompt.DoesNotExist):
+        loaded_index().pick(3, 1, 3)
+
+
+def test_refresh_loads_and_reloads_the_bank(question_bank):
+    question_index.refresh()
+    assert question_index.size() == 60
+
+    prompt = McPrompt.create(index=1000, chapter_index=1, text='added', type=1)
+    McChoice.create(question_index=prompt.index, text='added correct', correct=True)
+    # within the refresh interval the bank isn't looked at
+    question_index.refresh()
+    assert question_index.size() == 60
+
+    question_index.invalidate()
+    question_index.refresh()
+    assert question_index.size() == 61
+
+
+def test_version_bump_reloads_in_place_changes(question_bank):
+    question_index.refresh()
+    prompt_index, _, correct_id, _ = question_index.pick(2, 1, 3)
+
+    # same counts and ids, so only the version stamp tells the bank changed
+    McChoice.update(correct=False).where(McChoice.question_index == prompt_index).execute()
+    CacheVersion.bump('question_bank')
+    question_index.invalidate()
+    question_index.refresh()
+
+    assert question_index.size() == 59
+    for _ in range(50):
+        assert question_index.pick(2, 1, 3)[0] != prompt_index
@@ -0,0 +1,40 @@
+import json
+import time
+
+import pytest
+
+pytest.importorskip('peewee')
+pytest.importorskip('flask')
+jwt = pytest.importorskip('jwt')
+
+import rest_core
+
+
+def auth_header(subject):
+    token = jwt.encode({'aud': rest_core.jwt_audience, 'iat': int(time.time()), 'sub': subject},
+                       rest_core.jwt_secret, algorithm='HS256')
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    return {'Authorization': 'Bearer ' + token}
+
+
+def test_set_chapter_without_a_user_is_forbidden(database):
+    # before_request opens the request's own connection
+    database.close()
+    client = rest_core.app.test_client()
+    response = client.post('/api/v1/current_chapter/set', data=json.dumps({'chapter_index': 1}),
+                           content_type='application/json', headers=auth_header('auth0|nobody'))
+
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize('debug', [False, True])
+def test_metrics_headers_follow_debug(database, monkeypatch, debug):
+    database.close()
+    monkeypatch.setattr(rest_core, 'request_metrics_header', None)
+    monkeypatch.setattr(rest_core.app, 'debug', debug)
+    response = rest_core.app.test_client().post('/api/v1/current_chapter/set', data=json.dumps({'chapter_index': 1}),
+                                                content_type='application/json', headers=auth_header('auth0|nobody'))
+
+    assert ('X-Query-Count' in response.headers) == debug
+    assert ('Server-Timing' in response.headers) == debug
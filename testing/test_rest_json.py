@@ -0,0 +1,38 @@
+import datetime
+import json
+
+import pytest
+
+import rest_json
+
+PAYLOAD = {
+    'user': {'user_id': '1', 'total_points': 120, 'datetime_quest_started': datetime.datetime(2017, 9, 1, 12, 30)},
+    'quest_options': {'chapter_options': [{'chapter_index': 1, 'chapter_name': 'Chapter 1'}],
+                      'number_of_questions_options': [10, 25, 50]},
+    'rewards': [{'required_points': 20000, 'reward_name': 'Milestone 1'}]
+}
+
+
+@pytest.fixture(params=sorted(rest_json.json_encoders))
+def encoder(request):
+    rest_json.use_json_encoder(request.param)
+    yield request.param
+    rest_json.use_json_encoder(rest_json.config.json_encoder)
+
+
+def test_pre_encoded_parts_encode_like_the_plain_payload(encoder):
+    pre_encoded = dict(PAYLOAD, quest_options=rest_json.pre_encode_json(PAYLOAD['quest_options']),
+                       rewards=rest_json.pre_encode_json(PAYLOAD['rewards']))
+
+    encoded = json.loads(rest_json.encode_json_response(pre_encoded).decode('utf-8'))
+    assert encoded == json.loads(rest_json.encode_json_response(PAYLOAD).decode('utf-8'))
+    assert encoded['user']['datetime_quest_started'] == 'Fri, 01 Sep 2017 12:30:00 GMT'
+
+
+def test_only_the_stdlib_encoder_splices(encoder):
+    pre_encoded = rest_json.pre_encode_json(PAYLOAD['rewards'])
+    if encoder == 'stdlib':
+        assert isinstance(pre_encoded, rest_json.PreEncodedJson)
+        assert pre_encoded.encoded == b'[{"required_points":20000,"reward_name":"Milestone 1"}]'
+    else:
+        assert pre_encoded is PAYLOAD['rewards']
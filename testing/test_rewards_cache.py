@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+pytest.importorskip('peewee')
+
+import rest_functions
+import rest_json
+from business_objects.Models import Reward, CacheVersion
+
+
+class StubUser:
+    class_code_id = 'A1B2C3D4E5'
+
+
+@pytest.fixture(params=sorted(rest_json.json_encoders))
+def encoder(request, database):
+    # the caches encode when they load, so each encoder starts from empty caches
+    rest_json.use_json_encoder(request.param)
+    rest_functions.rewards_caches.clear()
+    yield request.param
+    rest_functions.rewards_caches.clear()
+    rest_json.use_json_encoder(rest_json.config.json_encoder)
+
+
+def create_rewards(number):
+    for reward_number in range(1, number + 1):
+        Reward.create(class_code=StubUser.class_code_id, id=reward_number, required_points=1000 * reward_number,
+                      reward_name='Milestone {}'.format(reward_number), reward_description='bonus')
+
+
+def test_rewards_json_encodes_like_the_rewards(encoder):
+    create_rewards(3)
+    rewards = rest_functions.get_rewards(StubUser())
+    rewards_json = rest_functions.get_rewards_json(StubUser())
+
+    assert [reward['reward_name'] for reward in rewards] == ['Milestone 1', 'Milestone 2', 'Milestone 3']
+    if encoder == 'stdlib':
+        assert isinstance(rewards_json, rest_json.PreEncodedJson)
+    else:
+        # orjson encodes the plain list with the rest of the response
+        assert rewards_json is rewards
+    response = json.loads(rest_json.encode_json_response({'rewards': rewards_json}).decode('utf-8'))
+    assert response['rewards'] == rewards
+
+
+def test_rewards_reload_when_the_version_is_bumped(encoder, monkeypatch):
+    monkeypatch.setattr(rest_functions.config, 'cache_version_check_interval', 0)
+    create_rewards(1)
+    assert rest_functions.get_rewards(StubUser())[0]['reward_name'] == 'Milestone 1'
+
+    Reward.update(reward_name='Renamed').where(Reward.id == 1).execute()
+    assert rest_functions.get_rewards(StubUser())[0]['reward_name'] == 'Milestone 1'
+    CacheVersion.bump(rest_functions.rewards_version_name(StubUser.class_code_id))
+    assert rest_functions.get_rewards(StubUser())[0]['reward_name'] == 'Renamed'
+    rewards_json = rest_functions.get_rewards_json(StubUser())
+    assert b'"Renamed"' in rest_json.encode_json_response({'rewards': rewards_json})
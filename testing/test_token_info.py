@@ -0,0 +1,125 @@
+import base64
+import json
+import time
+
+import pytest
+
+pytest.importorskip('peewee')
+
+import rest_functions
+
+
+class StubRequest:
+    def __init__(self, token):
+        self.headers = {'authorization': 'Bearer ' + token}
+
+
+def make_token(claims):
+    # only the payload is read, the signature was checked by requires_auth already
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode('utf-8')).decode('utf-8').rstrip('=')
+    return 'header.{}.signature'.format(payload)
+
+
+@pytest.fixture
+def tokeninfo(monkeypatch):
+    # stands in for auth0 /tokeninfo, counts the calls that would have gone out
+    calls = []
+    responses = {}
+
+    def get_token_info(client_request):
+        token = rest_functions.get_bearer_token(client_request)
+        calls.append(token)
+        return responses.get(token)
+
+    monkeypatch.setattr(rest_functions, 'get_token_info', get_token_info)
+    rest_functions.token_info_cache.invalidate()
+    yield calls, responses
+    rest_functions.token_info_cache.invalidate()
+
+
+def token_info_for(user_id):
+    return {'identities': [{'user_id': user_id}], 'given_name': 'Ada', 'email': 'ada@example.com'}
+
+
+def test_lookups_are_cached_per_token(tokeninfo):
+    calls, responses = tokeninfo
+    first_token = make_token({'sub': 'auth0|1', 'exp': time.time() + 600})
+    second_token = make_token({'sub': 'auth0|2', 'exp': time.time() + 600})
+    responses[first_token] = token_info_for('1')
+    responses[second_token] = token_info_for('2')
+
+    for _ in range(3):
+        assert rest_functions.get_cached_token_info(StubRequest(first_token)) == token_info_for('1')
+        assert rest_functions.get_cached_token_info(StubRequest(second_token)) == token_info_for('2')
+    assert calls == [first_token, second_token]
+
+
+def test_expired_tokens_are_not_cached(tokeninfo):
+    calls, responses = tokeninfo
+    token = make_token({'sub': 'auth0|1', 'exp': time.time() - 1})
+    responses[token] = token_info_for('1')
+
+    for _ in range(2):
+        assert rest_functions.get_cached_token_info(StubRequest(token)) == token_info_for('1')
+    assert len(calls) == 2
+
+
+def test_failed_lookups_are_negatively_cached(tokeninfo):
+    calls, responses = tokeninfo
+    token = make_token({'sub': 'auth0|1'})
+    responses[token] = {'error': 'invalid_token'}
+
+    assert rest_functions.get_cached_token_info(StubRequest(token)) is None
+    assert rest_functions.get_cached_token_info(StubRequest(token)) is None
+    assert len(calls) == 1
+
+
+def test_negative_entries_expire(tokeninfo, monkeypatch):
+    calls, responses = tokeninfo
+    monkeypatch.setattr(rest_functions.config, 'token_info_negative_ttl', 0)
+    token = make_token({'sub': 'auth0|1'})
+
+    assert rest_functions.get_cached_token_info(StubRequest(token)) is None
+    responses[token] = token_info_for('1')
+    assert rest_functions.get_cached_token_info(StubRequest(token)) == token_info_for('1')
+    assert len(calls) == 2
+
+
+def test_identity_prefers_jwt_claims(tokeninfo):
+    calls, responses = tokeninfo
+    token = make_token({'sub': 'auth0|1'})
+    responses[token] = token_info_for('1')
+    claims = {'sub': 'google-oauth2|110169484474386276334', 'given_name': 'Ada', 'email': 'ada@example.com'}
+
+    identity = rest_functions.get_user_identity(StubRequest(token), claims)
+    assert identity['user_id'] == '110169484474386276334'
+    assert calls == []
+
+    assert rest_functions.get_user_identity(StubRequest(token), None)['user_id'] == '1'
+    assert calls == [token]
+
+
+def test_request_user_resolves_the_identity_once(tokeninfo):
+    calls, responses = tokeninfo
+    token = make_token({'sub': 'auth0|1'})
+    responses[token] = token_info_for('1')
+    request_user = rest_functions.RequestUserLoader(StubRequest(token), {'sub': 'auth0|1'})
+
+    # create-account asks for the full identity first, the claims hold no names so tokeninfo answers
+    assert request_user.get_identity(('user_id', 'given_name', 'family_name', 'email'))['user_id'] == '1'
+    assert request_user.get_identity()['user_id'] == '1'
+    assert request_user.get_identity(('user_id', 'email'))['email'] == 'ada@example.com'
+    assert calls == [token]
+
+
+def test_request_user_resolves_again_for_more_fields(tokeninfo):
+    calls, responses = tokeninfo
+    token = make_token({'sub': 'auth0|1'})
+    responses[token] = token_info_for('1')
+    rest_functions.token_info_cache.invalidate()
+    request_user = rest_functions.RequestUserLoader(StubRequest(token), {'sub': 'auth0|1'})
+
+    assert request_user.get_identity()['email'] is None
+    assert calls == []
+    assert request_user.get_identity(('user_id', 'email'))['email'] == 'ada@example.com'
+    assert calls == [token]
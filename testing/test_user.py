@@ -0,0 +1,152 @@
+import datetime
+
+import pytest
+
+pytest.importorskip('peewee')
+
+from business_objects.Models import Classroom, McChoice, QuestLogEntry
+from business_objects.User import User
+from business_objects.questions.MultipleChoiceQuestion import decode_question_queue
+
+
+class StubRequest:
+    def __init__(self, client_choices):
+        self.json = client_choices
+
+
+def practice_choices(number_of_questions=10):
+    return {
+        'is_daily': False,
+        'chapter_index': 2,
+        'is_timed': False,
+        'number_of_questions': number_of_questions,
+        'cumulative': False,
+        'question_type': 1
+    }
+
+
+@pytest.fixture
+def user_id(question_bank):
+    Classroom.create(class_code='A1B2C3D4E5', current_chapter=1, daily_exp_base=2, max_multiplier=5,
+                     number_dailies_allowed=3, daily_point_value=100, daily_number_of_questions=10,
+                     registration_open=1)
+    User.create(user_id='110169484474386276334', class_code='A1B2C3D4E5', e_mail='ada@example.com',
+                reward_level=0, user_role=0, total_points=100, current_progress=0, multiplier=1,
+                number_correct=0, points_earned_current_quest=0)
+    return '110169484474386276334'
+
+
+def test_save_writes_only_changed_columns(user_id):
+    # two requests of the same user that change different columns
+    first = User.get(User.user_id == user_id)
+    second = User.get(User.user_id == user_id)
+    first.total_points = 150
+    first.save()
+    second.current_progress = 3
+    second.save()
+
+    user = User.get(User.user_id == user_id)
+    assert (user.total_points, user.current_progress) == (150, 3)
+
+
+def test_save_without_changes_writes_nothing(user_id, database, monkeypatch):
+    user = User.get(User.user_id == user_id)
+    statements = []
+    execute_sql = database.execute_sql
+
+    def recording_execute_sql(sql, *args, **kwargs):
+        statements.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    monkeypatch.setattr(database, 'execute_sql', recording_execute_sql)
+    user.save()
+    user.total_points += 10
+    user.save()
+
+    assert len(statements) == 1
+    assert statements[0].startswith('UPDATE') and '"total_points"' in statements[0]
+    assert '"e_mail"' not in statements[0]
+
+
+def test_get_json_min_leaves_the_user_clean(user_id):
+    user = User.get(User.user_id == user_id)
+    data = dict(user._data)
+    user_json = user.get_json_min()
+
+    assert user._data == data
+    assert not user.is_dirty()
+    assert not set(user_json) & set(User.json_excluded_fields)
+    assert user_json['total_points'] == 100
+
+
+def test_quest_length_must_be_an_offered_option(user_id):
+    user = User.get(User.user_id == user_id)
+    with pytest.raises(ValueError):
+        user.start_new_quest(StubRequest(practice_choices(number_of_questions=100000)), user.get_classroom())
+    assert user.question_queue is None
+
+
+def test_quest_serves_its_queued_questions(user_id):
+    user = User.get(User.user_id == user_id)
+    user.start_new_quest(StubRequest(practice_choices()), user.get_classroom())
+    user.save()
+
+    question_queue = decode_question_queue(User.get(User.user_id == user_id).question_queue)
+    assert len(question_queue) == 10
+    assert len(set(entry[0] for entry in question_queue)) == 10
+
+    for prompt_index, correct_index, choice_ids in question_queue:
+        question = user.start_new_question()
+        assert question.get_question_index() == prompt_index
+        assert user.current_answer_index == correct_index
+        assert [answer['index'] for answer in question.answer_choices()] == choice_ids
+        user.update_quest_progress()
+
+
+def test_queued_question_with_a_removed_choice_is_regenerated(user_id):
+    user = User.get(User.user_id == user_id)
+    user.start_new_quest(StubRequest(practice_choices()), user.get_classroom())
+    _, _, choice_ids = decode_question_queue(user.question_queue)[0]
+    McChoice.delete().where(McChoice.index == choice_ids[-1]).execute()
+
+    question = user.start_new_question()
+    answer_indexes = [answer['index'] for answer in question.answer_choices()]
+    assert choice_ids[-1] not in answer_indexes
+    assert McChoice.select().where(McChoice.index << answer_indexes).count() == len(answer_indexes)
+    assert user.current_answer_index in answer_indexes
+
+
+def test_dailies_complete_is_counted_without_writing(user_id, database, monkeypatch):
+    now = datetime.datetime.now()
+    for number in range(2):
+        QuestLogEntry.create(id=number + 1, user_id=user_id, is_daily=1, cumulative=1, number_correct=5,
+                             number_of_questions=10, datetime_quest_started=now, datetime_quest_completed=now)
+    user = User.get(User.user_id == user_id)
+    statements = []
+    execute_sql = database.execute_sql
+
+    def recording_execute_sql(sql, *args, **kwargs):
+        statements.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    # a user whose counter was never set, as on /daily/get
+    monkeypatch.setattr(database, 'execute_sql', recording_execute_sql)
+    assert user.get_dailies_complete() == 2
+    assert all(statement.startswith('SELECT') for statement in statements)
+    assert not user.is_dirty()
+
+    user.record_daily_completion()
+    user.save()
+    user = User.get(User.user_id == user_id)
+    assert (user.dailies_complete_count, user.dailies_complete_date) == (3, datetime.date.today())
+    assert user.get_dailies_complete() == 3
+
+
+def test_dailies_complete_on_another_day(user_id):
+    user = User.get(User.user_id == user_id)
+    user.dailies_complete_count = 3
+    user.dailies_complete_date = datetime.date.today() - datetime.timedelta(days=1)
+    assert user.get_dailies_complete() == 0
+
+    user.record_daily_completion()
+    assert (user.dailies_complete_count, user.dailies_complete_date) == (1, datetime.date.today())